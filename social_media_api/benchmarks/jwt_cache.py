@@ -0,0 +1,56 @@
+# Compares bearer token verification with and without security.token_cache.
+#
+# Request traffic is simulated as a Zipf distribution over the active users:
+# a few heavy users send most requests, each reusing one access token.
+#
+#   python -m social_media_api.benchmarks.jwt_cache --users 1000 --requests 50000
+import argparse
+import random
+import time
+
+from social_media_api import security
+
+
+def zipf_weights(n: int, s: float) -> list[float]:
+    return [1 / (rank**s) for rank in range(1, n + 1)]
+
+
+def run(tokens: list[str], requests: list[int], cache_size: int) -> float:
+    security.token_cache.clear()
+    security.token_cache.max_size = cache_size
+    start = time.perf_counter()
+    for i in requests:
+        security.get_subject_for_token_type(tokens[i], "access")
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="JWT verification cache benchmark")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=50_000)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    tokens = [
+        security.create_access_token(f"user{i}@example.net") for i in range(args.users)
+    ]
+    requests = random.choices(
+        range(args.users), weights=zipf_weights(args.users, args.zipf), k=args.requests
+    )
+    max_size = security.token_cache.max_size
+
+    # max_size=0 evicts every entry right away, i.e. a jwt.decode per request
+    uncached = run(tokens, requests, cache_size=0)
+    cached = run(tokens, requests, cache_size=max_size)
+
+    print(f"{args.requests} requests from {args.users} users (zipf s={args.zipf})")
+    for name, elapsed in (("jwt.decode", uncached), ("token_cache", cached)):
+        per_request = elapsed / args.requests * 1e6
+        print(f"{name:>12}: {elapsed:.3f}s total, {per_request:.1f}us/request")
+    print(f"     speedup: {uncached / cached:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Compares CPU time per feed response: FastAPI's response_model validation of
+# the Records (what GET /post did before) against serializers.py.
+#
+# Rows come from a real (in-memory sqlite) query so both paths see the same
+# Record objects the endpoints get.
+#
+#   python -m social_media_api.benchmarks.serialization --rows 100 1000
+import argparse
+import asyncio
+import time
+
+from databases import Database
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.schema import CreateTable
+
+from social_media_api.database import posts
+from social_media_api.models.post import UserPostWithLikes
+from social_media_api.routers.post import select_post_and_likes
+from social_media_api.serializers import dumps, serialize_post
+
+response_field = create_model_field(
+    "Response_get_all_posts", list[UserPostWithLikes], mode="serialization"
+)
+
+
+async def fetch_rows(count: int) -> list:
+    # force_rollback pins one connection, every :memory: connection is its own db
+    database = Database("sqlite:///:memory:", force_rollback=True)
+    await database.connect()
+    try:
+        await database.execute(
+            str(CreateTable(posts).compile(dialect=sqlite.dialect()))
+        )
+        await database.execute(
+            posts.insert().values(
+                [
+                    {
+                        "body": f"Post number {i} " * 4,
+                        "user_id": i % 50 + 1,
+                        "image_url": f"https://example.net/{i}.jpg" if i % 3 else None,
+                        "like_count": i * 7 % 101,
+                    }
+                    for i in range(count)
+                ]
+            )
+        )
+        return await database.fetch_all(select_post_and_likes)
+    finally:
+        await database.disconnect()
+
+
+async def validated(rows: list) -> bytes:
+    return await serialize_response(
+        field=response_field, response_content=rows, dump_json=True
+    )
+
+
+async def fast(rows: list) -> bytes:
+    return dumps(serialize_post.many(rows))
+
+
+async def cpu_per_request(render, rows: list, requests: int) -> float:
+    start = time.process_time()
+    for _ in range(requests):
+        await render(rows)
+    return (time.process_time() - start) / requests
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Feed serialization benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    for count in args.rows:
+        rows = await fetch_rows(count)
+        assert await validated(rows) == await fast(rows)
+
+        before = await cpu_per_request(validated, rows, args.requests)
+        after = await cpu_per_request(fast, rows, args.requests)
+        print(f"{count} rows, CPU per response:")
+        for name, elapsed in (("response_model", before), ("serializers", after)):
+            print(f"{name:>16}: {elapsed * 1e6:.0f}us")
+        print(f"{'speedup':>16}: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+# Throughput of the streaming upload path (uploads.stream_upload) without B2:
+# run it against the memory or local storage backend to see what the app
+# itself costs per uploaded MB (hashing, part splitting, thread hand-offs,
+# writes), independent of the network.
+#
+#   STORAGE_BACKEND=memory python -m social_media_api.benchmarks.uploads
+#   STORAGE_BACKEND=local STORAGE_LOCAL_ROOT=/tmp/media \
+#       python -m social_media_api.benchmarks.uploads --size-mb 256
+#
+# Needs DATABASE_URL like the app, uploaded files are recorded there.
+import argparse
+import asyncio
+import os
+import time
+
+from social_media_api.config import settings
+from social_media_api.database import database
+from social_media_api.migrations import run_migrations
+from social_media_api.uploads import stream_upload
+
+CHUNK = 64 * 1024
+
+
+async def body(data: bytes):
+    # chunked like a request body arrives
+    for start in range(0, len(data), CHUNK):
+        yield data[start : start + CHUNK]
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Streaming upload benchmark")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--uploads", type=int, default=5)
+    parser.add_argument("--part-size-mb", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    run_migrations()
+    await database.connect()
+    try:
+        data = bytearray(os.urandom(args.size_mb * 1024 * 1024))
+        elapsed = []
+        for i in range(args.uploads):
+            # a different file every time, or deduplication skips the work
+            data[:8] = i.to_bytes(8, "big")
+            start = time.perf_counter()
+            await stream_upload(
+                body(bytes(data)),
+                f"bench-{i}.bin",
+                part_size=args.part_size_mb * 1024 * 1024,
+                concurrency=args.concurrency,
+            )
+            elapsed.append(time.perf_counter() - start)
+    finally:
+        await database.disconnect()
+
+    best = min(elapsed)
+    print(f"{settings.storage_backend} backend, {args.size_mb} MB per upload:")
+    print(f"{'best':>8}: {best * 1000:.0f}ms, {args.size_mb / best:.0f} MB/s")
+    mean = sum(elapsed) / len(elapsed)
+    print(f"{'mean':>8}: {mean * 1000:.0f}ms, {args.size_mb / mean:.0f} MB/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Optional
+
+from social_media_api import metrics
+from social_media_api.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    # bounded LRU where every entry also expires after its ttl (seconds)
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CacheBackend(ABC):
+    # values must be JSON serializable so any backend can store them
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: float) -> None: ...
+
+    @abstractmethod
+    async def delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    async def clear(self) -> None: ...
+
+
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self, max_size: int):
+        self._cache = TTLCache(max_size=max_size, ttl=0)
+
+    async def get(self, key: str) -> Optional[Any]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self._cache.set(key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        self._cache.delete(key)
+
+    async def clear(self) -> None:
+        self._cache.clear()
+
+
+class RedisCacheBackend(CacheBackend):
+    # shared between workers/hosts, needs the optional `redis` package
+    def __init__(self, url: str, prefix: str):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self._redis.get(self._prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        await self._redis.set(
+            self._prefix + key, json.dumps(value), px=max(int(ttl * 1000), 1)
+        )
+
+    async def delete(self, key: str) -> None:
+        await self._redis.delete(self._prefix + key)
+
+    async def clear(self) -> None:
+        async for key in self._redis.scan_iter(match=self._prefix + "*"):
+            await self._redis.delete(key)
+
+
+def create_cache_backend(name: str, max_size: int) -> CacheBackend:
+    if settings.cache_redis_url:
+        return RedisCacheBackend(
+            settings.cache_redis_url, prefix=f"social_media_api:{name}:"
+        )
+    return MemoryCacheBackend(max_size=max_size)
+
+
+class Cache:
+    # a named cache with hit/miss counters, e.g. cache.user.hits
+    def __init__(self, name: str, ttl: float, max_size: int):
+        self.name = name
+        self.ttl = ttl
+        self.backend = create_cache_backend(name, max_size)
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = await self.backend.get(key)
+        outcome = "misses" if value is None else "hits"
+        metrics.increment(f"cache.{self.name}.{outcome}")
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await self.backend.set(key, value, self.ttl if ttl is None else ttl)
+
+    async def delete(self, key: str) -> None:
+        metrics.increment(f"cache.{self.name}.invalidations")
+        await self.backend.delete(key)
+
+    async def clear(self) -> None:
+        await self.backend.clear()
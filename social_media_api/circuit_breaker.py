@@ -0,0 +1,107 @@
+# Fail fast while an external service is down.
+#
+# After failure_threshold failures in a row the breaker opens: calls raise
+# CircuitOpenError right away instead of waiting on a timeout. After
+# reset_timeout it goes half-open and lets a single probe call through; if that
+# succeeds the breaker closes again, if it fails it stays open for another
+# reset_timeout.
+#
+# On /metrics: circuit.<name>.state (0 closed, 1 half-open, 2 open),
+# circuit.<name>.opened and circuit.<name>.rejected.
+import logging
+import time
+from typing import Awaitable, Callable, TypeVar
+
+from social_media_api import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_timeout: float,
+        failure_exceptions: tuple[type[BaseException], ...] = (Exception,),
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failure_exceptions = failure_exceptions
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+        metrics.register_gauge(
+            f"circuit.{name}.state", lambda: STATE_VALUES[self.state]
+        )
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def _admit(self) -> bool:
+        # returns whether this call is the half-open probe
+        state = self.state
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        metrics.increment(f"circuit.{self.name}.rejected")
+        raise CircuitOpenError(f"{self.name} is unavailable, circuit is open")
+
+    def _record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"Circuit {self.name} closed")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def _record_failure(self, probe: bool) -> None:
+        self.failures += 1
+        if probe or self.failures >= self.failure_threshold:
+            if not probe:
+                logger.warning(
+                    f"Circuit {self.name} opened after {self.failures} failures"
+                )
+            self.opened_at = time.monotonic()
+            metrics.increment(f"circuit.{self.name}.opened")
+        self._probing = False
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        probe = self._admit()
+        try:
+            result = await func(*args, **kwargs)
+        except self.failure_exceptions:
+            self._record_failure(probe)
+            raise
+        except BaseException:
+            # cancelled, or an error that says nothing about the service
+            if probe:
+                self._probing = False
+            raise
+        self._record_success()
+        return result
+
+    def reset(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
@@ -10,6 +10,19 @@ class GlobalConfig(BaseSettings):
     items_per_user: int = Field(default=50)
     database_url: Optional[str] = None
     db_force_rollback: bool = Field(default=False)
+    # apply pending schema migrations when the app starts
+    db_migrate_on_startup: bool = Field(default=True)
+    # asyncpg pool per worker, see db_pool.py for sizing against max_connections
+    db_pool_min_size: int = Field(default=2)
+    db_pool_max_size: int = Field(default=10)
+    # requests waiting longer than this for a connection get a 503
+    db_pool_acquire_timeout_seconds: Optional[float] = Field(default=10)
+    db_statement_cache_size: int = Field(default=100)
+    # read-only queries are spread over these, see replicas.py
+    read_replica_urls: list[str] = Field(default_factory=list)
+    # how far replicas may lag behind; for this long after a write the client
+    # reads from the primary, and pages read from a replica aren't cached longer
+    replica_max_lag_seconds: float = Field(default=5)
     env_state: Optional[Literal["development", "testing", "production"]] = (
         None  # Removed env="ENV_STATE"
     )
@@ -17,17 +30,125 @@ class GlobalConfig(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str
 
+    ##password hashing, bcrypt runs off the event loop in a bounded pool
+    password_hash_executor: Literal["thread", "process"] = "thread"
+    password_hash_workers: int = Field(default=4)
+    # logins/registrations queued beyond this get a 503 instead of waiting
+    password_hash_max_pending: int = Field(default=64)
+
+    ##write-behind like buffer, see like_buffer.py for the durability trade-off
+    like_buffer_enabled: bool = Field(default=False)
+    like_buffer_flush_interval_seconds: float = Field(default=0.5)
+    like_buffer_max_size: int = Field(default=1000)
+
+    ##background jobs, see jobs.py
+    # durable queue run by `python -m social_media_api.worker`; when off, jobs
+    # run in the web process after the response (FastAPI BackgroundTasks)
+    job_queue_enabled: bool = Field(default=False)
+    job_worker_concurrency: int = Field(default=8)
+    job_poll_interval_seconds: float = Field(default=1)
+    # a job still running after this is cancelled and becomes claimable again
+    job_visibility_timeout_seconds: float = Field(default=120)
+    job_max_attempts: int = Field(default=5)
+    # retry n waits job_retry_backoff_seconds * 2**(n-1), at most an hour
+    job_retry_backoff_seconds: float = Field(default=5)
+
+    ##outbound http, see http_clients.py; limits are per client and worker
+    http_client_max_connections: int = Field(default=100)
+    http_client_max_keepalive_connections: int = Field(default=20)
+    http_client_keepalive_expiry_seconds: float = Field(default=30)
+    http_client_timeout_seconds: float = Field(default=10)
+    http_client_connect_timeout_seconds: float = Field(default=5)
+    http_client_http2: bool = Field(default=True)
+
+    ##email outbox, see email_outbox.py
+    # batch notification emails instead of one Mailgun request per email
+    email_outbox_enabled: bool = Field(default=False)
+    email_outbox_flush_interval_seconds: float = Field(default=2)
+    # recipients per batch send, capped at Mailgun's 1000 and at the burst
+    email_batch_size: int = Field(default=500)
+    # provider rate limit in messages; keep it below the plan's sending limit
+    email_rate_limit_per_second: float = Field(default=10)
+    email_rate_limit_burst: int = Field(default=100)
+    # sends of a message that failed on the network or at Mailgun before it's dropped
+    email_max_attempts: int = Field(default=5)
+
+    ##responses
+    # encode read endpoints with serializers.py instead of response_model
+    # validation, turn off to debug a response that doesn't match its model
+    fast_serialization: bool = Field(default=True)
+    # rows fetched per query while streaming an export
+    export_chunk_size: int = Field(default=1000)
+
+    ##trending ranking, see ranking.py
+    # run the score refresh loop in this process; turn it on for one worker (on
+    # Postgres several take turns) or run `maintenance refresh_post_scores` from
+    # cron instead
+    ranking_enabled: bool = Field(default=False)
+    # a like loses half its weight every ranking_half_life_hours
+    ranking_half_life_hours: float = Field(default=24)
+    ranking_refresh_interval_seconds: float = Field(default=30)
+
+    ##caching
+    # shared cache (redis://...) for all workers, in-process memory when unset
+    cache_redis_url: Optional[str] = None
+    user_cache_ttl_seconds: float = Field(default=60)
+    user_cache_max_size: int = Field(default=10_000)
+    # feed pages, writes invalidate them, the ttl is only a safety net
+    feed_cache_ttl_seconds: float = Field(default=30)
+    feed_cache_max_size: int = Field(default=1000)
+    # verified JWTs, each entry lives until the token's exp
+    token_cache_max_size: int = Field(default=10_000)
+
     # Add maigun
     DEV_MAILGUN_API_KEY: Optional[str] = None
     DEV_MAILGUN_DOMAIN: Optional[str] = None
 
-    ##file handling
+    ##file handling, see storage.py
+    storage_backend: Literal["b2", "local", "memory"] = "b2"
+    # local backend: files live here and are served under /media, or under
+    # storage_public_url when a web server or CDN serves the directory
+    storage_local_root: str = Field(default="media")
+    # parts of resumable uploads and files still being written, kept out of the
+    # served directory; same filesystem as storage_local_root, <root>-work if unset
+    storage_local_work_root: Optional[str] = None
+    storage_public_url: Optional[str] = None
     B2_KEY_ID: Optional[str] = None
     B2_APPLICATION_KEY: Optional[str] = None
     B2_BUCKET_NAME: Optional[str] = None
+    # streamed uploads go to B2 in parts of this size (B2's minimum is 5 MB),
+    # up to upload_part_concurrency at once; an upload buffers at most
+    # upload_part_size_bytes * (upload_part_concurrency + 1) in memory
+    upload_part_size_bytes: int = Field(default=8 * 1024 * 1024)
+    upload_part_concurrency: int = Field(default=4)
+    # largest part accepted by the resumable upload API, held in memory while
+    # it's sent on to B2
+    upload_max_part_size_bytes: int = Field(default=64 * 1024 * 1024)
+    # a resumable upload without a new part for this long is cancelled by
+    # `maintenance expire_upload_sessions`, its stored parts are deleted
+    upload_session_ttl_seconds: float = Field(default=7 * 24 * 60 * 60)
 
     ##image generation
     DEEPAI_API_KEY: Optional[str] = None
+    # DeepAI calls in flight per process, more wait for a slot
+    image_generation_max_concurrency: int = Field(default=8)
+    # this many failures in a row open the circuit: calls fail fast for
+    # image_generation_breaker_reset_seconds, then one probe call decides
+    image_generation_breaker_failures: int = Field(default=5)
+    image_generation_breaker_reset_seconds: float = Field(default=30)
+    # identical prompts reuse the generated image for this long
+    image_generation_cache_ttl_seconds: float = Field(default=24 * 60 * 60)
+    image_generation_cache_max_size: int = Field(default=1000)
+
+    ##image derivatives, see images.py
+    # thumbnail and WEBP variants of every post image
+    image_variants_enabled: bool = Field(default=True)
+    image_thumbnail_size: int = Field(default=320)
+    image_webp_quality: int = Field(default=80)
+    image_processing_workers: int = Field(default=2)
+    image_processing_max_pending: int = Field(default=16)
+    # originals larger than this aren't processed
+    image_processing_max_bytes: int = Field(default=25 * 1024 * 1024)
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -53,6 +174,9 @@ class DevConfig(GlobalConfig):
 class TestConfig(GlobalConfig):
     database_url: str = "sqlite:///test.db"
     db_force_rollback: bool = True
+    # tests that want the variants turn them on themselves
+    image_variants_enabled: bool = False
+    storage_backend: Literal["b2", "local", "memory"] = "memory"
 
     model_config = SettingsConfigDict(
         env_prefix="TEST_",
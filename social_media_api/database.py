@@ -1,19 +1,13 @@
 # database.py
-import databases
 import sqlalchemy as sa
 
 from social_media_api.config import settings
+from social_media_api.db_pool import Database, pool_options
 
 print(f"Database URL in database.py: {settings.database_url}")  # Debug print
 
 metadata = sa.MetaData()
 
-engine = sa.create_engine(
-    settings.database_url,
-    connect_args={"check_same_thread": False},  # Only needed for SQLite
-)
-
-
 user_table = sa.Table(
     "users",
     metadata,
@@ -30,6 +24,14 @@ posts = sa.Table(
     sa.Column("body", sa.String),
     sa.Column("user_id", sa.ForeignKey("users.id"), nullable=False),
     sa.Column("image_url", sa.String),
+    # smaller variants of image_url, see images.py
+    sa.Column("thumbnail_url", sa.String),
+    sa.Column("webp_url", sa.String),
+    # denormalized count(likes), kept in sync by the like/unlike paths
+    sa.Column("like_count", sa.Integer, nullable=False, server_default="0"),
+    sa.Index("ix_posts_user_id", "user_id"),
+    # sort by most_likes, id is the keyset tie-breaker
+    sa.Index("ix_posts_like_count_id", "like_count", "id"),
 )
 
 comments = sa.Table(
@@ -39,6 +41,7 @@ comments = sa.Table(
     sa.Column("body", sa.String),
     sa.Column("post_id", sa.ForeignKey("posts.id"), nullable=False),
     sa.Column("user_id", sa.ForeignKey("users.id"), nullable=False),
+    sa.Index("ix_comments_post_id_id", "post_id", "id"),
 )
 
 likes_table = sa.Table(
@@ -47,10 +50,109 @@ likes_table = sa.Table(
     sa.Column("id", sa.Integer, primary_key=True),
     sa.Column("post_id", sa.ForeignKey("posts.id"), nullable=False),
     sa.Column("user_id", sa.ForeignKey("users.id"), nullable=False),
+    # one like per user per post, also serves post_id lookups
+    sa.Index("ux_likes_post_id_user_id", "post_id", "user_id", unique=True),
 )
 
-metadata.create_all(engine)  # Create tables after defining them
+# precomputed "trending" ranking, maintained by social_media_api.ranking
+post_scores = sa.Table(
+    "post_scores",
+    metadata,
+    sa.Column("post_id", sa.ForeignKey("posts.id"), primary_key=True),
+    # log of the time-decayed like score, see ranking.py
+    sa.Column("score", sa.Float, nullable=False),
+    # posts.like_count already folded into score
+    sa.Column("like_count", sa.Integer, nullable=False),
+    sa.Index("ix_post_scores_score_post_id", "score", "post_id"),
+)
 
-database = databases.Database(
-    settings.database_url, force_rollback=settings.db_force_rollback
+# posts whose like_count moved since post_scores last saw it, queued by the
+# like/unlike paths so the ranking refresh never scans all posts
+stale_scores = sa.Table(
+    "stale_scores",
+    metadata,
+    sa.Column("post_id", sa.ForeignKey("posts.id"), primary_key=True),
 )
+
+# durable background jobs, see social_media_api.jobs
+jobs_table = sa.Table(
+    "jobs",
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True),
+    sa.Column("name", sa.String, nullable=False),
+    # json encoded keyword arguments
+    sa.Column("payload", sa.String, nullable=False),
+    sa.Column("status", sa.String, nullable=False),
+    sa.Column("attempts", sa.Integer, nullable=False),
+    sa.Column("max_attempts", sa.Integer, nullable=False),
+    # unix timestamps
+    sa.Column("run_at", sa.Float, nullable=False),
+    sa.Column("locked_until", sa.Float),
+    sa.Column("last_error", sa.String),
+    sa.Index("ix_jobs_status_run_at", "status", "run_at"),
+)
+
+# resumable uploads, each one a large file in storage; see routers/upload.py
+upload_sessions = sa.Table(
+    "upload_sessions",
+    metadata,
+    # random, the id is all a client needs to resume
+    sa.Column("id", sa.String, primary_key=True),
+    sa.Column("user_id", sa.ForeignKey("users.id"), nullable=False),
+    sa.Column("file_name", sa.String, nullable=False),
+    sa.Column("content_type", sa.String),
+    # the storage backend's large file id (named when B2 was the only one)
+    sa.Column("b2_file_id", sa.String, nullable=False),
+    sa.Column("status", sa.String, nullable=False),
+    sa.Column("created_at", sa.Float, nullable=False),
+    # pushed back by every part, expire_upload_sessions cleans up after it
+    sa.Column("expires_at", sa.Float),
+)
+
+upload_parts = sa.Table(
+    "upload_parts",
+    metadata,
+    sa.Column("upload_id", sa.ForeignKey("upload_sessions.id"), primary_key=True),
+    sa.Column("part_number", sa.Integer, primary_key=True),
+    sa.Column("size", sa.Integer, nullable=False),
+    sa.Column("sha1", sa.String, nullable=False),
+)
+
+# every file uploaded so far by content, identical uploads reuse the first url
+uploaded_files = sa.Table(
+    "uploaded_files",
+    metadata,
+    # sha256 hex of the content
+    sa.Column("digest", sa.String, primary_key=True),
+    sa.Column("file_url", sa.String, nullable=False),
+    sa.Column("size", sa.BigInteger, nullable=False),
+    sa.Column("created_at", sa.Float, nullable=False),
+)
+
+# users.email needs no extra index, its UNIQUE constraint is backed by one
+# tables and indexes are created by social_media_api.migrations, not at import
+
+
+def create_database(url: str, metrics_prefix: str = "db.pool") -> Database:
+    return Database(
+        url,
+        force_rollback=settings.db_force_rollback,
+        **pool_options(
+            url,
+            min_size=settings.db_pool_min_size,
+            max_size=settings.db_pool_max_size,
+            acquire_timeout=settings.db_pool_acquire_timeout_seconds,
+            statement_cache_size=settings.db_statement_cache_size,
+            metrics_prefix=metrics_prefix,
+        ),
+    )
+
+
+# requests only ever use these async pools; the sync engine for migrations is
+# created by social_media_api.migrations when they run
+database = create_database(settings.database_url)
+# read-only, routed to by social_media_api.replicas
+replicas = [
+    create_database(url, metrics_prefix=f"db.replica{i}.pool")
+    for i, url in enumerate(settings.read_replica_urls)
+]
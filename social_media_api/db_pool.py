@@ -0,0 +1,114 @@
+# Connection pool sizing and metrics for the databases.Database instance.
+#
+# On Postgres every uvicorn worker holds its own asyncpg pool, so the server
+# sees up to workers * db_pool_max_size connections; size db_pool_max_size so
+# that stays below max_connections. The instrumented backend reports how full
+# the pool is and how long requests wait for a connection, and gives up after
+# db_pool_acquire_timeout_seconds instead of queueing forever.
+#
+#   db.pool.size / db.pool.in_use / db.pool.max_size   gauges
+#   db.pool.acquires, db.pool.acquire_wait_seconds     counters, their ratio is
+#                                                      the mean wait
+#   db.pool.acquire_timeouts                           counter
+#
+# Read replicas report the same metrics as db.replica<N>.pool.*.
+import asyncio
+import time
+from typing import Any, Optional
+
+import databases
+from databases.backends.postgres import PostgresBackend, PostgresConnection
+
+from social_media_api import metrics
+
+
+class DatabasePoolTimeoutError(Exception):
+    pass
+
+
+class InstrumentedPostgresBackend(PostgresBackend):
+    def __init__(
+        self,
+        database_url: Any,
+        acquire_timeout: Optional[float] = None,
+        metrics_prefix: str = "db.pool",
+        **options,
+    ):
+        super().__init__(database_url, **options)
+        self.acquire_timeout = acquire_timeout
+        self.metrics_prefix = metrics_prefix
+
+        metrics.register_gauge(f"{metrics_prefix}.size", self.pool_size)
+        metrics.register_gauge(f"{metrics_prefix}.in_use", self.pool_in_use)
+        metrics.register_gauge(
+            f"{metrics_prefix}.max_size", lambda: self._pool_max_size
+        )
+
+    @property
+    def _pool_max_size(self) -> int:
+        return self._get_connection_kwargs().get("max_size", 10)
+
+    def pool_size(self) -> int:
+        return self._pool.get_size() if self._pool is not None else 0
+
+    def pool_in_use(self) -> int:
+        if self._pool is None:
+            return 0
+        return self._pool.get_size() - self._pool.get_idle_size()
+
+    def connection(self) -> "InstrumentedPostgresConnection":
+        return InstrumentedPostgresConnection(self, self._dialect)
+
+
+class InstrumentedPostgresConnection(PostgresConnection):
+    _database: InstrumentedPostgresBackend
+
+    async def acquire(self) -> None:
+        assert self._connection is None, "Connection is already acquired"
+        assert self._database._pool is not None, "DatabaseBackend is not running"
+        prefix = self._database.metrics_prefix
+        start = time.perf_counter()
+        try:
+            self._connection = await self._database._pool.acquire(
+                timeout=self._database.acquire_timeout
+            )
+        except asyncio.TimeoutError as e:
+            metrics.increment(f"{prefix}.acquire_timeouts")
+            raise DatabasePoolTimeoutError(
+                "Timed out waiting for a database connection"
+            ) from e
+        finally:
+            metrics.increment(
+                f"{prefix}.acquire_wait_seconds", time.perf_counter() - start
+            )
+        metrics.increment(f"{prefix}.acquires")
+
+
+class Database(databases.Database):
+    SUPPORTED_BACKENDS = {
+        **databases.Database.SUPPORTED_BACKENDS,
+        "postgresql": "social_media_api.db_pool:InstrumentedPostgresBackend",
+        "postgres": "social_media_api.db_pool:InstrumentedPostgresBackend",
+    }
+
+
+def pool_options(
+    database_url: str,
+    min_size: int,
+    max_size: int,
+    acquire_timeout: Optional[float],
+    statement_cache_size: int,
+    metrics_prefix: str = "db.pool",
+) -> dict:
+    # only the asyncpg pool takes these, sqlite has one connection per acquire
+    if not databases.DatabaseURL(database_url).dialect.startswith("postgres"):
+        return {}
+    return {
+        "min_size": min_size,
+        "max_size": max_size,
+        "acquire_timeout": acquire_timeout,
+        # 0 behind pgbouncer in transaction mode, prepared statements don't
+        # survive switching server connections
+        "statement_cache_size": statement_cache_size,
+        "metrics_prefix": metrics_prefix,
+    }
@@ -0,0 +1,231 @@
+# Batched, rate limited email dispatch through Mailgun.
+#
+# With email_outbox_enabled, notification emails are not sent one request each
+# but collected in memory and flushed every email_outbox_flush_interval_seconds
+# (or when email_batch_size messages are pending). Messages of one template go
+# out as a single Mailgun batch send: one request with up to email_batch_size
+# recipients and per-recipient "recipient-variables" filling the template's
+# %recipient.<name>% placeholders. A token bucket holds sending to
+# email_rate_limit_per_second messages (bursts up to email_rate_limit_burst),
+# so a signup wave is spread out instead of being throttled by the provider.
+#
+# Pending messages are coalesced: a second notification with the same template,
+# recipient and key (e.g. registering twice) replaces the first, only the newest
+# goes out. A batch that fails on the network, is throttled (429) or hits a
+# Mailgun outage (5xx) is retried on the next flush, at most email_max_attempts
+# times per message. Any other rejection would fail the same way again: the
+# batch is retried one message each so only the bad addresses are dropped.
+# As with the like buffer, messages still pending when the process
+# dies without a clean shutdown are lost; emails sent by jobs of the durable
+# queue therefore don't go through the outbox (see tasks.send_email).
+import asyncio
+import json
+import logging
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+from social_media_api import metrics
+from social_media_api.config import settings
+from social_media_api.http_clients import get_client
+from social_media_api.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Mailgun accepts at most 1000 recipients per batch send
+MAILGUN_MAX_BATCH = 1000
+
+PLACEHOLDER = re.compile(r"%recipient\.(\w+)%")
+
+
+@dataclass(frozen=True)
+class EmailTemplate:
+    name: str
+    subject: str
+    # may use %recipient.<name>% placeholders, %recipient.email% is the recipient
+    body: str
+
+    def render(self, variables: dict) -> str:
+        return PLACEHOLDER.sub(lambda match: str(variables[match.group(1)]), self.body)
+
+
+@dataclass
+class Message:
+    template: EmailTemplate
+    to: str
+    variables: dict = field(default_factory=dict)
+    # failed sends so far
+    attempts: int = 0
+
+
+def split_batches(messages: list[Message], size: int) -> list[list[Message]]:
+    # recipient-variables are keyed by address, so a batch can hold each
+    # recipient only once; a second message to them goes into the next batch
+    batches: list[dict[str, Message]] = []
+    for message in messages:
+        for batch in batches:
+            if len(batch) < size and message.to not in batch:
+                batch[message.to] = message
+                break
+        else:
+            batches.append({message.to: message})
+    return [list(batch.values()) for batch in batches]
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return True
+
+
+async def send_mailgun_batch(template: EmailTemplate, messages: list[Message]):
+    response = await get_client("mailgun").post(
+        f"https://api.mailgun.net/v3/{settings.DEV_MAILGUN_DOMAIN}/messages",
+        auth=("api", settings.DEV_MAILGUN_API_KEY),
+        data={
+            "from": f"Tijo Thomas <mailgun@{settings.DEV_MAILGUN_DOMAIN}>",
+            "to": [message.to for message in messages],
+            "subject": template.subject,
+            "text": template.body,
+            "recipient-variables": json.dumps(
+                {message.to: message.variables for message in messages}
+            ),
+        },
+    )
+    response.raise_for_status()
+    return response
+
+
+class EmailOutbox:
+    def __init__(
+        self,
+        send_batch: Callable[[EmailTemplate, list[Message]], Awaitable],
+        flush_interval: float,
+        batch_size: int,
+        bucket: TokenBucket,
+        max_attempts: int = 5,
+    ):
+        self.send_batch = send_batch
+        self.flush_interval = flush_interval
+        # a batch must fit in the bucket, or it could never be sent
+        self.batch_size = int(min(batch_size, MAILGUN_MAX_BATCH, bucket.capacity))
+        self.bucket = bucket
+        self.max_attempts = max_attempts
+        # (template, recipient, key) -> newest message
+        self._pending: dict[tuple, Message] = {}
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        metrics.register_gauge("email.outbox.pending", lambda: len(self._pending))
+
+    def add(
+        self,
+        template: EmailTemplate,
+        to: str,
+        variables: dict,
+        key: Optional[str] = None,
+    ) -> None:
+        coalesce_key = (template.name, to, key)
+        if coalesce_key in self._pending:
+            metrics.increment("email.coalesced")
+        self._pending[coalesce_key] = Message(template, to, {"email": to, **variables})
+        metrics.increment("email.queued")
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    async def flush(self) -> int:
+        async with self._lock:
+            pending, self._pending = self._pending, {}
+            self._full.clear()
+            by_template: dict[str, list[tuple]] = defaultdict(list)
+            for coalesce_key, message in pending.items():
+                by_template[message.template.name].append((coalesce_key, message))
+
+            batches = [
+                batch
+                for entries in by_template.values()
+                for batch in split_batches(
+                    [message for _, message in entries], self.batch_size
+                )
+            ]
+            keys = {id(message): key for key, message in pending.items()}
+            sent = 0
+            for batch in batches:
+                sent += await self._send(batch, keys)
+            metrics.increment("email.sent", sent)
+            return sent
+
+    async def _send(self, batch: list[Message], keys: dict[int, tuple]) -> int:
+        waited = await self.bucket.acquire(len(batch))
+        metrics.increment("email.rate_limited_seconds", waited)
+        try:
+            await self.send_batch(batch[0].template, batch)
+        except (httpx.HTTPError, OSError) as e:
+            retryable = is_retryable(e)
+            if not retryable and len(batch) > 1:
+                logger.warning(f"Batch of {len(batch)} emails rejected, sending singly")
+                sent = 0
+                for message in batch:
+                    sent += await self._send([message], keys)
+                return sent
+
+            logger.error(f"Sending {len(batch)} emails failed: {e}")
+            metrics.increment("email.failed", len(batch))
+            for message in batch:
+                message.attempts += 1
+                if retryable and message.attempts < self.max_attempts:
+                    # unless a newer message replaced it in the meantime
+                    self._pending.setdefault(keys[id(message)], message)
+                else:
+                    logger.error(
+                        f"Dropping {message.template.name} email to {message.to}"
+                        f" after {message.attempts} attempts"
+                    )
+                    metrics.increment("email.dropped")
+            return 0
+        metrics.increment("email.batches")
+        return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._pending:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    # keep the loop alive, the next flush tries what's left
+                    logger.error(f"Flushing the email outbox failed: {e!r}")
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+email_outbox = EmailOutbox(
+    send_mailgun_batch,
+    flush_interval=settings.email_outbox_flush_interval_seconds,
+    batch_size=settings.email_batch_size,
+    bucket=TokenBucket(
+        rate=settings.email_rate_limit_per_second,
+        capacity=settings.email_rate_limit_burst,
+    ),
+    max_attempts=settings.email_max_attempts,
+)
@@ -0,0 +1,75 @@
+# Response cache for GET /post feed pages.
+#
+# Entries are keyed by a feed version plus sorting/cursor/limit and whether the
+# page was read from the primary or a replica. Any write that
+# changes what the feed shows (new post, like/unlike, generated image) bumps the
+# version, which makes every cached page unreachable at once; the old entries
+# simply age out. The version is a random token rather than a counter so that
+# losing it (eviction, cache restart) can never resurrect stale pages.
+import hashlib
+import logging
+import uuid
+from typing import Optional
+
+from fastapi import Request, Response
+
+from social_media_api.cache import Cache
+from social_media_api.config import settings
+
+logger = logging.getLogger(__name__)
+
+feed_cache = Cache(
+    "feed", ttl=settings.feed_cache_ttl_seconds, max_size=settings.feed_cache_max_size
+)
+
+VERSION_KEY = "version"
+# the version has to outlive any page cached under it
+VERSION_TTL = 24 * 60 * 60
+
+
+async def get_feed_version() -> str:
+    version = await feed_cache.backend.get(VERSION_KEY)
+    if version is None:
+        version = await invalidate_feed()
+    return version
+
+
+async def invalidate_feed() -> str:
+    version = uuid.uuid4().hex
+    await feed_cache.backend.set(VERSION_KEY, version, VERSION_TTL)
+    return version
+
+
+def page_key(
+    version: str, source: str, sorting: str, cursor: Optional[str], limit: int
+) -> str:
+    # source is "primary" or "replica": a client that just wrote reads from the
+    # primary and must not get a lagging replica's page of the same version
+    return f"{version}:{source}:{sorting}:{cursor or ''}:{limit}"
+
+
+def make_entry(body: bytes, next_cursor: Optional[str]) -> dict:
+    return {
+        "body": body.decode(),
+        "etag": f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+        "next_cursor": next_cursor,
+    }
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def entry_response(request: Request, entry: dict, next_cursor_header: str) -> Response:
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache"}
+    if entry["next_cursor"]:
+        headers[next_cursor_header] = entry["next_cursor"]
+    if etag_matches(request, entry["etag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=entry["body"], media_type="application/json", headers=headers
+    )
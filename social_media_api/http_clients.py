@@ -0,0 +1,85 @@
+# Long-lived, connection-pooled httpx clients for outbound API calls.
+#
+# One AsyncClient per external service, created on first use and closed in the
+# app lifespan (or when the worker exits), so consecutive calls reuse open
+# keep-alive (or HTTP/2) connections instead of paying TCP+TLS setup each time.
+#
+# Per client <name> on /metrics:
+#   http.<name>.requests              requests sent
+#   http.<name>.connections_opened    new TCP connections
+#   http.<name>.tls_handshakes        new TLS sessions
+# requests - connections_opened is the number of requests that reused one.
+import logging
+from typing import Any
+
+import httpx
+
+from social_media_api import metrics
+from social_media_api.config import settings
+
+logger = logging.getLogger(__name__)
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+# httpcore trace events that mean a new connection / TLS session
+CONNECTION_EVENTS = {
+    "connection.connect_tcp.complete": "connections_opened",
+    "connection.connect_unix_socket.complete": "connections_opened",
+    "connection.start_tls.complete": "tls_handshakes",
+}
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def make_trace(name: str):
+    async def trace(event: str, info: dict[str, Any]) -> None:
+        if counter := CONNECTION_EVENTS.get(event):
+            metrics.increment(f"http.{name}.{counter}")
+
+    return trace
+
+
+def create_client(name: str) -> httpx.AsyncClient:
+    http2 = settings.http_client_http2
+    if http2 and not http2_available():
+        logger.warning("http_client_http2 is on but h2 isn't installed, using HTTP/1.1")
+        http2 = False
+
+    trace = make_trace(name)
+
+    async def on_request(request: httpx.Request) -> None:
+        metrics.increment(f"http.{name}.requests")
+        request.extensions["trace"] = trace
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.http_client_max_connections,
+            max_keepalive_connections=settings.http_client_max_keepalive_connections,
+            keepalive_expiry=settings.http_client_keepalive_expiry_seconds,
+        ),
+        timeout=httpx.Timeout(
+            settings.http_client_timeout_seconds,
+            connect=settings.http_client_connect_timeout_seconds,
+        ),
+        event_hooks={"request": [on_request]},
+    )
+
+
+def get_client(name: str) -> httpx.AsyncClient:
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _clients[name] = create_client(name)
+    return client
+
+
+async def close_clients() -> None:
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
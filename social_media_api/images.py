@@ -0,0 +1,128 @@
+# Smaller derivatives of post images, made off the request path.
+#
+# When a post gets an image, a background job downloads the original, renders
+# a thumbnail (image_thumbnail_size px on the longer side) and a full size
+# variant, both WEBP at image_webp_quality, stores them next to the original
+# and sets the post's thumbnail_url and webp_url. Feed clients load those and
+# only fetch image_url when they need the original.
+#
+# Decoding and encoding images is CPU bound, so it runs in a process pool
+# (image_processing_workers processes, at most image_processing_max_pending
+# images queued); a job that finds the pool full fails and is retried later.
+import asyncio
+import io
+import logging
+from typing import Optional
+
+from databases import Database
+from PIL import Image, ImageOps
+
+from social_media_api import metrics
+from social_media_api.config import settings
+from social_media_api.database import database as default_database
+from social_media_api.database import posts
+from social_media_api.feed_cache import invalidate_feed
+from social_media_api.http_clients import get_client
+from social_media_api.jobs import enqueue, job
+from social_media_api.offload import BoundedExecutor
+from social_media_api.storage import storage
+
+logger = logging.getLogger(__name__)
+
+# variant -> posts column with its url
+VARIANT_COLUMNS = {"thumbnail": "thumbnail_url", "webp": "webp_url"}
+
+image_processor = BoundedExecutor(
+    "image_processing",
+    kind="process",
+    max_workers=settings.image_processing_workers,
+    max_pending=settings.image_processing_max_pending,
+)
+
+
+class ImageTooLargeError(Exception):
+    pass
+
+
+def render_variants(data: bytes, thumbnail_size: int, quality: int) -> dict:
+    # runs in a worker process: only plain bytes go in and out
+    with Image.open(io.BytesIO(data)) as original:
+        # phone photos are often stored sideways with an EXIF rotation
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in image.getbands() or "transparency" in image.info
+            image = image.convert("RGBA" if has_alpha else "RGB")
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+
+        variants = {}
+        for name, variant in (("thumbnail", thumbnail), ("webp", image)):
+            out = io.BytesIO()
+            variant.save(out, "WEBP", quality=quality)
+            variants[name] = out.getvalue()
+        return variants
+
+
+async def download_image(url: str) -> bytes:
+    data = bytearray()
+    async with get_client("images").stream("GET", url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            data += chunk
+            if len(data) > settings.image_processing_max_bytes:
+                raise ImageTooLargeError(f"{url} is over {len(data)} bytes")
+    return bytes(data)
+
+
+@job(concurrency=2)
+async def generate_image_variants(
+    post_id: int, image_url: str, database: Optional[Database] = None
+):
+    database = database or default_database
+    original = await download_image(image_url)
+    variants = await image_processor.run(
+        render_variants,
+        original,
+        settings.image_thumbnail_size,
+        settings.image_webp_quality,
+    )
+
+    # compare with image_processing.original_bytes for the savings
+    metrics.increment("image_processing.original_bytes", len(original))
+    urls = {}
+    for name, data in variants.items():
+        urls[VARIANT_COLUMNS[name]] = await asyncio.to_thread(
+            storage.upload_bytes, data, f"posts/{post_id}/{name}.webp", "image/webp"
+        )
+        metrics.increment(f"image_processing.{name}_bytes", len(data))
+
+    # unless the post got another image in the meantime
+    query = (
+        posts.update()
+        .where(posts.c.id == post_id, posts.c.image_url == image_url)
+        .values(**urls)
+    )
+    logger.debug(query)
+    await database.execute(query)
+    await invalidate_feed()
+    metrics.increment("image_processing.images")
+
+
+async def schedule_image_variants(post_id: int, image_url: str) -> None:
+    # called from background work already, so without the job queue the
+    # variants are made right here
+    if not settings.image_variants_enabled:
+        return
+    if settings.job_queue_enabled:
+        await enqueue(
+            default_database,
+            generate_image_variants,
+            post_id=post_id,
+            image_url=image_url,
+        )
+        return
+    try:
+        await generate_image_variants(post_id, image_url)
+    except Exception as e:
+        logger.error(f"Making variants of {image_url} failed: {e!r}")
@@ -0,0 +1,199 @@
+# Durable background jobs.
+#
+# Jobs are rows in the jobs table, so they survive restarts and deploys and run
+# in a separate worker process (social_media_api.worker) instead of occupying
+# web workers. A worker claims a job atomically and leases it for
+# job_visibility_timeout_seconds; if the worker dies the lease runs out and
+# another worker picks the job up again. A failed job is retried with
+# exponential backoff until its max_attempts are used up, then it stays in the
+# table with status "failed" and its last error for inspection. Jobs that
+# succeed are deleted.
+#
+# Handlers are registered with @job and take JSON-serializable keyword
+# arguments. schedule() is what the routers call: it enqueues the job when
+# settings.job_queue_enabled, and falls back to BackgroundTasks otherwise. With
+# the queue enabled, set cache_redis_url too: jobs invalidate the feed cache from
+# the worker process, which an in-memory cache in the web workers wouldn't see.
+import json
+import logging
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+import sqlalchemy
+from databases import Database
+from fastapi import BackgroundTasks
+
+from social_media_api import metrics
+from social_media_api.config import settings
+from social_media_api.database import database, jobs_table
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+FAILED = "failed"
+
+MAX_BACKOFF_SECONDS = 60 * 60
+
+
+@dataclass(frozen=True)
+class JobSpec:
+    func: Callable[..., Awaitable]
+    max_attempts: int
+    # at most this many of the job run at once in one worker
+    concurrency: Optional[int] = None
+
+
+JOBS: dict[str, JobSpec] = {}
+
+# the claimed row while a worker runs a job, None outside the job queue
+current_job: ContextVar[Optional[dict]] = ContextVar("current_job", default=None)
+
+
+def will_retry() -> bool:
+    # whether raising now gets the current job another attempt; without the
+    # queue (BackgroundTasks) nothing ever runs it again
+    job = current_job.get()
+    return job is not None and job["attempts"] < job["max_attempts"]
+
+
+def job(max_attempts: Optional[int] = None, concurrency: Optional[int] = None):
+    def register(func: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+        JOBS[func.__name__] = JobSpec(
+            func, max_attempts or settings.job_max_attempts, concurrency
+        )
+        return func
+
+    return register
+
+
+async def enqueue(database: Database, func: Callable, **kwargs) -> int:
+    spec = JOBS[func.__name__]
+    query = jobs_table.insert().values(
+        name=func.__name__,
+        payload=json.dumps(kwargs),
+        status=QUEUED,
+        attempts=0,
+        max_attempts=spec.max_attempts,
+        run_at=time.time(),
+    )
+    logger.debug(query)
+    job_id = await database.execute(query)
+    metrics.increment("jobs.enqueued")
+    return job_id
+
+
+async def schedule(background_tasks: BackgroundTasks, func: Callable, **kwargs):
+    if settings.job_queue_enabled:
+        await enqueue(database, func, **kwargs)
+    else:
+        background_tasks.add_task(func, **kwargs)
+
+
+def claim_query(
+    database: Database, now: float, lease: float, exclude: set[str] = frozenset()
+):
+    # queued jobs that are due, or running ones whose worker lost its lease and
+    # that have attempts left
+    claimable = sqlalchemy.or_(
+        sqlalchemy.and_(jobs_table.c.status == QUEUED, jobs_table.c.run_at <= now),
+        sqlalchemy.and_(
+            jobs_table.c.status == RUNNING,
+            jobs_table.c.locked_until < now,
+            jobs_table.c.attempts < jobs_table.c.max_attempts,
+        ),
+    )
+    next_job = (
+        sqlalchemy.select(jobs_table.c.id)
+        .where(claimable)
+        .order_by(jobs_table.c.run_at)
+        .limit(1)
+    )
+    if exclude:
+        next_job = next_job.where(jobs_table.c.name.not_in(exclude))
+    if database.url.dialect == "postgresql":
+        # concurrent workers skip each other's rows instead of queueing on them
+        next_job = next_job.with_for_update(skip_locked=True)
+    return (
+        jobs_table.update()
+        .where(jobs_table.c.id == next_job.scalar_subquery(), claimable)
+        .values(
+            status=RUNNING,
+            attempts=jobs_table.c.attempts + 1,
+            locked_until=now + lease,
+        )
+        .returning(jobs_table)
+    )
+
+
+def fail_abandoned_query(now: float):
+    # jobs whose worker died on every attempt (OOM, a crash in native code)
+    # never got to fail() themselves
+    return (
+        jobs_table.update()
+        .where(
+            jobs_table.c.status == RUNNING,
+            jobs_table.c.locked_until < now,
+            jobs_table.c.attempts >= jobs_table.c.max_attempts,
+        )
+        .values(
+            status=FAILED,
+            locked_until=None,
+            last_error="Lease expired on the last attempt, the worker died",
+        )
+        .returning(jobs_table.c.id, jobs_table.c.name)
+    )
+
+
+async def claim(
+    database: Database, lease: float, exclude: set[str] = frozenset()
+) -> Optional[dict]:
+    now = time.time()
+    for abandoned in await database.fetch_all(fail_abandoned_query(now)):
+        logger.error(
+            f"Job {abandoned['name']} {abandoned['id']} failed for good: "
+            "its worker died on every attempt"
+        )
+        metrics.increment("jobs.failed")
+
+    query = claim_query(database, now, lease, exclude)
+    logger.debug(query)
+    return await database.fetch_one(query)
+
+
+def owned(job):
+    # still our claim: nobody re-claimed the job after our lease ran out
+    return sqlalchemy.and_(
+        jobs_table.c.id == job["id"], jobs_table.c.attempts == job["attempts"]
+    )
+
+
+async def complete(database: Database, job) -> None:
+    await database.execute(jobs_table.delete().where(owned(job)))
+    metrics.increment("jobs.succeeded")
+
+
+def backoff(attempts: int) -> float:
+    return min(
+        settings.job_retry_backoff_seconds * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS
+    )
+
+
+async def fail(database: Database, job, error: str) -> None:
+    if job["attempts"] >= job["max_attempts"]:
+        logger.error(f"Job {job['name']} {job['id']} failed for good: {error}")
+        values = {"status": FAILED, "locked_until": None}
+        metrics.increment("jobs.failed")
+    else:
+        values = {
+            "status": QUEUED,
+            "run_at": time.time() + backoff(job["attempts"]),
+            "locked_until": None,
+        }
+        metrics.increment("jobs.retried")
+    query = (
+        jobs_table.update().where(owned(job)).values(last_error=error[:1000], **values)
+    )
+    await database.execute(query)
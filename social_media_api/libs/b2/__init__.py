@@ -1,5 +1,9 @@
+import hashlib
+import io
 import logging
 from functools import lru_cache
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
 
 import b2sdk.v2 as b2
 
@@ -7,6 +11,10 @@ from social_media_api.config import settings
 
 logger = logging.getLogger(__name__)
 
+# large file limits
+B2_MIN_PART_SIZE = 5 * 1000 * 1000
+B2_MAX_PARTS = 10_000
+
 
 @lru_cache()
 def b2_api():
@@ -39,3 +47,51 @@ def b2_upload_file(local_file: str, file_name: str) -> str:
     logger.debug(f"Uploaded {local_file} to b2 and got download url {download_url}")
 
     return download_url
+
+
+# building blocks for streaming uploads (see uploads.py), all blocking: call
+# them from a thread
+def b2_upload_bytes(
+    data: bytes, file_name: str, content_type: Optional[str] = None
+) -> str:
+    api = b2_api()
+    uploaded_file = b2_get_bucket(api).upload_bytes(
+        data, file_name, content_type=content_type
+    )
+    return api.get_download_url_for_fileid(uploaded_file.id_)
+
+
+def b2_start_large_file(file_name: str, content_type: Optional[str] = None) -> str:
+    api = b2_api()
+    response = api.session.start_large_file(
+        b2_get_bucket(api).id_, file_name, content_type or "b2/x-auto", {}
+    )
+    logger.debug(f"Started large file {file_name}: {response['fileId']}")
+    return response["fileId"]
+
+
+def b2_upload_part(
+    file_id: str, part_number: int, data: bytes, sha1: Optional[str] = None
+) -> str:
+    # parts are numbered from 1, every part but the last needs B2_MIN_PART_SIZE
+    sha1 = sha1 or hashlib.sha1(data).hexdigest()
+    b2_api().session.upload_part(
+        file_id, part_number, len(data), sha1, io.BytesIO(data)
+    )
+    return sha1
+
+
+def b2_finish_large_file(file_id: str, part_sha1s: list[str]) -> str:
+    api = b2_api()
+    response = api.session.finish_large_file(file_id, part_sha1s)
+    return api.get_download_url_for_fileid(response["fileId"])
+
+
+def b2_cancel_large_file(file_id: str) -> None:
+    b2_api().session.cancel_large_file(file_id)
+
+
+def b2_delete_file(file_url: str, file_name: str) -> None:
+    # file_url as returned by the uploads above, it carries the file id
+    file_id = parse_qs(urlparse(file_url).query)["fileId"][0]
+    b2_api().delete_file_version(file_id, file_name)
@@ -0,0 +1,119 @@
+# Optional write-behind buffer for likes.
+#
+# During a viral spike every tap on the same post would be its own INSERT and
+# its own UPDATE of one hot posts row. With the buffer enabled, likes are
+# collected in memory per post and written in batches (one multi-row INSERT and
+# one counter UPDATE) every like_buffer_flush_interval_seconds or as soon as
+# like_buffer_max_size likes are pending. The trade-off: likes still in the
+# buffer are lost if the process dies without a clean shutdown, a smaller
+# interval narrows that window at the cost of more, smaller writes.
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Optional
+
+from databases import Database
+
+from social_media_api import metrics
+from social_media_api.config import settings
+from social_media_api.database import database
+from social_media_api.likes import delete_like, insert_likes
+from social_media_api.models.post import MAX_BULK_ITEMS
+
+logger = logging.getLogger(__name__)
+
+
+class LikeBuffer:
+    def __init__(self, database: Database, flush_interval: float, max_size: int):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        # post_id -> user_ids, a double tap is coalesced before it hits the db
+        self._pending: dict[int, set[int]] = defaultdict(set)
+        self._size = 0
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        metrics.register_gauge("like_buffer.pending", lambda: self._size)
+
+    def add(self, post_id: int, user_id: int) -> None:
+        if not self._put(post_id, user_id):
+            metrics.increment("like_buffer.coalesced")
+        if self._size >= self.max_size:
+            self._full.set()
+
+    def _put(self, post_id: int, user_id: int) -> bool:
+        if user_id in self._pending[post_id]:
+            return False
+        self._pending[post_id].add(user_id)
+        self._size += 1
+        return True
+
+    def discard(self, post_id: int, user_id: int) -> None:
+        # an unlike must also cancel a like that hasn't been written yet
+        if user_id in self._pending.get(post_id, ()):
+            self._pending[post_id].discard(user_id)
+            self._size -= 1
+
+    async def unlike(self, post_id: int, user_id: int) -> bool:
+        # under the flush lock: a like that is being flushed right now has left
+        # _pending but isn't in the db yet, it must be written before the delete
+        async with self._lock:
+            self.discard(post_id, user_id)
+            return await delete_like(self.database, post_id, user_id)
+
+    async def flush(self) -> int:
+        async with self._lock:
+            pending, self._pending = self._pending, defaultdict(set)
+            self._size = 0
+            self._full.clear()
+            likes = [
+                {"post_id": post_id, "user_id": user_id}
+                for post_id, user_ids in pending.items()
+                for user_id in user_ids
+            ]
+            written = 0
+            for start in range(0, len(likes), MAX_BULK_ITEMS):
+                batch = likes[start : start + MAX_BULK_ITEMS]
+                try:
+                    written += len(await insert_likes(self.database, batch))
+                except Exception as e:
+                    # keep the likes for the next (timed) flush instead of
+                    # dropping them
+                    logger.error(f"Flushing {len(batch)} buffered likes failed: {e}")
+                    for like in likes[start:]:
+                        self._put(like["post_id"], like["user_id"])
+                    break
+            metrics.increment("like_buffer.flushed", written)
+            return written
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._size:
+                await self.flush()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+like_buffer = LikeBuffer(
+    database,
+    flush_interval=settings.like_buffer_flush_interval_seconds,
+    max_size=settings.like_buffer_max_size,
+)
@@ -0,0 +1,79 @@
+import logging
+from collections import Counter
+
+import sqlalchemy
+from databases import Database
+from sqlalchemy.dialects import postgresql, sqlite
+
+from social_media_api.database import likes_table, posts
+from social_media_api.feed_cache import invalidate_feed
+from social_media_api.ranking import mark_scores_stale
+
+logger = logging.getLogger(__name__)
+
+
+def increment_like_counts(counts: dict[int, int]):
+    # one UPDATE for any number of posts: like_count + CASE id WHEN ... END
+    return (
+        posts.update()
+        .where(posts.c.id.in_(list(counts)))
+        .values(
+            like_count=posts.c.like_count
+            + sqlalchemy.case(counts, value=posts.c.id, else_=0)
+        )
+    )
+
+
+def insert_likes_query(database: Database, likes: list[dict]):
+    # INSERT ... ON CONFLICT DO NOTHING, retries and double taps are no-ops
+    dialect = postgresql if database.url.dialect == "postgresql" else sqlite
+    return (
+        dialect.insert(likes_table)
+        .values(likes)
+        .on_conflict_do_nothing(index_elements=["post_id", "user_id"])
+        .returning(likes_table.c.id, likes_table.c.post_id, likes_table.c.user_id)
+    )
+
+
+async def insert_likes(database: Database, likes: list[dict]) -> list:
+    # returns only the likes that did not exist yet, the counters are bumped for
+    # exactly those rows in the same transaction
+    query = insert_likes_query(database, likes)
+    logger.debug(query)
+
+    async with database.transaction():
+        inserted = await database.fetch_all(query)
+        if inserted:
+            counts = Counter(like["post_id"] for like in inserted)
+            await database.execute(increment_like_counts(counts))
+            await mark_scores_stale(database, list(counts))
+    if inserted:
+        await invalidate_feed()
+    # ids are handed out in VALUES order, so this is the input order
+    return sorted(inserted, key=lambda like: like["id"])
+
+
+async def find_likes(database: Database, user_id: int, post_ids: set[int]) -> list:
+    query = likes_table.select().where(
+        likes_table.c.user_id == user_id, likes_table.c.post_id.in_(post_ids)
+    )
+    logger.debug(query)
+    return await database.fetch_all(query)
+
+
+async def delete_like(database: Database, post_id: int, user_id: int) -> bool:
+    query = (
+        likes_table.delete()
+        .where(likes_table.c.post_id == post_id, likes_table.c.user_id == user_id)
+        .returning(likes_table.c.id)
+    )
+    logger.debug(query)
+
+    async with database.transaction():
+        deleted = await database.fetch_all(query)
+        if deleted:
+            await database.execute(increment_like_counts({post_id: -len(deleted)}))
+            await mark_scores_stale(database, [post_id])
+    if deleted:
+        await invalidate_feed()
+    return bool(deleted)
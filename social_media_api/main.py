@@ -1,17 +1,32 @@
 # main.py
+import asyncio
 import logging
 import os
 from contextlib import asynccontextmanager
 
 from asgi_correlation_id import CorrelationIdMiddleware
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, status
 from fastapi.exception_handlers import http_exception_handler
+from fastapi.staticfiles import StaticFiles
 
-from social_media_api.database import database
+from social_media_api import metrics
+from social_media_api.config import settings
+from social_media_api.database import database, replicas
+from social_media_api.db_pool import DatabasePoolTimeoutError
+from social_media_api.email_outbox import email_outbox
+from social_media_api.http_clients import close_clients
+from social_media_api.images import image_processor
+from social_media_api.like_buffer import like_buffer
 from social_media_api.logging_conf import configure_logging  # Updated function name
+from social_media_api.migrations import run_migrations
+from social_media_api.ranking import score_refresher
+from social_media_api.replicas import ReadYourWritesMiddleware
+from social_media_api.routers.export import router as export_router
 from social_media_api.routers.post import router as post_router
 from social_media_api.routers.upload import router as upload_router
 from social_media_api.routers.user import router as user_router
+from social_media_api.security import password_hasher
+from social_media_api.storage import MEDIA_PATH
 
 print(f"Current working directory: {os.getcwd()}")
 
@@ -22,19 +37,50 @@ logger = logging.getLogger("social_media_api")  # Use the correct logger name
 async def lifespan(app: FastAPI):
     configure_logging()  # Updated function name
     logger.info("Hello World")
+    if settings.db_migrate_on_startup:
+        await asyncio.to_thread(run_migrations)
     await database.connect()
+    for replica in replicas:
+        await replica.connect()
     print("Database connected")
+    if settings.like_buffer_enabled:
+        await like_buffer.start()
+    if settings.ranking_enabled:
+        await score_refresher.start()
+    if settings.email_outbox_enabled:
+        await email_outbox.start()
     yield
+    await score_refresher.stop()
+    # write buffered likes before the connection goes away
+    await like_buffer.stop()
+    for replica in replicas:
+        await replica.disconnect()
     await database.disconnect()
+    # send what's still queued while the mailgun client is open
+    await email_outbox.stop()
+    await close_clients()
+    password_hasher.shutdown()
+    image_processor.shutdown()
     print("Database disconnected")
 
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(CorrelationIdMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
 
 app.include_router(post_router)
 app.include_router(user_router)
 app.include_router(upload_router)
+app.include_router(export_router)
+
+if settings.storage_backend == "local":
+    # uploaded files; FileResponse hands them to the server's sendfile where
+    # the server supports it
+    app.mount(
+        MEDIA_PATH,
+        StaticFiles(directory=settings.storage_local_root, check_dir=False),
+        name="media",
+    )
 
 
 @app.get("/test-db")
@@ -46,7 +92,25 @@ async def test_db():
         return {"message": f"Database connection failed: {str(e)}"}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
+
 @app.exception_handler(HTTPException)
 async def http_exception_handle_logging(request, exception):
     logger.error(f"HTTPException: {exception.status_code} {exception.detail}")
     return await http_exception_handler(request, exception)
+
+
+@app.exception_handler(DatabasePoolTimeoutError)
+async def database_pool_timeout_handler(request, exception):
+    logger.error(f"Database pool exhausted: {exception}")
+    return await http_exception_handler(
+        request,
+        HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": "1"},
+        ),
+    )
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+
+import sqlalchemy
+from databases import Database
+
+from social_media_api.database import database, likes_table, posts
+from social_media_api.ranking import mark_all_stale_query, refresh_post_scores
+from social_media_api.uploads import expire_upload_sessions
+
+logger = logging.getLogger(__name__)
+
+
+def reconcile_like_counts_query():
+    # backfill/repair posts.like_count from the likes table in one statement,
+    # only rows that drifted are written
+    counted = (
+        sqlalchemy.select(sqlalchemy.func.count(likes_table.c.id))
+        .where(likes_table.c.post_id == posts.c.id)
+        .scalar_subquery()
+    )
+    return (
+        posts.update().where(posts.c.like_count != counted).values(like_count=counted)
+    )
+
+
+async def reconcile_like_counts(database: Database) -> None:
+    query = reconcile_like_counts_query()
+    logger.debug(query)
+
+    async with database.transaction():
+        await database.execute(query)
+        # repaired counts change the trending scores too
+        await database.execute(mark_all_stale_query(database.url.dialect))
+
+
+COMMANDS = {
+    "reconcile_like_counts": reconcile_like_counts,
+    "refresh_post_scores": refresh_post_scores,
+    "expire_upload_sessions": expire_upload_sessions,
+}
+
+
+async def main(command: str) -> None:
+    await database.connect()
+    try:
+        await COMMANDS[command](database)
+    finally:
+        await database.disconnect()
+
+
+# python -m social_media_api.maintenance reconcile_like_counts
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Database maintenance commands")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    asyncio.run(main(parser.parse_args().command))
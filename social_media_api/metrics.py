@@ -0,0 +1,33 @@
+# In-process counters and gauges, served as JSON on GET /metrics.
+# Each uvicorn worker keeps its own numbers.
+import logging
+from collections import defaultdict
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+_counters: dict[str, float] = defaultdict(float)
+_gauges: dict[str, Callable[[], float]] = {}
+
+
+def increment(name: str, amount: float = 1) -> None:
+    _counters[name] += amount
+
+
+def register_gauge(name: str, read: Callable[[], float]) -> None:
+    # gauges are read when the metrics are collected, not pushed
+    _gauges[name] = read
+
+
+def snapshot() -> dict[str, float]:
+    values = dict(_counters)
+    for name, read in _gauges.items():
+        try:
+            values[name] = read()
+        except Exception as e:
+            logger.warning(f"Could not read gauge {name}: {e}")
+    return dict(sorted(values.items()))
+
+
+def reset() -> None:
+    _counters.clear()
@@ -0,0 +1,261 @@
+# Versioned, forward-only schema migrations.
+#
+# Migrations are additive only (new tables, defaulted columns, indexes), so they
+# can be applied to the live database before the code that needs them is
+# deployed. On Postgres indexes are built CONCURRENTLY outside a transaction so
+# writes to the table are never blocked. Applied versions are recorded in the
+# schema_version table, running the migrations again is a no-op.
+#
+#   python -m social_media_api.migrations
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+from social_media_api.config import settings
+from social_media_api.database import (
+    comments,
+    jobs_table,
+    likes_table,
+    post_scores,
+    posts,
+    stale_scores,
+    upload_parts,
+    upload_sessions,
+    uploaded_files,
+    user_table,
+)
+from social_media_api.maintenance import reconcile_like_counts_query
+from social_media_api.ranking import mark_all_stale_query
+
+logger = logging.getLogger(__name__)
+
+schema_version = sa.Table(
+    "schema_version",
+    sa.MetaData(),
+    sa.Column("version", sa.Integer, primary_key=True),
+    sa.Column("description", sa.String, nullable=False),
+    sa.Column("applied_at", sa.DateTime(timezone=True), nullable=False),
+)
+
+# pg_advisory_lock key, so workers starting at the same time migrate one by one
+MIGRATION_LOCK_ID = 7310436
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    transactional: bool = True
+
+
+def create_table(conn: Connection, table: sa.Table) -> None:
+    # columns only, indexes get their own (non-blocking) migration steps
+    conn.execute(CreateTable(table, if_not_exists=True))
+
+
+def add_column(conn: Connection, table: sa.Table, column: sa.Column) -> bool:
+    existing = {c["name"] for c in sa.inspect(conn).get_columns(table.name)}
+    if column.name in existing:
+        return False
+    spec = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.execute(sa.text(f"ALTER TABLE {table.name} ADD COLUMN {spec}"))
+    return True
+
+
+def create_index(
+    conn: Connection, name: str, table: str, *columns: str, unique: bool = False
+) -> None:
+    concurrently = " CONCURRENTLY" if conn.dialect.name == "postgresql" else ""
+    if concurrently:
+        # a failed concurrent build leaves an INVALID index behind, which
+        # IF NOT EXISTS would take for done; build it again instead
+        valid = conn.execute(
+            sa.text(
+                "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"
+            ),
+            {"name": name},
+        ).scalar()
+        if valid is False:
+            logger.warning(f"Rebuilding invalid index {name}")
+            drop_index(conn, name)
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    conn.execute(
+        sa.text(
+            f"CREATE {kind}{concurrently} IF NOT EXISTS {name} "
+            f"ON {table} ({', '.join(columns)})"
+        )
+    )
+
+
+def drop_index(conn: Connection, name: str) -> None:
+    concurrently = " CONCURRENTLY" if conn.dialect.name == "postgresql" else ""
+    conn.execute(sa.text(f"DROP INDEX{concurrently} IF EXISTS {name}"))
+
+
+def _create_base_tables(conn: Connection) -> None:
+    for table in (user_table, posts, comments, likes_table):
+        create_table(conn, table)
+
+
+def _add_posts_like_count(conn: Connection) -> None:
+    if add_column(conn, posts, posts.c.like_count):
+        conn.execute(reconcile_like_counts_query())
+
+
+def _create_lookup_indexes(conn: Connection) -> None:
+    create_index(conn, "ix_comments_post_id_id", "comments", "post_id", "id")
+    create_index(conn, "ix_likes_post_id", "likes", "post_id")
+    create_index(conn, "ix_posts_user_id", "posts", "user_id")
+    create_index(conn, "ix_posts_like_count_id", "posts", "like_count", "id")
+
+
+def _make_likes_unique(conn: Connection) -> None:
+    # keep the first like of every (post, user) pair, then fix the counters; if
+    # old code inserts a duplicate before the index exists the build fails, just
+    # run it again (create_index replaces the invalid index it left on Postgres)
+    first_likes = sa.select(sa.func.min(likes_table.c.id)).group_by(
+        likes_table.c.post_id, likes_table.c.user_id
+    )
+    conn.execute(likes_table.delete().where(likes_table.c.id.not_in(first_likes)))
+    conn.execute(reconcile_like_counts_query())
+    create_index(
+        conn, "ux_likes_post_id_user_id", "likes", "post_id", "user_id", unique=True
+    )
+    drop_index(conn, "ix_likes_post_id")
+
+
+def _create_post_scores(conn: Connection) -> None:
+    # filled by the first ranking refresh
+    create_table(conn, post_scores)
+    create_index(
+        conn, "ix_post_scores_score_post_id", "post_scores", "score", "post_id"
+    )
+
+
+def _create_jobs(conn: Connection) -> None:
+    create_table(conn, jobs_table)
+    create_index(conn, "ix_jobs_status_run_at", "jobs", "status", "run_at")
+
+
+def _create_upload_sessions(conn: Connection) -> None:
+    for table in (upload_sessions, upload_parts):
+        create_table(conn, table)
+
+
+def _create_uploaded_files(conn: Connection) -> None:
+    create_table(conn, uploaded_files)
+
+
+def _add_posts_image_variants(conn: Connection) -> None:
+    add_column(conn, posts, posts.c.thumbnail_url)
+    add_column(conn, posts, posts.c.webp_url)
+
+
+def _create_stale_scores(conn: Connection) -> None:
+    create_table(conn, stale_scores)
+    # what the refresh found by scanning all posts until now
+    conn.execute(mark_all_stale_query(conn.dialect.name))
+
+
+def _add_upload_session_expiry(conn: Connection) -> None:
+    add_column(conn, upload_sessions, upload_sessions.c.expires_at)
+    conn.execute(
+        upload_sessions.update()
+        .where(upload_sessions.c.expires_at.is_(None))
+        .values(
+            expires_at=upload_sessions.c.created_at
+            + settings.upload_session_ttl_seconds
+        )
+    )
+
+
+MIGRATIONS = [
+    Migration(1, "create users, posts, comments and likes", _create_base_tables),
+    Migration(2, "add posts.like_count", _add_posts_like_count),
+    Migration(
+        3, "index hot lookup columns", _create_lookup_indexes, transactional=False
+    ),
+    Migration(4, "one like per user per post", _make_likes_unique, transactional=False),
+    Migration(
+        5, "add post_scores for trending", _create_post_scores, transactional=False
+    ),
+    Migration(6, "add the jobs queue", _create_jobs, transactional=False),
+    Migration(7, "add resumable upload sessions", _create_upload_sessions),
+    Migration(8, "index uploaded files by content", _create_uploaded_files),
+    Migration(9, "add posts image variant urls", _add_posts_image_variants),
+    Migration(10, "queue posts for the ranking refresh", _create_stale_scores),
+    Migration(11, "expire abandoned upload sessions", _add_upload_session_expiry),
+]
+
+
+def create_migration_engine() -> Engine:
+    # a sync engine just for the migration run, the app itself only uses the
+    # async pool in database.py
+    connect_args = {}
+    if settings.database_url.startswith("sqlite"):
+        connect_args["check_same_thread"] = False
+    return sa.create_engine(settings.database_url, connect_args=connect_args)
+
+
+def applied_versions(conn: Connection) -> set[int]:
+    return set(conn.execute(sa.select(schema_version.c.version)).scalars())
+
+
+def run_migrations(engine: Optional[Engine] = None) -> list[int]:
+    if engine is None:
+        engine = create_migration_engine()
+        try:
+            return run_migrations(engine)
+        finally:
+            engine.dispose()
+
+    schema_version.create(engine, checkfirst=True)
+
+    applied = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock:
+        if engine.dialect.name == "postgresql":
+            lock.execute(sa.select(sa.func.pg_advisory_lock(MIGRATION_LOCK_ID)))
+        try:
+            done = applied_versions(lock)
+            for migration in MIGRATIONS:
+                if migration.version in done:
+                    continue
+                logger.info(
+                    f"Applying migration {migration.version}: {migration.description}"
+                )
+                _apply(engine, migration)
+                applied.append(migration.version)
+        finally:
+            if engine.dialect.name == "postgresql":
+                lock.execute(sa.select(sa.func.pg_advisory_unlock(MIGRATION_LOCK_ID)))
+    return applied
+
+
+def _apply(engine: Engine, migration: Migration) -> None:
+    record = schema_version.insert().values(
+        version=migration.version,
+        description=migration.description,
+        applied_at=datetime.now(timezone.utc),
+    )
+    if migration.transactional:
+        with engine.begin() as conn:
+            migration.apply(conn)
+            conn.execute(record)
+    else:
+        # every statement commits on its own; steps must be idempotent so a
+        # half-applied migration can simply be run again
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            migration.apply(conn)
+            conn.execute(record)
+
+
+if __name__ == "__main__":
+    applied = run_migrations()
+    print(f"Applied migrations: {applied or 'none, schema is up to date'}")
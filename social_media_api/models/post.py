@@ -1,6 +1,8 @@
 from typing import Optional
 
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
+
+MAX_BULK_ITEMS = 500
 
 
 class UserPostIn(BaseModel):
@@ -12,6 +14,9 @@ class UserPost(UserPostIn):
     id: int
     user_id: int
     image_url: Optional[str] = None
+    # smaller variants of image_url, set a little after it
+    thumbnail_url: Optional[str] = None
+    webp_url: Optional[str] = None
 
 
 class UserPostWithLikes(UserPost):
@@ -43,3 +48,26 @@ class PostLike(PostLikeIn):
     model_config = ConfigDict(from_attributes=True)
     id: int
     user_id: int
+
+
+# bulk endpoints, results are returned per item in request order
+class BulkLikeIn(BaseModel):
+    likes: list[PostLikeIn] = Field(min_length=1, max_length=MAX_BULK_ITEMS)
+
+
+class BulkLikeResult(BaseModel):
+    post_id: int
+    status: int
+    like: Optional[PostLike] = None
+    detail: Optional[str] = None
+
+
+class BulkCommentIn(BaseModel):
+    comments: list[CommentIn] = Field(min_length=1, max_length=MAX_BULK_ITEMS)
+
+
+class BulkCommentResult(BaseModel):
+    post_id: int
+    status: int
+    comment: Optional[Comment] = None
+    detail: Optional[str] = None
@@ -0,0 +1,33 @@
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class UploadSessionIn(BaseModel):
+    file_name: str = Field(min_length=1)
+    content_type: Optional[str] = None
+
+
+class UploadPart(BaseModel):
+    part_number: int
+    size: int
+    sha1: str
+
+
+class UploadSession(BaseModel):
+    upload_id: str
+    file_name: str
+    status: str
+    # every part but the last must be at least this big, at most max_part_size
+    min_part_size: int
+    max_part_size: int
+    # a file that fits in fewer parts goes to /upload/stream instead
+    min_parts: int
+    # unix time, unless another part arrives before
+    expires_at: float
+    parts: list[UploadPart] = []
+
+
+class UploadComplete(BaseModel):
+    message: str
+    file_url: str
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Literal, Optional, TypeVar
+
+from social_media_api import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ExecutorOverloadedError(Exception):
+    pass
+
+
+# runs blocking calls in a worker pool so they never block the event loop; at
+# most max_pending calls may be queued or running, callers beyond that are
+# rejected straight away instead of piling up behind a saturated pool
+class BoundedExecutor:
+    def __init__(
+        self,
+        name: str,
+        kind: Literal["thread", "process"],
+        max_workers: int,
+        max_pending: int,
+    ):
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[Executor] = None
+
+        metrics.register_gauge(f"{name}.in_flight", lambda: self.pending)
+        metrics.register_gauge(f"{name}.queue_depth", lambda: self.queue_depth)
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self.pending - self.max_workers, 0)
+
+    def _get_executor(self) -> Executor:
+        # created lazily so importing the module never forks worker processes
+        if self._executor is None:
+            pool = ProcessPoolExecutor if self.kind == "process" else ThreadPoolExecutor
+            self._executor = pool(max_workers=self.max_workers)
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        if self.pending >= self.max_pending:
+            metrics.increment(f"{self.name}.rejected")
+            raise ExecutorOverloadedError(f"{self.name} has too many pending calls")
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,44 @@
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException, status
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# the next page cursor goes in a header so list responses keep their shape
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(position: dict) -> str:
+    # {"sorting": "new", "id": 42} -> opaque url-safe token
+    raw = json.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def create_cursor_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+    )
+
+
+def decode_cursor(cursor: str, keys: tuple[str, ...], **expected) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError) as e:
+        raise create_cursor_exception() from e
+
+    if not isinstance(position, dict):
+        raise create_cursor_exception()
+    # a cursor is only valid for the listing (sorting, post, ...) it was issued for
+    for key, value in expected.items():
+        if position.get(key) != value:
+            raise create_cursor_exception()
+    # keyset values end up in the WHERE clause, only accept numbers
+    for key in keys:
+        value = position.get(key)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise create_cursor_exception()
+    return position
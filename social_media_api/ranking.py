@@ -0,0 +1,273 @@
+# Precomputed "trending" ranking.
+#
+# Every like counts with a weight that decays exponentially with its age (half
+# life ranking_half_life_hours). Decaying every stored score on every refresh
+# would rewrite the whole table, so scores use forward decay instead: a like at
+# time t is stored with weight exp(rate * (t - EPOCH)), which grows over time
+# rather than the old ones shrinking. All scores are compared at the same "now",
+# so the order is the same as with real decay, and only posts that got new likes
+# have to be written. Scores are kept as logarithms so the growing weights never
+# overflow a float.
+#
+# The refresh job folds the change of posts.like_count since the last refresh
+# into post_scores. Writes that move like_count (likes, unlikes, new posts) queue
+# the post in stale_scores in the same transaction, so a refresh only reads the
+# posts that changed. A new post starts out with the weight of one like at the
+# time it is first scored, so fresh posts show up in the trending feed before
+# they collect likes.
+#
+# Several workers may run the refresh loop; on Postgres they take turns on an
+# advisory lock instead of doing the same work at once.
+import asyncio
+import logging
+import math
+import time
+from typing import Optional
+
+import sqlalchemy
+from databases import Database
+from sqlalchemy.dialects import postgresql, sqlite
+
+from social_media_api import metrics
+from social_media_api.config import settings
+from social_media_api.database import database, post_scores, posts, stale_scores
+from social_media_api.feed_cache import invalidate_feed
+
+logger = logging.getLogger(__name__)
+
+# 2024-01-01T00:00:00Z, forward decay weights are relative to this instant
+EPOCH = 1_704_067_200
+REFRESH_BATCH_SIZE = 1000
+# unlikes can take a score down to this fraction of its previous value, never to 0
+MIN_SCORE_FRACTION = 1e-6
+# pg_advisory_lock key of the refresh loop
+RANKING_LOCK_ID = 7310437
+
+
+def decay_rate() -> float:
+    return math.log(2) / (settings.ranking_half_life_hours * 60 * 60)
+
+
+def like_weight(now: float) -> float:
+    # log of the weight of one like given at `now`
+    return decay_rate() * (now - EPOCH)
+
+
+def add_likes(score: float, likes: int, weight: float, scored_likes: int) -> float:
+    # fold `likes` likes (negative for unlikes) of log weight `weight` into a
+    # score that holds scored_likes likes plus the post's own starting weight
+    if likes == 0:
+        return score
+    if likes > 0:
+        change = math.log(likes) + weight
+        high, low = max(score, change), min(score, change)
+        return high + math.log1p(math.exp(low - high))
+    # which like was taken back isn't known, and at today's weight an old like
+    # would take the whole score with it; remove an average one instead
+    removed = min(-likes / (scored_likes + 1), 1 - MIN_SCORE_FRACTION)
+    return score + math.log1p(-removed)
+
+
+def mark_stale_query(database: Database, post_ids: list[int]):
+    dialect = postgresql if database.url.dialect == "postgresql" else sqlite
+    return (
+        dialect.insert(stale_scores)
+        .values([{"post_id": post_id} for post_id in post_ids])
+        .on_conflict_do_nothing(index_elements=["post_id"])
+    )
+
+
+async def mark_scores_stale(database: Database, post_ids: list[int]) -> None:
+    # call it in the transaction that changed the posts' like_count
+    await database.execute(mark_stale_query(database, post_ids))
+
+
+def mark_all_stale_query(dialect_name: str):
+    # full scan for posts without a score or whose like_count drifted from it,
+    # for backfills and repairs only
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    unscored = (
+        sqlalchemy.select(posts.c.id)
+        .select_from(posts.outerjoin(post_scores, post_scores.c.post_id == posts.c.id))
+        .where(
+            sqlalchemy.or_(
+                post_scores.c.post_id.is_(None),
+                post_scores.c.like_count != posts.c.like_count,
+            )
+        )
+    )
+    return (
+        dialect.insert(stale_scores)
+        .from_select(["post_id"], unscored)
+        .on_conflict_do_nothing(index_elements=["post_id"])
+    )
+
+
+def select_stale_scores(after_id: int, limit: int):
+    return (
+        sqlalchemy.select(
+            posts.c.id,
+            posts.c.like_count,
+            post_scores.c.score,
+            post_scores.c.like_count.label("scored_likes"),
+        )
+        .select_from(
+            stale_scores.join(posts, posts.c.id == stale_scores.c.post_id).outerjoin(
+                post_scores, post_scores.c.post_id == stale_scores.c.post_id
+            )
+        )
+        .where(stale_scores.c.post_id > after_id)
+        .order_by(stale_scores.c.post_id)
+        .limit(limit)
+    )
+
+
+def clear_stale_query(post_ids: list[int]):
+    # a post liked again after it was read still differs from its score and
+    # stays queued for the next refresh
+    scored = (
+        sqlalchemy.select(post_scores.c.post_id)
+        .join(posts, posts.c.id == post_scores.c.post_id)
+        .where(
+            post_scores.c.post_id.in_(post_ids),
+            post_scores.c.like_count == posts.c.like_count,
+        )
+    )
+    return stale_scores.delete().where(stale_scores.c.post_id.in_(scored))
+
+
+def insert_scores_query(database: Database, scores: list[dict]):
+    # another worker may have scored the post in the meantime, its row wins
+    dialect = postgresql if database.url.dialect == "postgresql" else sqlite
+    return (
+        dialect.insert(post_scores)
+        .values(scores)
+        .on_conflict_do_nothing(index_elements=["post_id"])
+    )
+
+
+def update_scores_query(
+    scores: dict[int, float], seen: dict[int, int], likes: dict[int, int]
+):
+    # one UPDATE for the whole batch; a row only changes if its like_count is
+    # still the one the new score was computed from, so concurrent refreshes
+    # can't fold the same likes in twice
+    post_id = post_scores.c.post_id
+    return (
+        post_scores.update()
+        .where(
+            post_id.in_(list(scores)),
+            post_scores.c.like_count == sqlalchemy.case(seen, value=post_id),
+        )
+        .values(
+            score=sqlalchemy.case(scores, value=post_id),
+            like_count=sqlalchemy.case(likes, value=post_id),
+        )
+    )
+
+
+async def refresh_post_scores(
+    database: Database,
+    now: Optional[float] = None,
+    batch_size: int = REFRESH_BATCH_SIZE,
+) -> int:
+    weight = like_weight(time.time() if now is None else now)
+    refreshed = 0
+    after_id = 0
+    while True:
+        query = select_stale_scores(after_id, batch_size)
+        logger.debug(query)
+        rows = await database.fetch_all(query)
+        if not rows:
+            break
+        after_id = rows[-1]["id"]
+
+        new = [
+            {
+                "post_id": row["id"],
+                "score": weight + math.log1p(row["like_count"]),
+                "like_count": row["like_count"],
+            }
+            for row in rows
+            if row["score"] is None
+        ]
+        changed = [row for row in rows if row["score"] is not None]
+        async with database.transaction():
+            if new:
+                await database.execute(insert_scores_query(database, new))
+            if changed:
+                query = update_scores_query(
+                    {
+                        row["id"]: add_likes(
+                            row["score"],
+                            row["like_count"] - row["scored_likes"],
+                            weight,
+                            row["scored_likes"],
+                        )
+                        for row in changed
+                    },
+                    {row["id"]: row["scored_likes"] for row in changed},
+                    {row["id"]: row["like_count"] for row in changed},
+                )
+                await database.execute(query)
+            await database.execute(clear_stale_query([row["id"] for row in rows]))
+        refreshed += len(rows)
+        if len(rows) < batch_size:
+            break
+
+    if refreshed:
+        metrics.increment("ranking.scores_refreshed", refreshed)
+        await invalidate_feed()
+    return refreshed
+
+
+class ScoreRefresher:
+    def __init__(self, database: Database, interval: float):
+        self.database = database
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> int:
+        if self.database.url.dialect != "postgresql":
+            return await refresh_post_scores(self.database)
+        # the lock belongs to the connection, hold one for the whole refresh
+        async with self.database.connection():
+            locked = await self.database.fetch_val(
+                "SELECT pg_try_advisory_lock(:id)", {"id": RANKING_LOCK_ID}
+            )
+            if not locked:
+                # another worker is at it
+                return 0
+            try:
+                return await refresh_post_scores(self.database)
+            finally:
+                await self.database.execute(
+                    "SELECT pg_advisory_unlock(:id)", {"id": RANKING_LOCK_ID}
+                )
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                # a failed refresh only leaves the ranking a bit staler
+                logger.error(f"Refreshing post scores failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+score_refresher = ScoreRefresher(
+    database, interval=settings.ranking_refresh_interval_seconds
+)
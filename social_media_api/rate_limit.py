@@ -0,0 +1,34 @@
+import asyncio
+import time
+
+
+# refills `rate` tokens per second up to `capacity` (the allowed burst);
+# acquire() waits until enough tokens are there instead of failing
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1) -> float:
+        # returns how long the caller had to wait
+        if tokens > self.capacity:
+            raise ValueError(f"can't take {tokens} tokens, capacity is {self.capacity}")
+        waited = 0.0
+        # one waiter at a time, so a big request isn't starved by small ones
+        async with self._lock:
+            self._refill()
+            while self.tokens < tokens:
+                delay = (tokens - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+                self._refill()
+            self.tokens -= tokens
+        return waited
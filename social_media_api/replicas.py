@@ -0,0 +1,64 @@
+# Read-replica routing.
+#
+# Read-only queries (feed, post detail, comments, user lookups, exports) take
+# their Database from read_database()/get_read_database, which round-robins
+# over settings.read_replica_urls; writes always go to the primary `database`.
+# Replicas lag behind the primary, so after a successful write the client gets
+# a short-lived cookie and its reads go to the primary until it expires: whoever
+# just posted sees their post (read-your-writes). Without replicas configured
+# everything uses the primary and no cookie is set.
+import itertools
+import math
+
+from databases import Database
+from fastapi import Request
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from social_media_api.config import settings
+from social_media_api.database import database, replicas
+
+READ_PRIMARY_COOKIE = "read_primary"
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+_reads = itertools.count()
+
+
+def read_database(use_primary: bool = False) -> Database:
+    if use_primary or not replicas:
+        return database
+    return replicas[next(_reads) % len(replicas)]
+
+
+def is_replica(db: Database) -> bool:
+    return db is not database
+
+
+async def get_read_database(request: Request) -> Database:
+    return read_database(use_primary=READ_PRIMARY_COOKIE in request.cookies)
+
+
+class ReadYourWritesMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in WRITE_METHODS
+            or not replicas
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                max_age = math.ceil(settings.replica_max_lag_seconds)
+                MutableHeaders(scope=message).append(
+                    "set-cookie",
+                    f"{READ_PRIMARY_COOKIE}=1; Max-Age={max_age}; Path=/; "
+                    "HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
@@ -0,0 +1,107 @@
+import csv
+import io
+import logging
+from enum import Enum
+from typing import Annotated, AsyncIterator
+
+import sqlalchemy
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+
+from social_media_api import metrics
+from social_media_api.config import settings
+from social_media_api.database import comments, likes_table, posts
+from social_media_api.models.user import User
+from social_media_api.replicas import read_database
+from social_media_api.security import get_current_admin
+from social_media_api.serializers import dumps
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+class ExportTable(str, Enum):
+    posts = "posts"
+    comments = "comments"
+    likes = "likes"
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+EXPORT_TABLES = {
+    ExportTable.posts: posts,
+    ExportTable.comments: comments,
+    ExportTable.likes: likes_table,
+}
+
+MEDIA_TYPES = {
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.csv: "text/csv",
+}
+
+
+async def iterate_chunks(table: sqlalchemy.Table, chunk_size: int) -> AsyncIterator:
+    # keyset chunks by id: memory stays at one chunk whatever the table size,
+    # and unlike a server-side cursor no connection/transaction is held open
+    # while a slow client downloads
+    db = read_database()
+    last_id = None
+    while True:
+        query = table.select().order_by(table.c.id).limit(chunk_size)
+        if last_id is not None:
+            query = query.where(table.c.id > last_id)
+        logger.debug(query)
+
+        rows = await db.fetch_all(query)
+        if not rows:
+            return
+        metrics.increment("export.rows", len(rows))
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+async def ndjson_lines(table: sqlalchemy.Table) -> AsyncIterator[bytes]:
+    # column names are quoted_name, orjson only takes exact str keys
+    columns = [str(column.name) for column in table.columns]
+    async for rows in iterate_chunks(table, settings.export_chunk_size):
+        yield b"".join(
+            dumps(dict(zip(columns, tuple(row._mapping)))) + b"\n" for row in rows
+        )
+
+
+async def csv_lines(table: sqlalchemy.Table) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(column.name for column in table.columns)
+    async for rows in iterate_chunks(table, settings.export_chunk_size):
+        writer.writerows(tuple(row._mapping) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # an empty table still gets its header row
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@router.get("/export/{table}", response_class=StreamingResponse)
+async def export_table(
+    table: ExportTable,
+    current_user: Annotated[User, Depends(get_current_admin)],
+    format: ExportFormat = ExportFormat.ndjson,
+):
+    logger.info(f"Exporting {table.value} as {format.value}")
+    lines = ndjson_lines if format == ExportFormat.ndjson else csv_lines
+    return StreamingResponse(
+        lines(EXPORT_TABLES[table]),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="{table.value}.{format.value}"'
+            )
+        },
+    )
@@ -1,12 +1,39 @@
 import logging
 from enum import Enum
-from typing import Annotated
+from typing import Annotated, Optional
 
 import sqlalchemy
-from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
+from databases import Database
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
 
-from social_media_api.database import comments, database, likes_table, posts
+from social_media_api.config import settings
+from social_media_api.database import comments, database, post_scores, posts
+from social_media_api.feed_cache import (
+    entry_response,
+    feed_cache,
+    get_feed_version,
+    invalidate_feed,
+    make_entry,
+    page_key,
+)
+from social_media_api.jobs import schedule
+from social_media_api.like_buffer import like_buffer
+from social_media_api.likes import find_likes, insert_likes
 from social_media_api.models.post import (
+    BulkCommentIn,
+    BulkCommentResult,
+    BulkLikeIn,
+    BulkLikeResult,
     Comment,
     CommentIn,
     PostLike,
@@ -17,19 +44,30 @@ from social_media_api.models.post import (
     UserPostWithLikes,
 )
 from social_media_api.models.user import User
+from social_media_api.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    NEXT_CURSOR_HEADER,
+    decode_cursor,
+    encode_cursor,
+)
+from social_media_api.ranking import mark_scores_stale
+from social_media_api.replicas import get_read_database, is_replica
 from social_media_api.security import get_current_user
+from social_media_api.serializers import (
+    dumps,
+    respond,
+    serialize_comment,
+    serialize_post,
+)
 from social_media_api.tasks import generate_and_add_to_post
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 
-# sql outer join
-select_post_and_likes = (
-    (sqlalchemy.select(posts, sqlalchemy.func.count(likes_table.c.id).label("likes")))
-    .select_from(posts.outerjoin(likes_table))
-    .group_by(posts.c.id)
-)
+# likes come from the denormalized counter, no join/aggregate over likes
+select_post_and_likes = sqlalchemy.select(posts, posts.c.like_count.label("likes"))
 
 
 async def find_post(post_id: int):
@@ -39,6 +77,20 @@ async def find_post(post_id: int):
     return await database.fetch_one(query)
 
 
+async def find_existing_post_ids(post_ids: set[int]) -> set[int]:
+    # one set-based existence check instead of a find_post per item
+    query = sqlalchemy.select(posts.c.id).where(posts.c.id.in_(post_ids))
+    logger.debug(query)
+    return {row["id"] for row in await database.fetch_all(query)}
+
+
+def post_not_found_result(post_id: int) -> dict:
+    return {"post_id": post_id, "status": 404, "detail": "Post not found"}
+
+
+LIKE_CONFLICT = "Like was removed concurrently, try again"
+
+
 @router.post("/post", response_model=UserPost, status_code=201)
 async def create_post(
     post: UserPostIn,
@@ -51,15 +103,21 @@ async def create_post(
 
     data = {**post.model_dump(), "user_id": current_user.id}
     query = posts.insert().values(data)
-    last_record_id = await database.execute(query)
+    async with database.transaction():
+        last_record_id = await database.execute(query)
+        # scored by the next ranking refresh
+        await mark_scores_stale(database, [last_record_id])
+    await invalidate_feed()
     if prompt:
-        background_tasks.add_task(
+        await schedule(
+            background_tasks,
             generate_and_add_to_post,
-            current_user.email,
-            last_record_id,
-            request.url_for("get_post_with_comments", post_id=last_record_id),
-            database,
-            prompt,
+            email=current_user.email,
+            post_id=last_record_id,
+            post_url=str(
+                request.url_for("get_post_with_comments", post_id=last_record_id)
+            ),
+            prompt=prompt,
         )
     return {**data, "id": last_record_id}
 
@@ -68,23 +126,108 @@ class PostSorting(str, Enum):
     new = "new"
     old = "old"
     most_likes = "most_likes"
+    # time-decayed likes, precomputed by social_media_api.ranking
+    trending = "trending"
 
 
-@router.get("/post", response_model=list[UserPostWithLikes])
-async def get_all_posts(
-    sorting: PostSorting = PostSorting.new,
-):  # ap.com/post?sorting=most_likes
-    logger.info("Getting all posts")
+SORTING_KEYS = {
+    PostSorting.most_likes: ("likes", "id"),
+    PostSorting.trending: ("score", "id"),
+}
+
+
+feed_page_adapter = TypeAdapter(list[UserPostWithLikes])
+
+
+async def fetch_posts_page(
+    db: Database, sorting: PostSorting, cursor: Optional[str], limit: int
+) -> tuple[list, Optional[str]]:
+    # keyset pagination: every ordering ends in posts.id, so it is total and a
+    # page boundary never shifts when posts are inserted concurrently
+    likes = posts.c.like_count
+    score = post_scores.c.score
+    keys = SORTING_KEYS.get(sorting, ("id",))
+    position = cursor and decode_cursor(cursor, keys, sorting=sorting.value)
+
+    query = select_post_and_likes
     if sorting == PostSorting.new:
-        query = select_post_and_likes.order_by(posts.c.id.desc())
+        if position:
+            query = query.where(posts.c.id < position["id"])
+        query = query.order_by(posts.c.id.desc())
     elif sorting == PostSorting.old:
-        query = select_post_and_likes.order_by(posts.c.id.asc())
+        if position:
+            query = query.where(posts.c.id > position["id"])
+        query = query.order_by(posts.c.id.asc())
     elif sorting == PostSorting.most_likes:
-        query = select_post_and_likes.order_by(sqlalchemy.desc("likes"))
+        if position:
+            query = query.where(
+                sqlalchemy.or_(
+                    likes < position["likes"],
+                    sqlalchemy.and_(
+                        likes == position["likes"], posts.c.id < position["id"]
+                    ),
+                )
+            )
+        query = query.order_by(likes.desc(), posts.c.id.desc())
+    elif sorting == PostSorting.trending:
+        # top-N straight off the (score, post_id) index; posts created since the
+        # last refresh join the ranking on the next one
+        query = query.add_columns(score).join(
+            post_scores, post_scores.c.post_id == posts.c.id
+        )
+        if position:
+            query = query.where(
+                sqlalchemy.or_(
+                    score < position["score"],
+                    sqlalchemy.and_(
+                        score == position["score"],
+                        post_scores.c.post_id < position["id"],
+                    ),
+                )
+            )
+        query = query.order_by(score.desc(), post_scores.c.post_id.desc())
 
+    # fetch one extra row to know whether there is a next page
+    query = query.limit(limit + 1)
     logger.debug(query)
 
-    return await database.fetch_all(query)
+    page = await db.fetch_all(query)
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    last = page[-1]
+    return page, encode_cursor(
+        {"sorting": sorting.value, **{key: last[key] for key in keys}}
+    )
+
+
+@router.get("/post", response_model=list[UserPostWithLikes])
+async def get_all_posts(
+    request: Request,
+    db: Annotated[Database, Depends(get_read_database)],
+    sorting: PostSorting = PostSorting.new,
+    cursor: Optional[str] = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+):  # ap.com/post?sorting=most_likes&cursor=...
+    logger.info("Getting all posts")
+    source = "replica" if is_replica(db) else "primary"
+    key = page_key(await get_feed_version(), source, sorting.value, cursor, limit)
+    entry = await feed_cache.get(key)
+    if entry is None:
+        page, next_cursor = await fetch_posts_page(db, sorting, cursor, limit)
+        if settings.fast_serialization:
+            body = dumps(serialize_post.many(page))
+        else:
+            body = feed_page_adapter.dump_json(
+                feed_page_adapter.validate_python(page, from_attributes=True)
+            )
+        entry = make_entry(body, next_cursor)
+        # a lagging replica may have missed the write that bumped the version,
+        # don't let its page outlive the lag
+        ttl = settings.replica_max_lag_seconds if is_replica(db) else None
+        await feed_cache.set(key, entry, ttl=ttl)
+    # served from the cache or not, an unchanged page is a 304
+    return entry_response(request, entry, NEXT_CURSOR_HEADER)
 
 
 @router.post("/comment", response_model=Comment, status_code=201)
@@ -103,42 +246,213 @@ async def create_comment(
     return new_comment
 
 
-@router.get("/post/{post_id}/comment", response_model=list[Comment])
-async def get_comments_on_post(post_id: int):
+def select_comments_page(post_id: int, position: Optional[dict], limit: int):
     query = comments.select().where(comments.c.post_id == post_id)
-    return await database.fetch_all(query)
+    if position:
+        query = query.where(comments.c.id > position["id"])
+    # one extra row tells whether there is a next page
+    return query.order_by(comments.c.id.asc()).limit(limit + 1)
+
+
+def set_next_comments_cursor(
+    response: Response, post_id: int, page: list, limit: int
+) -> list:
+    if len(page) > limit:
+        page = page[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            {"post_id": post_id, "id": page[-1]["id"]}
+        )
+    return page
+
+
+@router.post("/comment/bulk", response_model=list[BulkCommentResult])
+async def create_comments_bulk(
+    bulk: BulkCommentIn, current_user: Annotated[User, Depends(get_current_user)]
+):
+    logger.info(f"Creating {len(bulk.comments)} comments")
+    existing = await find_existing_post_ids(
+        {comment.post_id for comment in bulk.comments}
+    )
+
+    data = [
+        {**comment.model_dump(), "user_id": current_user.id}
+        for comment in bulk.comments
+        if comment.post_id in existing
+    ]
+    inserted = []
+    if data:
+        query = comments.insert().values(data).returning(comments)
+        logger.debug(query)
+        async with database.transaction():
+            inserted = await database.fetch_all(query)
+    # ids are handed out in VALUES order, so sorting restores the request order
+    inserted = iter(sorted(inserted, key=lambda comment: comment["id"]))
+    return [
+        (
+            {"post_id": comment.post_id, "status": 201, "comment": next(inserted)}
+            if comment.post_id in existing
+            else post_not_found_result(comment.post_id)
+        )
+        for comment in bulk.comments
+    ]
+
+
+@router.get("/post/{post_id}/comment", response_model=list[Comment])
+async def get_comments_on_post(
+    post_id: int,
+    response: Response,
+    db: Annotated[Database, Depends(get_read_database)],
+    cursor: Optional[str] = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+):
+    position = cursor and decode_cursor(cursor, ("id",), post_id=post_id)
+    query = select_comments_page(post_id, position, limit)
+    logger.debug(query)
+
+    page = await db.fetch_all(query)
+    page = set_next_comments_cursor(response, post_id, page, limit)
+    return respond(serialize_comment.many(page), response)
 
 
 @router.get("/post/{post_id}", response_model=UserPostWithComments)
-async def get_post_with_comments(post_id: int):
+async def get_post_with_comments(
+    post_id: int,
+    response: Response,
+    db: Annotated[Database, Depends(get_read_database)],
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+):
     logger.info("Getting post and its comments and likes")
 
-    query = select_post_and_likes.where(posts.c.id == post_id)
+    # post, like count and the first page of comments in one round-trip: the post
+    # columns repeat on every comment row, a post without comments is one row
+    # with NULL comment columns
+    page = select_comments_page(post_id, None, limit).subquery()
+    query = (
+        select_post_and_likes.add_columns(
+            page.c.id.label("comment_id"),
+            page.c.body.label("comment_body"),
+            page.c.user_id.label("comment_user_id"),
+        )
+        .select_from(posts.outerjoin(page, page.c.post_id == posts.c.id))
+        .where(posts.c.id == post_id)
+        .order_by(page.c.id.asc())
+    )
     logger.debug(query)
 
-    post = await database.fetch_one(query)
+    rows = await db.fetch_all(query)
 
-    if not post:
+    if not rows:
         raise HTTPException(status_code=404, detail="Post not found")
-    return {
-        "post": post,
-        "comments": await get_comments_on_post(post_id),
-    }
+    post_comments = [
+        {
+            "id": row["comment_id"],
+            "body": row["comment_body"],
+            "post_id": post_id,
+            "user_id": row["comment_user_id"],
+        }
+        for row in rows
+        if row["comment_id"] is not None
+    ]
+    post_comments = set_next_comments_cursor(response, post_id, post_comments, limit)
+    return respond(
+        {"post": serialize_post(rows[0]), "comments": post_comments}, response
+    )
 
 
 # Define Likes endpoints
-@router.post("/like", response_model=PostLike, status_code=201)
+# liking is idempotent: 201 for a new like, 200 with the existing one otherwise,
+# 202 when the like_buffer is enabled and the like will be written shortly
+@router.post(
+    "/like",
+    response_model=PostLike,
+    status_code=201,
+    responses={202: {"description": "Like buffered, written on the next flush"}},
+)
 async def like_post(
-    like: PostLikeIn, current_user: Annotated[User, Depends(get_current_user)]
+    like: PostLikeIn,
+    current_user: Annotated[User, Depends(get_current_user)],
+    response: Response,
 ):
     logger.info("Liking Post")
     post = await find_post(like.post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post Not Found")
 
+    if settings.like_buffer_enabled:
+        like_buffer.add(like.post_id, current_user.id)
+        return JSONResponse(
+            status_code=202,
+            content={"post_id": like.post_id, "user_id": current_user.id},
+        )
+
     data = {**like.model_dump(), "user_id": current_user.id}
-    query = likes_table.insert().values(data)
+    # an unlike can remove the existing like between the insert and the lookup,
+    # then the like is inserted after all; an endless tug of war gets a 409
+    for _ in range(2):
+        if inserted := await insert_likes(database, [data]):
+            return inserted[0]
+        if existing := await find_likes(database, current_user.id, {like.post_id}):
+            response.status_code = 200
+            return existing[0]
+    raise HTTPException(status_code=409, detail=LIKE_CONFLICT)
 
-    logger.debug(query)
-    last_record_id = await database.execute(query)
-    return {**data, "id": last_record_id}
+
+@router.delete("/like/{post_id}", status_code=204)
+async def unlike_post(
+    post_id: int, current_user: Annotated[User, Depends(get_current_user)]
+):
+    logger.info("Unliking Post")
+    # idempotent as well, unliking a post that isn't liked is not an error
+    # also cancels the like if it's still in the buffer
+    await like_buffer.unlike(post_id, current_user.id)
+
+
+@router.post("/like/bulk", response_model=list[BulkLikeResult])
+async def like_posts_bulk(
+    bulk: BulkLikeIn, current_user: Annotated[User, Depends(get_current_user)]
+):
+    logger.info(f"Liking {len(bulk.likes)} posts")
+    # each post once, in request order; repeats get the like of the first one
+    post_ids = list(dict.fromkeys(like.post_id for like in bulk.likes))
+    existing = await find_existing_post_ids(set(post_ids))
+
+    data = [
+        {"post_id": post_id, "user_id": current_user.id}
+        for post_id in post_ids
+        if post_id in existing
+    ]
+    inserted = await insert_likes(database, data) if data else []
+    results = {
+        like["post_id"]: {"post_id": like["post_id"], "status": 201, "like": like}
+        for like in inserted
+    }
+    if liked_before := existing - results.keys():
+        for like in await find_likes(database, current_user.id, liked_before):
+            results[like["post_id"]] = {
+                "post_id": like["post_id"],
+                "status": 200,
+                "like": like,
+            }
+    # unliked between the insert and the lookup: like them again, once
+    if unliked := [like for like in data if like["post_id"] not in results]:
+        for like in await insert_likes(database, unliked):
+            results[like["post_id"]] = {
+                "post_id": like["post_id"],
+                "status": 201,
+                "like": like,
+            }
+
+    response = []
+    for like in bulk.likes:
+        if like.post_id not in existing:
+            response.append(post_not_found_result(like.post_id))
+            continue
+        if like.post_id not in results:
+            response.append(
+                {"post_id": like.post_id, "status": 409, "detail": LIKE_CONFLICT}
+            )
+            continue
+        response.append(results[like.post_id])
+        # a repeated post id in the same request finds its like already there
+        results[like.post_id] = {**results[like.post_id], "status": 200}
+    return response
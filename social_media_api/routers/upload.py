@@ -1,20 +1,50 @@
+import asyncio
+import hashlib
 import logging
 import tempfile
+import time
+import uuid
+from typing import Annotated, Optional
 
 import aiofiles
-from fastapi import APIRouter, HTTPException, UploadFile, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    UploadFile,
+    status,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 
-from social_media_api.libs.b2 import b2_upload_file
+from social_media_api.config import settings
+from social_media_api.database import database, upload_parts, upload_sessions
+from social_media_api.models.upload import (
+    UploadComplete,
+    UploadPart,
+    UploadSession,
+    UploadSessionIn,
+)
+from social_media_api.models.user import User
+from social_media_api.security import get_current_user
+from social_media_api.storage import MAX_PARTS, MIN_PART_SIZE, MIN_PARTS, storage
+from social_media_api.uploads import (
+    UPLOAD_ABORTED,
+    UPLOAD_COMPLETE,
+    UPLOAD_EXPIRED,
+    UPLOAD_OPEN,
+    find_uploaded_file,
+    record_uploaded_file,
+    stream_upload,
+)
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-
-# client splits up file into  chunks 1 MB
-# clients send chunks 1 at a time
-# client sends the last chunk
-
 CHUNK_SIZE = 1024 * 1024  # 1 MB
 
 
@@ -28,16 +58,27 @@ async def upload_file(file: UploadFile):
             logger.info(f"Saving uploaded file temporarily to {file_name}")
 
             # Open the temp file asynchronously for writing binary data
+            digest = hashlib.sha256()
+            size = 0
             async with aiofiles.open(file_name, "wb") as f:
-                # Read chunks asynchronously and write them to the file
+                # Read chunks asynchronously and write them to the file,
+                # hashing them on the way
                 while chunk := await file.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    size += len(chunk)
                     await f.write(chunk)
 
-            # Upload the completed temp file to Backblaze B2
-            file_url = b2_upload_file(
-                local_file=file_name,
-                file_name=file.filename,  # original client file name
-            )
+            # the same bytes were uploaded before, reuse that file
+            file_url = await find_uploaded_file(digest.hexdigest())
+            if file_url is None:
+                # Upload the completed temp file to storage, which blocks so
+                # keep it off the event loop
+                file_url = await asyncio.to_thread(
+                    storage.upload_file,
+                    local_file=file_name,
+                    file_name=file.filename,  # original client file name
+                )
+                await record_uploaded_file(digest.hexdigest(), file_url, size)
 
     except Exception as e:
         logger.error(f"Error uploading file: {e}")
@@ -47,3 +88,256 @@ async def upload_file(file: UploadFile):
         )
 
     return {"message": "Upload successful", "file_url": file_url}
+
+
+# the raw request body is the file, streamed to storage as it arrives without a temp
+# file; prefer this over /upload for large files. Clients that send the
+# X-Content-SHA256 of the file skip the upload if it's already stored (which
+# hands out the url to anyone who knows the digest: fine for public media).
+@router.post("/upload/stream", status_code=201)
+async def upload_stream(
+    request: Request,
+    file_name: str = Query(min_length=1),
+    x_content_sha256: Annotated[Optional[str], Header()] = None,
+):
+    if x_content_sha256 is not None:
+        if file_url := await find_uploaded_file(x_content_sha256.lower()):
+            return {"message": "Upload successful", "file_url": file_url}
+    try:
+        file_url = await stream_upload(
+            request.stream(),
+            file_name=file_name,
+            content_type=request.headers.get("content-type"),
+        )
+    except Exception as e:
+        logger.error(f"Error uploading file: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="There was an error uploading the file.",
+        )
+
+    return {"message": "Upload successful", "file_url": file_url}
+
+
+# Resumable uploads, for large files over unreliable connections:
+#
+#   POST   /uploads                        start one, returns its upload_id
+#   PUT    /uploads/{id}/parts/{n}         body is part n (1-based), optionally
+#                                          with an X-Content-SHA1 header
+#   GET    /uploads/{id}                   the parts received so far
+#   POST   /uploads/{id}/complete          assemble the parts into the file
+#   DELETE /uploads/{id}                   abort
+#
+# Every part goes straight to storage as a part of a large file and is
+# recorded once it's stored, so after a dropped connection the client asks which parts
+# arrived and sends only the rest. Parts are independent, clients may send
+# several at once and in any order.
+async def find_open_upload(upload_id: str, user: User):
+    query = upload_sessions.select().where(
+        upload_sessions.c.id == upload_id, upload_sessions.c.user_id == user.id
+    )
+    upload = await database.fetch_one(query)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if upload.status == UPLOAD_OPEN and upload.expires_at < time.time():
+        # not cleaned up yet
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=f"Upload is {UPLOAD_EXPIRED}"
+        )
+    if upload.status != UPLOAD_OPEN:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=f"Upload is {upload.status}"
+        )
+    return upload
+
+
+async def find_parts(upload_id: str) -> list[UploadPart]:
+    query = (
+        upload_parts.select()
+        .where(upload_parts.c.upload_id == upload_id)
+        .order_by(upload_parts.c.part_number)
+    )
+    return [
+        UploadPart(part_number=row.part_number, size=row.size, sha1=row.sha1)
+        for row in await database.fetch_all(query)
+    ]
+
+
+def upload_response(upload, parts: list[UploadPart]) -> UploadSession:
+    return UploadSession(
+        upload_id=upload["id"],
+        file_name=upload["file_name"],
+        status=upload["status"],
+        min_part_size=MIN_PART_SIZE,
+        max_part_size=settings.upload_max_part_size_bytes,
+        min_parts=MIN_PARTS,
+        expires_at=upload["expires_at"],
+        parts=parts,
+    )
+
+
+async def read_part(request: Request) -> bytes:
+    data = bytearray()
+    async for chunk in request.stream():
+        data += chunk
+        if len(data) > settings.upload_max_part_size_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Part too large",
+            )
+    return bytes(data)
+
+
+def storage_error(e: Exception) -> HTTPException:
+    logger.error(f"Error uploading file: {e}")
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail="There was an error uploading the file.",
+    )
+
+
+@router.post("/uploads", response_model=UploadSession, status_code=201)
+async def initiate_upload(
+    upload: UploadSessionIn, current_user: Annotated[User, Depends(get_current_user)]
+):
+    try:
+        b2_file_id = await asyncio.to_thread(
+            storage.start_large_file, upload.file_name, upload.content_type
+        )
+    except Exception as e:
+        raise storage_error(e)
+
+    now = time.time()
+    data = {
+        "id": uuid.uuid4().hex,
+        "user_id": current_user.id,
+        "file_name": upload.file_name,
+        "content_type": upload.content_type,
+        "b2_file_id": b2_file_id,
+        "status": UPLOAD_OPEN,
+        "created_at": now,
+        "expires_at": now + settings.upload_session_ttl_seconds,
+    }
+    await database.execute(upload_sessions.insert().values(data))
+    return upload_response(data, [])
+
+
+@router.put("/uploads/{upload_id}/parts/{part_number}", response_model=UploadPart)
+async def upload_part(
+    upload_id: str,
+    part_number: Annotated[int, Path(ge=1, le=MAX_PARTS)],
+    request: Request,
+    current_user: Annotated[User, Depends(get_current_user)],
+    x_content_sha1: Annotated[Optional[str], Header()] = None,
+):
+    upload = await find_open_upload(upload_id, current_user)
+    data = await read_part(request)
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty part")
+    sha1 = hashlib.sha1(data).hexdigest()
+    if x_content_sha1 is not None and x_content_sha1.lower() != sha1:
+        raise HTTPException(status_code=400, detail="Checksum mismatch")
+
+    part = UploadPart(part_number=part_number, size=len(data), sha1=sha1)
+    # a retry of a part that did arrive (the response got lost) is a no-op
+    if part in await find_parts(upload_id):
+        return part
+
+    try:
+        await asyncio.to_thread(
+            storage.upload_part, upload.b2_file_id, part_number, data, sha1
+        )
+    except Exception as e:
+        raise storage_error(e)
+
+    dialect = postgresql if database.url.dialect == "postgresql" else sqlite
+    query = (
+        dialect.insert(upload_parts)
+        .values(upload_id=upload_id, **part.model_dump())
+        .on_conflict_do_update(
+            index_elements=["upload_id", "part_number"],
+            set_={"size": part.size, "sha1": part.sha1},
+        )
+    )
+    await database.execute(query)
+    await database.execute(
+        upload_sessions.update()
+        .where(upload_sessions.c.id == upload_id)
+        .values(expires_at=time.time() + settings.upload_session_ttl_seconds)
+    )
+    return part
+
+
+@router.get("/uploads/{upload_id}", response_model=UploadSession)
+async def get_upload(
+    upload_id: str, current_user: Annotated[User, Depends(get_current_user)]
+):
+    query = upload_sessions.select().where(
+        upload_sessions.c.id == upload_id,
+        upload_sessions.c.user_id == current_user.id,
+    )
+    upload = await database.fetch_one(query)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload_response(upload, await find_parts(upload_id))
+
+
+async def set_upload_status(upload_id: str, upload_status: str) -> None:
+    query = (
+        upload_sessions.update()
+        .where(upload_sessions.c.id == upload_id)
+        .values(status=upload_status)
+    )
+    await database.execute(query)
+
+
+@router.post("/uploads/{upload_id}/complete", response_model=UploadComplete)
+async def complete_upload(
+    upload_id: str, current_user: Annotated[User, Depends(get_current_user)]
+):
+    upload = await find_open_upload(upload_id, current_user)
+    parts = await find_parts(upload_id)
+    if not parts:
+        raise HTTPException(status_code=400, detail="No parts uploaded")
+    received = {part.part_number for part in parts}
+    missing = sorted(set(range(1, parts[-1].part_number + 1)) - received)
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Missing parts: {missing}")
+    if len(parts) < MIN_PARTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A resumable upload needs at least {MIN_PARTS} parts, "
+            "send smaller files to /upload/stream",
+        )
+    if any(part.size < MIN_PART_SIZE for part in parts[:-1]):
+        raise HTTPException(
+            status_code=400,
+            detail=f"All parts but the last must be at least {MIN_PART_SIZE} bytes",
+        )
+
+    try:
+        file_url = await asyncio.to_thread(
+            storage.finish_large_file, upload.b2_file_id, [part.sha1 for part in parts]
+        )
+    except Exception as e:
+        raise storage_error(e)
+
+    await set_upload_status(upload_id, UPLOAD_COMPLETE)
+    return UploadComplete(message="Upload successful", file_url=file_url)
+
+
+@router.delete("/uploads/{upload_id}", status_code=204)
+async def abort_upload(
+    upload_id: str, current_user: Annotated[User, Depends(get_current_user)]
+):
+    upload = await find_open_upload(upload_id, current_user)
+    try:
+        # drops the parts already stored
+        await asyncio.to_thread(storage.cancel_large_file, upload.b2_file_id)
+    except Exception as e:
+        raise storage_error(e)
+
+    await database.execute(
+        upload_parts.delete().where(upload_parts.c.upload_id == upload_id)
+    )
+    await set_upload_status(upload_id, UPLOAD_ABORTED)
@@ -4,14 +4,16 @@ from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, status
 
 from social_media_api import tasks
 from social_media_api.database import database, user_table
+from social_media_api.jobs import schedule
 from social_media_api.models.user import UserIn
 from social_media_api.security import (
     authenticate_user,
     create_access_token,
     create_confirmation_token,
-    get_password_hash,
     get_subject_for_token_type,
     get_user,
+    hash_password,
+    invalidate_cached_user,
 )
 
 logger = logging.getLogger(__name__)
@@ -29,18 +31,21 @@ async def register_user(
             detail="A user with this email already exists",
         )
         # never store password as plain text, hash it
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     query = user_table.insert().values(email=user.email, password=hashed_password)
 
     logger.debug(query)
 
     await database.execute(query)
 
-    background_tasks.add_task(
+    await schedule(
+        background_tasks,
         tasks.send_user_registration_email,
-        user.email,
-        confirmation_url=request.url_for(
-            "confirm_email", token=create_confirmation_token(user.email)
+        email=user.email,
+        confirmation_url=str(
+            request.url_for(
+                "confirm_email", token=create_confirmation_token(user.email)
+            )
         ),
     )
 
@@ -63,5 +68,6 @@ async def confirm_email(token: str):
     logger.debug(query)
 
     await database.execute(query)
+    await invalidate_cached_user(email)
 
     return {"detail": "User Confirmed"}
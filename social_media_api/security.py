@@ -1,14 +1,21 @@
+import hashlib
 import logging
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Annotated, Literal
+from typing import Annotated, Literal, Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import ExpiredSignatureError, JWTError, jwt
 from passlib.context import CryptContext
 
+from social_media_api import metrics
+from social_media_api.cache import Cache, TTLCache
 from social_media_api.config import get_settings
 from social_media_api.database import database, user_table
+from social_media_api.models.user import User
+from social_media_api.offload import BoundedExecutor, ExecutorOverloadedError
+from social_media_api.replicas import is_replica, read_database
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -19,6 +26,21 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = BoundedExecutor(
+    "password_hash",
+    kind=settings.password_hash_executor,
+    max_workers=settings.password_hash_workers,
+    max_pending=settings.password_hash_max_pending,
+)
+
+# email -> {"id", "email"} of authenticated users, never the password hash
+user_cache = Cache(
+    "user", ttl=settings.user_cache_ttl_seconds, max_size=settings.user_cache_max_size
+)
+# sha256(token) -> verified payload; clients reuse one access token for 30 minutes
+# so the signature is checked once per worker, not once per request. The digest
+# covers the signature, a tampered token never matches a cached entry.
+token_cache = TTLCache(max_size=settings.token_cache_max_size, ttl=0)
 
 
 def access_token_expire_minutes() -> int:
@@ -58,14 +80,56 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+# bcrypt takes tens of ms of CPU, async handlers must use these two
+async def hash_password(password: str) -> str:
+    return await _run_password_hasher(get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run_password_hasher(verify_password, plain_password, hashed_password)
+
+
+async def _run_password_hasher(func, *args):
+    try:
+        return await password_hasher.run(func, *args)
+    except ExecutorOverloadedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": "1"},
+        ) from e
+
+
 async def get_user(email: str):
     logger.debug("Fetching user from the database", extra={"email": email})
     query = user_table.select().where(user_table.c.email == email)
-    result = await database.fetch_one(query)
+    db = read_database()
+    result = await db.fetch_one(query)
+    # a replica that hasn't caught up can only be missing the user or their
+    # confirmation, the primary has the final word on both
+    if is_replica(db) and (result is None or not result.confirmed):
+        result = await database.fetch_one(query)
     if result:
         return result
 
 
+async def get_cached_user(email: str) -> Optional[User]:
+    cached = await user_cache.get(email)
+    if cached is not None:
+        return User(**cached)
+
+    user = await get_user(email)
+    if user is None:
+        return None
+    user = User(id=user.id, email=user.email)
+    await user_cache.set(email, user.model_dump())
+    return user
+
+
+async def invalidate_cached_user(email: str) -> None:
+    await user_cache.delete(email)
+
+
 def create_credentials_exception(detail: str) -> HTTPException:
     return HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
 
@@ -74,17 +138,21 @@ async def authenticate_user(email: str, password: str):
     user = await get_user(email)
     if not user:
         raise create_credentials_exception("Invalid email or password")
-    if not verify_password(password, user.password):
+    if not await check_password(password, user.password):
         raise create_credentials_exception("Invalid email or password")
     if not user.confirmed:
         raise create_credentials_exception("User has not confirmed email")
     return user
 
 
-# get subject of token from payload
-def get_subject_for_token_type(
-    token: str, type: Literal["access", "confiramtion"]
-) -> str:
+def decode_token(token: str) -> dict:
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(digest)
+    if payload is not None:
+        metrics.increment("token_cache.hits")
+        return payload
+    metrics.increment("token_cache.misses")
+
     try:
         payload = jwt.decode(token, key=SECRET_KEY, algorithms=[ALGORITHM])
 
@@ -93,6 +161,18 @@ def get_subject_for_token_type(
     except JWTError as e:
         raise create_credentials_exception("Invalid Token") from e
 
+    expires_in = payload.get("exp", 0) - time.time()
+    if expires_in > 0:
+        token_cache.set(digest, payload, ttl=expires_in)
+    return payload
+
+
+# get subject of token from payload
+def get_subject_for_token_type(
+    token: str, type: Literal["access", "confiramtion"]
+) -> str:
+    payload = decode_token(token)
+
     email = payload.get("sub")
     if email is None:
         raise create_credentials_exception("Token missing 'sub' field")
@@ -105,9 +185,20 @@ def get_subject_for_token_type(
 
 
 # check whether token is access or confirmation
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+# FastAPI already runs this once per request, the cache saves the query across them
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> User:
     email = get_subject_for_token_type(token, "access")
-    user = await get_user(email=email)
+    user = await get_cached_user(email=email)
     if user is None:
         raise create_credentials_exception("Could not find user for this token")
     return user
+
+
+async def get_current_admin(
+    current_user: Annotated[User, Depends(get_current_user)],
+) -> User:
+    if current_user.email != settings.admin_email:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions"
+        )
+    return current_user
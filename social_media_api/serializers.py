@@ -0,0 +1,73 @@
+# Fast response serialization for read endpoints.
+#
+# By default FastAPI validates every returned Record against the endpoint's
+# response_model before encoding it. Rows straight from our own tables already
+# have the right shape, so with settings.fast_serialization the read endpoints
+# pick the model's fields out of each row with a pre-built serializer and encode
+# the result with orjson, skipping per-row validation entirely. Only content
+# built by these serializers may go through respond().
+#
+#   python -m social_media_api.benchmarks.serialization
+import json
+from operator import itemgetter
+from typing import Any
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from social_media_api.config import settings
+from social_media_api.models.post import Comment, UserPostWithLikes
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the stdlib encoder
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RowSerializer:
+    # Record -> dict with exactly the model's fields, in the model's order.
+    # Record.__getitem__ resolves the column and its result processor on every
+    # access; instead the field positions are looked up once per result and
+    # each row is read as a plain tuple. The models here only have int/str
+    # columns, which have no result processors to skip.
+    def __init__(self, model: type[BaseModel]):
+        self.fields = tuple(model.model_fields)
+
+    def _getter(self, row) -> itemgetter:
+        columns = list(row._mapping.keys())
+        return itemgetter(*(columns.index(field) for field in self.fields))
+
+    def __call__(self, row) -> dict:
+        return self.many([row])[0]
+
+    def many(self, rows) -> list[dict]:
+        if not rows:
+            return []
+        fields, get = self.fields, self._getter(rows[0])
+        return [dict(zip(fields, get(tuple(row._mapping)))) for row in rows]
+
+
+serialize_post = RowSerializer(UserPostWithLikes)
+serialize_comment = RowSerializer(Comment)
+
+
+def respond(content: Any, response: Response):
+    # content goes out as is, keeping the headers/status set on the injected
+    # response; without fast_serialization FastAPI validates it as usual
+    if not settings.fast_serialization:
+        return content
+    return FastJSONResponse(
+        content, status_code=response.status_code or 200, headers=response.headers
+    )
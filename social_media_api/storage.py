@@ -0,0 +1,295 @@
+# Where uploaded files are kept, chosen with settings.storage_backend:
+#
+#   b2      Backblaze B2 (libs/b2), the production store
+#   local   a directory on this machine (storage_local_root), served by the app
+#           under /media; for small single-server deployments
+#   memory  a dict in this process, for tests and for load testing the upload
+#           path offline (python -m social_media_api.benchmarks.uploads)
+#
+# Every backend stores single files and multi-part "large files" (see
+# uploads.py and the resumable upload API) and returns the public url of what
+# it stored. The methods block, call them from a thread.
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path, PurePosixPath
+from typing import Optional
+
+from social_media_api.config import settings
+from social_media_api.libs.b2 import (
+    B2_MAX_PARTS,
+    B2_MIN_PART_SIZE,
+    b2_cancel_large_file,
+    b2_delete_file,
+    b2_finish_large_file,
+    b2_start_large_file,
+    b2_upload_bytes,
+    b2_upload_file,
+    b2_upload_part,
+)
+
+logger = logging.getLogger(__name__)
+
+# large file limits, B2's on every backend so clients behave the same anywhere
+MIN_PART_SIZE = B2_MIN_PART_SIZE
+MAX_PARTS = B2_MAX_PARTS
+# B2 won't finish a large file of one part, small files are single uploads
+MIN_PARTS = 2
+
+MEDIA_PATH = "/media"
+
+COPY_CHUNK = 8 * 1024 * 1024
+
+
+class StorageBackend(ABC):
+    # returns the url
+    @abstractmethod
+    def upload_file(self, local_file: str, file_name: str) -> str: ...
+
+    @abstractmethod
+    def upload_bytes(
+        self, data: bytes, file_name: str, content_type: Optional[str] = None
+    ) -> str: ...
+
+    # returns the id of the large file
+    @abstractmethod
+    def start_large_file(
+        self, file_name: str, content_type: Optional[str] = None
+    ) -> str: ...
+
+    # parts are numbered from 1, returns the part's sha1
+    @abstractmethod
+    def upload_part(
+        self, file_id: str, part_number: int, data: bytes, sha1: Optional[str] = None
+    ) -> str: ...
+
+    # returns the url
+    @abstractmethod
+    def finish_large_file(self, file_id: str, part_sha1s: list[str]) -> str: ...
+
+    @abstractmethod
+    def cancel_large_file(self, file_id: str) -> None: ...
+
+    # file_name as it was uploaded
+    @abstractmethod
+    def delete_file(self, file_url: str, file_name: str) -> None: ...
+
+
+class B2StorageBackend(StorageBackend):
+    def upload_file(self, local_file: str, file_name: str) -> str:
+        return b2_upload_file(local_file=local_file, file_name=file_name)
+
+    def upload_bytes(self, data, file_name, content_type=None) -> str:
+        return b2_upload_bytes(data, file_name, content_type)
+
+    def start_large_file(self, file_name, content_type=None) -> str:
+        return b2_start_large_file(file_name, content_type)
+
+    def upload_part(self, file_id, part_number, data, sha1=None) -> str:
+        return b2_upload_part(file_id, part_number, data, sha1)
+
+    def finish_large_file(self, file_id, part_sha1s) -> str:
+        return b2_finish_large_file(file_id, part_sha1s)
+
+    def cancel_large_file(self, file_id) -> None:
+        b2_cancel_large_file(file_id)
+
+    def delete_file(self, file_url, file_name) -> None:
+        b2_delete_file(file_url, file_name)
+
+
+def storage_key(file_name: str) -> str:
+    # B2 gives every upload its own url even when names repeat; the other
+    # backends get that (and safe paths) from a random prefix and a name
+    # without directory tricks
+    parts = [
+        part for part in PurePosixPath(file_name).parts if part not in ("/", ".", "..")
+    ]
+    return "/".join([uuid.uuid4().hex, *parts])
+
+
+def check_part(data: bytes, sha1: Optional[str]) -> str:
+    actual = hashlib.sha1(data).hexdigest()
+    if sha1 is not None and sha1 != actual:
+        raise ValueError(f"part checksum mismatch: {sha1} != {actual}")
+    return actual
+
+
+def check_parts(part_sha1s: list[str]) -> None:
+    if len(part_sha1s) < MIN_PARTS:
+        raise ValueError(f"a large file needs at least {MIN_PARTS} parts")
+
+
+def copy_fd(src: int, dst: int) -> int:
+    # file to file inside the kernel: copy_file_range (reflinks / server side
+    # copies where the filesystem can), then sendfile, then a plain read/write
+    # loop where neither works (other OS, across filesystems on old kernels)
+    copied = 0
+    kernel_copies = []
+    if hasattr(os, "copy_file_range"):
+        kernel_copies.append(lambda: os.copy_file_range(src, dst, COPY_CHUNK))
+    if hasattr(os, "sendfile"):
+        kernel_copies.append(lambda: os.sendfile(dst, src, None, COPY_CHUNK))
+    for copy in kernel_copies:
+        try:
+            while n := copy():
+                copied += n
+            return copied
+        except OSError as e:
+            unsupported = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP)
+            if copied or e.errno not in unsupported:
+                raise
+    while chunk := os.read(src, COPY_CHUNK):
+        os.write(dst, chunk)
+        copied += len(chunk)
+    return copied
+
+
+def default_work_root(root: str) -> Path:
+    # media -> media-work, next to the served directory
+    path = Path(root).resolve()
+    return path.with_name(path.name + "-work")
+
+
+class LocalStorageBackend(StorageBackend):
+    def __init__(self, root: str, public_url: str, work_root: Optional[str] = None):
+        self.root = Path(root)
+        self.public_url = public_url.rstrip("/")
+        # parts and files being written, outside the served root; on the same
+        # filesystem, finished files are renamed into root
+        self.work_root = Path(work_root) if work_root else default_work_root(root)
+
+    def _url(self, key: str) -> str:
+        return f"{self.public_url}/{key}"
+
+    def _write(self, key: str, write) -> str:
+        # written aside and renamed, so readers never see half a file
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partials = self.work_root / "partial"
+        partials.mkdir(parents=True, exist_ok=True)
+        partial = partials / uuid.uuid4().hex
+        try:
+            with open(partial, "wb") as out:
+                write(out)
+            os.replace(partial, path)
+        finally:
+            partial.unlink(missing_ok=True)
+        return self._url(key)
+
+    def upload_file(self, local_file, file_name) -> str:
+        def write(out):
+            with open(local_file, "rb") as src:
+                copy_fd(src.fileno(), out.fileno())
+
+        return self._write(storage_key(file_name), write)
+
+    def upload_bytes(self, data, file_name, content_type=None) -> str:
+        return self._write(storage_key(file_name), lambda out: out.write(data))
+
+    def _parts_dir(self, file_id: str) -> Path:
+        if not file_id.isalnum():
+            raise ValueError(f"Invalid large file id {file_id!r}")
+        return self.work_root / "parts" / file_id
+
+    def start_large_file(self, file_name, content_type=None) -> str:
+        file_id = uuid.uuid4().hex
+        parts = self._parts_dir(file_id)
+        parts.mkdir(parents=True)
+        (parts / "name").write_text(file_name)
+        return file_id
+
+    def upload_part(self, file_id, part_number, data, sha1=None) -> str:
+        sha1 = check_part(data, sha1)
+        (self._parts_dir(file_id) / str(part_number)).write_bytes(data)
+        return sha1
+
+    def finish_large_file(self, file_id, part_sha1s) -> str:
+        check_parts(part_sha1s)
+        parts = self._parts_dir(file_id)
+
+        def write(out):
+            for number in range(1, len(part_sha1s) + 1):
+                with open(parts / str(number), "rb") as part:
+                    copy_fd(part.fileno(), out.fileno())
+
+        url = self._write(storage_key((parts / "name").read_text()), write)
+        shutil.rmtree(parts)
+        return url
+
+    def cancel_large_file(self, file_id) -> None:
+        shutil.rmtree(self._parts_dir(file_id), ignore_errors=True)
+
+    def delete_file(self, file_url, file_name) -> None:
+        key = file_url.removeprefix(self.public_url + "/")
+        if ".." in PurePosixPath(key).parts:
+            raise ValueError(f"Invalid file url {file_url!r}")
+        (self.root / key).unlink(missing_ok=True)
+
+
+class MemoryStorageBackend(StorageBackend):
+    def __init__(self):
+        # key -> content
+        self.files: dict[str, bytes] = {}
+        self.large_files: dict[str, dict] = {}
+
+    def get(self, url: str) -> bytes:
+        return self.files[url.removeprefix("memory://")]
+
+    def _store(self, file_name: str, data: bytes) -> str:
+        key = storage_key(file_name)
+        self.files[key] = data
+        return f"memory://{key}"
+
+    def upload_file(self, local_file, file_name) -> str:
+        with open(local_file, "rb") as src:
+            return self._store(file_name, src.read())
+
+    def upload_bytes(self, data, file_name, content_type=None) -> str:
+        return self._store(file_name, bytes(data))
+
+    def start_large_file(self, file_name, content_type=None) -> str:
+        file_id = uuid.uuid4().hex
+        self.large_files[file_id] = {"name": file_name, "parts": {}}
+        return file_id
+
+    def upload_part(self, file_id, part_number, data, sha1=None) -> str:
+        sha1 = check_part(data, sha1)
+        self.large_files[file_id]["parts"][part_number] = bytes(data)
+        return sha1
+
+    def finish_large_file(self, file_id, part_sha1s) -> str:
+        check_parts(part_sha1s)
+        large_file = self.large_files.pop(file_id)
+        parts = large_file["parts"]
+        data = b"".join(parts[n] for n in range(1, len(part_sha1s) + 1))
+        return self._store(large_file["name"], data)
+
+    def cancel_large_file(self, file_id) -> None:
+        self.large_files.pop(file_id, None)
+
+    def delete_file(self, file_url, file_name) -> None:
+        self.files.pop(file_url.removeprefix("memory://"), None)
+
+    def clear(self) -> None:
+        self.files.clear()
+        self.large_files.clear()
+
+
+def create_storage_backend() -> StorageBackend:
+    if settings.storage_backend == "local":
+        return LocalStorageBackend(
+            settings.storage_local_root,
+            settings.storage_public_url or MEDIA_PATH,
+            settings.storage_local_work_root,
+        )
+    if settings.storage_backend == "memory":
+        return MemoryStorageBackend()
+    return B2StorageBackend()
+
+
+storage = create_storage_backend()
@@ -1,11 +1,23 @@
+import asyncio
+import hashlib
 import logging
 from json import JSONDecodeError
+from typing import Optional
 
 import httpx
 from databases import Database
 
+from social_media_api import metrics
+from social_media_api.cache import Cache
+from social_media_api.circuit_breaker import CircuitBreaker, CircuitOpenError
 from social_media_api.config import settings
+from social_media_api.database import database as default_database
 from social_media_api.database import posts
+from social_media_api.email_outbox import EmailTemplate, email_outbox
+from social_media_api.feed_cache import invalidate_feed
+from social_media_api.http_clients import get_client
+from social_media_api.images import schedule_image_variants
+from social_media_api.jobs import current_job, job, will_retry
 
 logger = logging.getLogger(__name__)
 
@@ -16,81 +28,184 @@ class APIResponseError(Exception):
 
 async def send_simple_email(to: str, subject: str, body: str):
     logger.debug(f"sending email to '{to[:3]}' with subject '{subject[:20]}' ")
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"https://api.mailgun.net/v3/{settings.DEV_MAILGUN_DOMAIN}/messages",
-                auth=("api", settings.DEV_MAILGUN_API_KEY),
-                data={
-                    "from": "Tijo Thomas <mailgun@{settings.DEV_MAILGUN_DOMAIN}>",
-                    "to": [to],
-                    "subject": subject,
-                    "text": body,
-                },
-            )
-            response.raise_for_status()
-
-            logger.debug(response.content)
-
-            return response
-        except httpx.HTTPStatusError as err:
-            raise APIResponseError(
-                f"API request failed with status code {err.response.status_code}"
-            ) from err
+    client = get_client("mailgun")
+    try:
+        response = await client.post(
+            f"https://api.mailgun.net/v3/{settings.DEV_MAILGUN_DOMAIN}/messages",
+            auth=("api", settings.DEV_MAILGUN_API_KEY),
+            data={
+                "from": "Tijo Thomas <mailgun@{settings.DEV_MAILGUN_DOMAIN}>",
+                "to": [to],
+                "subject": subject,
+                "text": body,
+            },
+        )
+        response.raise_for_status()
+
+        logger.debug(response.content)
+
+        return response
+    except httpx.HTTPStatusError as err:
+        raise APIResponseError(
+            f"API request failed with status code {err.response.status_code}"
+        ) from err
+
+
+REGISTRATION_EMAIL = EmailTemplate(
+    "registration",
+    "Successfully signed up",
+    (
+        "Hi %recipient.email%! You have successfully signed up to the social_media"
+        " REST API.Please confirm your email by clicking on the "
+        "following link : %recipient.confirmation_url%"
+    ),
+)
+
+IMAGE_FAILED_EMAIL = EmailTemplate(
+    "image_failed",
+    "Error generating image",
+    (
+        "Hi %recipient.email%! Unfortunately there was an error generating an image"
+        "for your post."
+    ),
+)
+
+IMAGE_READY_EMAIL = EmailTemplate(
+    "image_ready",
+    "Image generation completed",
+    (
+        "Hi %recipient.email%! Your image has been generated and added to your post."
+        " Please click on the following link to view it: %recipient.post_url%"
+    ),
+)
+
+
+# through the batched outbox when it's on, `key` tells notifications with the
+# same template and recipient apart, pending ones with the same key coalesce.
+# Jobs of the durable queue send right away: a job done once its email sits in
+# process memory would lose the email when the worker restarts, a failed send
+# fails the job and it's retried.
+async def send_email(
+    template: EmailTemplate, to: str, key: Optional[str] = None, **variables
+):
+    if settings.email_outbox_enabled and current_job.get() is None:
+        email_outbox.add(template, to, variables, key=key)
+        return None
+    return await send_simple_email(
+        to, template.subject, template.render({"email": to, **variables})
+    )
 
 
+@job()
 async def send_user_registration_email(email: str, confirmation_url: str):
-    return await send_simple_email(
-        email,
-        "Successfully signed up",
-        (
-            f"Hi {email}! You have successfully signed up to the social_media REST API."
-            "Please confirm your email by clicking on the "
-            f"following link : {confirmation_url}"
-        ),
+    # a user registering again before the batch goes out gets one email, with
+    # the newest link
+    return await send_email(
+        REGISTRATION_EMAIL, email, confirmation_url=confirmation_url
     )
 
 
 # generating image
 async def _generate_cute_creature_api(prompt: str):  # private function
     logger.debug("Generating cute creature")
-    async with httpx.AsyncClient() as client:
+    client = get_client("deepai")
+    try:
+        response = await client.post(
+            "https://api.deepai.org/api/cute-creature-generator",
+            data={"text": prompt},
+            headers={"api-key": settings.DEEPAI_API_KEY},
+            timeout=60,
+        )
+        logger.debug(response)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as err:
+        status = err.response.status_code
+        if status == 429 or status >= 500:
+            # overloaded or down, worth trying again later
+            raise
+        raise APIResponseError(f"API request failed with status code {status}") from err
+    except (JSONDecodeError, TypeError) as err:
+        raise APIResponseError("API response parsing failed") from err
+
+
+# Guards around the image API: at most image_generation_max_concurrency calls in
+# flight per process (the rest wait for a slot), a circuit breaker that fails
+# fast while DeepAI is down, and prompt deduplication: concurrent requests for
+# the same prompt share one call and a generated image is reused for
+# image_generation_cache_ttl_seconds.
+image_cache = Cache(
+    "images",
+    ttl=settings.image_generation_cache_ttl_seconds,
+    max_size=settings.image_generation_cache_max_size,
+)
+image_breaker = CircuitBreaker(
+    "deepai",
+    failure_threshold=settings.image_generation_breaker_failures,
+    reset_timeout=settings.image_generation_breaker_reset_seconds,
+    failure_exceptions=(APIResponseError, httpx.HTTPError),
+)
+_image_slots = asyncio.Semaphore(settings.image_generation_max_concurrency)
+_image_calls: dict[str, asyncio.Task] = {}
+_images_in_flight = 0
+
+metrics.register_gauge("image_generation.in_flight", lambda: _images_in_flight)
+metrics.register_gauge("image_generation.pending", lambda: len(_image_calls))
+
+
+def _prompt_key(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+async def _call_image_api(prompt: str, key: str):
+    global _images_in_flight
+    async with _image_slots:
+        _images_in_flight += 1
         try:
-            response = await client.post(
-                "https://api.deepai.org/api/cute-creature-generator",
-                data={"text": prompt},
-                headers={"api-key": settings.DEEPAI_API_KEY},
-                timeout=60,
-            )
-            logger.debug(response)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as err:
-            raise APIResponseError(
-                f"API request failed with status code {err.response.status_code}"
-            ) from err
-        except (JSONDecodeError, TypeError) as err:
-            raise APIResponseError("API response parsing failed") from err
+            response = await image_breaker.call(_generate_cute_creature_api, prompt)
+        finally:
+            _images_in_flight -= 1
+    await image_cache.set(key, response)
+    return response
+
+
+async def generate_image(prompt: str):
+    key = _prompt_key(prompt)
+    if (response := await image_cache.get(key)) is not None:
+        metrics.increment("image_generation.cache_hits")
+        return response
 
+    call = _image_calls.get(key)
+    if call is None:
+        call = _image_calls[key] = asyncio.create_task(_call_image_api(prompt, key))
+        call.add_done_callback(lambda _: _image_calls.pop(key, None))
+    else:
+        metrics.increment("image_generation.deduplicated")
+    # a cancelled caller (job timeout) doesn't cancel the call others wait on
+    return await asyncio.shield(call)
 
+
+# the external API takes up to a minute per image, don't let these crowd out
+# the emails in a worker
+@job(concurrency=4)
 async def generate_and_add_to_post(
     email: str,
     post_id: int,
     post_url: str,
-    database: Database,
+    database: Optional[Database] = None,
     prompt: str = "A blue british shorthair cat is sitting on a couch",
 ):
+    database = database or default_database
     try:
-        response = await _generate_cute_creature_api(prompt)
+        response = await generate_image(prompt)
     except APIResponseError:
-        return await send_simple_email(
-            email,
-            "Error generating image",
-            (
-                f"Hi {email}! Unfortunately there was an error generating an image"
-                "for your post."
-            ),
-        )
+        return await send_email(IMAGE_FAILED_EMAIL, email, key=str(post_id))
+    except (CircuitOpenError, httpx.HTTPError):
+        # DeepAI is down or overloaded, the job queue tries again with backoff;
+        # the user only hears about it once no attempt is left
+        if will_retry():
+            raise
+        return await send_email(IMAGE_FAILED_EMAIL, email, key=str(post_id))
 
     logger.debug("Connecting to database to update post")
 
@@ -103,15 +218,10 @@ async def generate_and_add_to_post(
     logger.debug(query)
 
     await database.execute(query)
+    await invalidate_feed()
 
     logger.debug("Database connection in background task closed")
 
-    await send_simple_email(
-        email,
-        "Image generation completed",
-        (
-            f"Hi {email}! Your image has been generated and added to your post."
-            f" Please click on the following link to view it: {post_url}"
-        ),
-    )
+    await send_email(IMAGE_READY_EMAIL, email, key=str(post_id), post_url=post_url)
+    await schedule_image_variants(post_id, response["output_url"])
     return response
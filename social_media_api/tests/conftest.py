@@ -12,7 +12,12 @@ os.environ["ENV_STATE"] = "testing"
 
 
 from social_media_api.database import database, user_table  # noqa: E402
+from social_media_api.feed_cache import feed_cache  # noqa: E402
 from social_media_api.main import app  # noqa: E402
+from social_media_api.migrations import run_migrations  # noqa: E402
+from social_media_api.security import token_cache, user_cache  # noqa: E402
+from social_media_api.storage import storage  # noqa: E402
+from social_media_api.tasks import image_breaker, image_cache  # noqa: E402
 
 
 @pytest.fixture(scope="session")
@@ -20,6 +25,11 @@ def anyio_backend():
     return "asyncio"
 
 
+@pytest.fixture(scope="session", autouse=True)
+def migrated_db() -> None:
+    run_migrations()
+
+
 @pytest.fixture()
 def client() -> Generator:
     yield TestClient(app)
@@ -32,6 +42,24 @@ async def db() -> AsyncGenerator:
     await database.disconnect()
 
 
+# every test rolls the database back, cached rows must not outlive it
+@pytest.fixture(autouse=True)
+async def clear_caches() -> AsyncGenerator:
+    yield
+    await user_cache.clear()
+    await feed_cache.clear()
+    await image_cache.clear()
+    token_cache.clear()
+    image_breaker.reset()
+
+
+# TestConfig stores uploads in memory, tests look at what was stored here
+@pytest.fixture(autouse=True)
+def memory_storage() -> Generator:
+    yield storage
+    storage.clear()
+
+
 @pytest.fixture()
 async def async_client() -> AsyncGenerator[AsyncClient, None]:
     transport = ASGITransport(app=app)
@@ -71,12 +99,10 @@ async def confirmed_user(registered_user: dict) -> dict:
 # mailgun email sending
 @pytest.fixture(autouse=True)
 async def mock_httpx_client(mocker):
-    mocked_client = mocker.patch("social_media_api.tasks.httpx.AsyncClient")
-
     mocked_async_client = Mock()
     response = Response(status_code=200, content="", request=Request("POST", "//"))
     mocked_async_client.post = AsyncMock(return_value=response)
-    mocked_client.return_value.__aenter__.return_value = mocked_async_client
+    mocker.patch("social_media_api.tasks.get_client", return_value=mocked_async_client)
 
     return mocked_async_client
 
@@ -0,0 +1,90 @@
+import csv
+import io
+import json
+
+import pytest
+from httpx import AsyncClient
+
+from social_media_api import security
+from social_media_api.config import settings
+from social_media_api.database import database
+from social_media_api.tests.helpers import create_comment, create_post, like_post
+
+
+@pytest.fixture()
+async def admin_token(mocker, confirmed_user: dict, logged_in_token: str) -> str:
+    mocker.patch.object(security.settings, "admin_email", confirmed_user["email"])
+    return logged_in_token
+
+
+async def export(async_client: AsyncClient, token: str, table: str, **params):
+    return await async_client.get(
+        f"/export/{table}",
+        params=params,
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+
+@pytest.mark.anyio
+async def test_export_requires_admin(async_client: AsyncClient, logged_in_token: str):
+    response = await export(async_client, logged_in_token, "posts")
+    assert response.status_code == 403
+
+
+@pytest.mark.anyio
+async def test_export_posts_ndjson(
+    async_client: AsyncClient, admin_token: str, confirmed_user: dict, mocker
+):
+    mocker.patch.object(settings, "export_chunk_size", 2)
+    for i in range(5):
+        await create_post(f"Test Post {i}", async_client, admin_token)
+    await like_post(3, async_client, admin_token)
+    spy = mocker.spy(database, "fetch_all")
+
+    response = await export(async_client, admin_token, "posts")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == [1, 2, 3, 4, 5]
+    assert lines[2] == {
+        "id": 3,
+        "body": "Test Post 2",
+        "user_id": confirmed_user["id"],
+        "image_url": None,
+        "thumbnail_url": None,
+        "webp_url": None,
+        "like_count": 1,
+    }
+    # 5 rows in chunks of 2
+    assert spy.call_count == 3
+
+
+@pytest.mark.anyio
+async def test_export_comments_csv(
+    async_client: AsyncClient, admin_token: str, created_post: dict
+):
+    await create_comment("Hello, world", created_post["id"], async_client, admin_token)
+
+    response = await export(async_client, admin_token, "comments", format="csv")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert 'filename="comments.csv"' in response.headers["content-disposition"]
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows == [
+        ["id", "body", "post_id", "user_id"],
+        ["1", "Hello, world", "1", "1"],
+    ]
+
+
+@pytest.mark.anyio
+async def test_export_empty_table_csv(async_client: AsyncClient, admin_token: str):
+    response = await export(async_client, admin_token, "likes", format="csv")
+    assert response.text.splitlines() == ["id,post_id,user_id"]
+
+
+@pytest.mark.anyio
+async def test_export_unknown_table(async_client: AsyncClient, admin_token: str):
+    response = await export(async_client, admin_token, "users")
+    assert response.status_code == 422
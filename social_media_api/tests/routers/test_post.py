@@ -2,6 +2,9 @@ import pytest
 from httpx import AsyncClient
 
 from social_media_api import security
+from social_media_api.database import database
+from social_media_api.likes import find_likes
+from social_media_api.ranking import refresh_post_scores
 from social_media_api.tests.helpers import (  # noqa
     create_comment,
     create_post,
@@ -119,6 +122,79 @@ async def test_get_post_with_comments(
     }
 
 
+@pytest.mark.anyio
+async def test_get_comments_on_post_paginated(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    for i in range(5):
+        await create_comment(
+            f"Comment {i}", created_post["id"], async_client, logged_in_token
+        )
+
+    comment_ids, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = await async_client.get(
+            f"/post/{created_post['id']}/comment", params=params
+        )
+        assert response.status_code == 200
+        comment_ids += [comment["id"] for comment in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+
+    assert comment_ids == [1, 2, 3, 4, 5]
+
+
+@pytest.mark.anyio
+async def test_get_post_with_comments_first_page(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    for i in range(3):
+        await create_comment(
+            f"Comment {i}", created_post["id"], async_client, logged_in_token
+        )
+
+    response = await async_client.get(
+        f"/post/{created_post['id']}", params={"limit": 2}
+    )
+    assert response.status_code == 200
+    assert [comment["id"] for comment in response.json()["comments"]] == [1, 2]
+
+    response = await async_client.get(
+        f"/post/{created_post['id']}/comment",
+        params={"cursor": response.headers["X-Next-Cursor"]},
+    )
+    assert [comment["id"] for comment in response.json()] == [3]
+
+
+@pytest.mark.anyio
+async def test_get_post_with_comments_single_query(
+    async_client: AsyncClient, created_post: dict, created_comment: dict, mocker
+):
+    spy = mocker.spy(database, "fetch_all")
+
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.status_code == 200
+    spy.assert_called_once()
+
+
+@pytest.mark.anyio
+async def test_get_comments_cursor_from_other_post(
+    async_client: AsyncClient, logged_in_token: str
+):
+    await create_post("Test Post 1", async_client, logged_in_token)
+    await create_post("Test Post 2", async_client, logged_in_token)
+    for _ in range(2):
+        await create_comment("Comment", 1, async_client, logged_in_token)
+    response = await async_client.get("/post/1/comment", params={"limit": 1})
+
+    response = await async_client.get(
+        "/post/2/comment", params={"cursor": response.headers["X-Next-Cursor"]}
+    )
+    assert response.status_code == 400
+
+
 @pytest.mark.anyio
 async def test_get_missing_post_with_comments(
     async_client: AsyncClient, created_post: dict, created_comment: dict
@@ -180,6 +256,211 @@ async def test_get_all_posts_sort_likes(
     assert post_ids == expected_order
 
 
+@pytest.mark.anyio
+async def test_like_post_updates_like_count(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await like_post(created_post["id"], async_client, logged_in_token)
+
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["post"]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_like_post_is_idempotent(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    first = await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.post(
+        "/like",
+        json={"post_id": created_post["id"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 200
+    assert response.json() == first
+
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["post"]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_like_post_unliked_during_lookup(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str, mocker
+):
+    await like_post(created_post["id"], async_client, logged_in_token)
+    # an unlike lands between the no-op insert and the lookup
+    mocker.patch(
+        "social_media_api.routers.post.find_likes",
+        side_effect=unlike_first(async_client, logged_in_token, created_post["id"]),
+    )
+
+    response = await async_client.post(
+        "/like",
+        json={"post_id": created_post["id"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 201
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["post"]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_like_posts_bulk_unliked_during_lookup(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str, mocker
+):
+    await like_post(created_post["id"], async_client, logged_in_token)
+    mocker.patch(
+        "social_media_api.routers.post.find_likes",
+        side_effect=unlike_first(async_client, logged_in_token, created_post["id"]),
+    )
+
+    response = await async_client.post(
+        "/like/bulk",
+        json={"likes": [{"post_id": created_post["id"]}]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert [result["status"] for result in response.json()] == [201]
+
+
+def unlike_first(async_client: AsyncClient, token: str, post_id: int):
+    async def unlike_then_find(*args):
+        await async_client.delete(
+            f"/like/{post_id}", headers={"Authorization": f"Bearer {token}"}
+        )
+        return await find_likes(*args)
+
+    return unlike_then_find
+
+
+@pytest.mark.anyio
+async def test_unlike_post(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await like_post(created_post["id"], async_client, logged_in_token)
+
+    for _ in range(2):
+        response = await async_client.delete(
+            f"/like/{created_post['id']}",
+            headers={"Authorization": f"Bearer {logged_in_token}"},
+        )
+        assert response.status_code == 204
+
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["post"]["likes"] == 0
+
+
+##---------testing bulk endpoints
+@pytest.mark.anyio
+async def test_like_posts_bulk(
+    async_client: AsyncClient, logged_in_token: str, confirmed_user: dict
+):
+    await create_post("Test Post 1", async_client, logged_in_token)
+    await create_post("Test Post 2", async_client, logged_in_token)
+
+    response = await async_client.post(
+        "/like/bulk",
+        json={"likes": [{"post_id": 2}, {"post_id": 3}, {"post_id": 1}]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["status"] for result in results] == [201, 404, 201]
+    assert results[0]["like"] == {
+        "id": 1,
+        "post_id": 2,
+        "user_id": confirmed_user["id"],
+    }
+    assert results[2]["like"]["post_id"] == 1
+
+    response = await async_client.get("/post", params={"sorting": "old"})
+    assert [post["likes"] for post in response.json()] == [1, 1]
+
+
+@pytest.mark.anyio
+async def test_like_posts_bulk_already_liked(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    first = await like_post(created_post["id"], async_client, logged_in_token)
+
+    response = await async_client.post(
+        "/like/bulk",
+        json={"likes": [{"post_id": created_post["id"]}] * 2},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert [result["status"] for result in response.json()] == [200, 200]
+    assert response.json()[0]["like"] == first
+
+    response = await async_client.get(f"/post/{created_post['id']}")
+    assert response.json()["post"]["likes"] == 1
+
+
+@pytest.mark.anyio
+async def test_like_posts_bulk_repeated_post(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    response = await async_client.post(
+        "/like/bulk",
+        json={"likes": [{"post_id": created_post["id"]}] * 2},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert [result["status"] for result in response.json()] == [201, 200]
+    assert response.json()[0]["like"] == response.json()[1]["like"]
+
+
+@pytest.mark.anyio
+async def test_like_posts_bulk_all_missing(
+    async_client: AsyncClient, logged_in_token: str
+):
+    response = await async_client.post(
+        "/like/bulk",
+        json={"likes": [{"post_id": 5}]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 200
+    assert response.json() == [
+        {"post_id": 5, "status": 404, "like": None, "detail": "Post not found"}
+    ]
+
+
+@pytest.mark.anyio
+async def test_like_posts_bulk_empty(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.post(
+        "/like/bulk",
+        json={"likes": []},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_create_comments_bulk(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    response = await async_client.post(
+        "/comment/bulk",
+        json={
+            "comments": [
+                {"body": "First", "post_id": created_post["id"]},
+                {"body": "Missing", "post_id": 99},
+                {"body": "Second", "post_id": created_post["id"]},
+            ]
+        },
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["status"] for result in results] == [201, 404, 201]
+    assert [results[0]["comment"]["body"], results[2]["comment"]["body"]] == [
+        "First",
+        "Second",
+    ]
+
+    response = await async_client.get(f"/post/{created_post['id']}/comment")
+    assert [comment["body"] for comment in response.json()] == ["First", "Second"]
+
+
 # testing a method not in sorting
 @pytest.mark.anyio
 async def test_get_all_posts_wrong_sorting(
@@ -191,6 +472,156 @@ async def test_get_all_posts_wrong_sorting(
     assert response.status_code == 422
 
 
+##---------testing feed pagination
+async def get_all_pages(async_client: AsyncClient, sorting: str, limit: int):
+    post_ids, cursor = [], None
+    while True:
+        params = {"sorting": sorting, "limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = await async_client.get("/post", params=params)
+        assert response.status_code == 200
+        assert len(response.json()) <= limit
+        post_ids += [post["id"] for post in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return post_ids
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "sorting, expected_order",
+    [
+        ("new", [5, 4, 3, 2, 1]),
+        ("old", [1, 2, 3, 4, 5]),
+        ("most_likes", [4, 2, 5, 3, 1]),
+    ],
+)
+async def test_get_all_posts_paginated(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sorting: str,
+    expected_order: list[int],
+):
+    for i in range(5):
+        await create_post(f"Test Post {i}", async_client, logged_in_token)
+    for post_id in (4, 4, 2):
+        await like_post(post_id, async_client, logged_in_token)
+
+    assert await get_all_pages(async_client, sorting, limit=2) == expected_order
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_trending(async_client: AsyncClient, logged_in_token: str):
+    for i in range(5):
+        await create_post(f"Test Post {i}", async_client, logged_in_token)
+    await refresh_post_scores(database, now=1_750_000_000)
+    for post_id in (4, 4, 2):
+        await like_post(post_id, async_client, logged_in_token)
+    await refresh_post_scores(database, now=1_750_000_000)
+
+    # posts with equal scores fall back to newest first
+    assert await get_all_pages(async_client, "trending", limit=2) == [4, 2, 5, 3, 1]
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_last_page_has_no_cursor(
+    async_client: AsyncClient, created_post: dict
+):
+    response = await async_client.get("/post", params={"limit": 1})
+    assert response.status_code == 200
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_stable_under_inserts(
+    async_client: AsyncClient, logged_in_token: str
+):
+    for i in range(3):
+        await create_post(f"Test Post {i}", async_client, logged_in_token)
+
+    response = await async_client.get("/post", params={"limit": 2})
+    await create_post("Newer Post", async_client, logged_in_token)
+    response = await async_client.get(
+        "/post", params={"limit": 2, "cursor": response.headers["X-Next-Cursor"]}
+    )
+    assert [post["id"] for post in response.json()] == [1]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "eyJpZCI6ImEifQ"])
+async def test_get_all_posts_invalid_cursor(async_client: AsyncClient, cursor: str):
+    response = await async_client.get("/post", params={"cursor": cursor})
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_cursor_from_other_sorting(
+    async_client: AsyncClient, logged_in_token: str
+):
+    await create_post("Test Post 1", async_client, logged_in_token)
+    await create_post("Test Post 2", async_client, logged_in_token)
+    response = await async_client.get("/post", params={"limit": 1})
+
+    response = await async_client.get(
+        "/post",
+        params={"sorting": "old", "cursor": response.headers["X-Next-Cursor"]},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_served_from_cache(
+    async_client: AsyncClient, created_post: dict, mocker
+):
+    await async_client.get("/post")
+    spy = mocker.spy(database, "fetch_all")
+
+    response = await async_client.get("/post")
+    assert response.json() == [{**created_post, "likes": 0}]
+    spy.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_cache_invalidated_on_write(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await async_client.get("/post", params={"sorting": "most_likes"})
+
+    await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.get("/post", params={"sorting": "most_likes"})
+    assert response.json()[0]["likes"] == 1
+
+    await async_client.delete(
+        f"/like/{created_post['id']}",
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    response = await async_client.get("/post", params={"sorting": "most_likes"})
+    assert response.json()[0]["likes"] == 0
+
+    await create_post("Newer Post", async_client, logged_in_token)
+    response = await async_client.get("/post", params={"sorting": "most_likes"})
+    assert len(response.json()) == 2
+
+
+@pytest.mark.anyio
+async def test_get_all_posts_not_modified(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    response = await async_client.get("/post")
+    etag = response.headers["ETag"]
+
+    response = await async_client.get("/post", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+    await like_post(created_post["id"], async_client, logged_in_token)
+    response = await async_client.get("/post", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
 # fixture to prevent generate-image from running
 @pytest.fixture()
 async def mock_generate_cute_creature_api(mocker):
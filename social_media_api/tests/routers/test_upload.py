@@ -1,11 +1,18 @@
 import contextlib
+import hashlib
 import os
 import pathlib
 import tempfile
+import time
 
 import pytest
 from httpx import AsyncClient
 
+from social_media_api import metrics
+from social_media_api.database import database, user_table
+from social_media_api.storage import MemoryStorageBackend
+from social_media_api.uploads import expire_upload_sessions, record_uploaded_file
+
 # import io
 
 
@@ -16,13 +23,10 @@ def sample_image(fs) -> pathlib.Path:  # fs is from pytest-fakefs
     return path
 
 
-# Mock the Backblaze Upload
-@pytest.fixture(autouse=True)
-def mock_b2_upload_file(mocker):
-    return mocker.patch(
-        "social_media_api.routers.upload.b2_upload_file",
-        return_value="https://fakeurl.com",
-    )
+# uploads land in the in-memory storage backend (see conftest)
+@pytest.fixture()
+def upload_file_spy(mocker, memory_storage: MemoryStorageBackend):
+    return mocker.spy(memory_storage, "upload_file")
 
 
 # patch aiofiles
@@ -56,11 +60,18 @@ async def call_upload_endpoint(
 
 @pytest.mark.anyio
 async def test_upload_image(
-    async_client: AsyncClient, logged_in_token: str, sample_image: pathlib.Path
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sample_image: pathlib.Path,
+    memory_storage: MemoryStorageBackend,
 ):
+    sample_image.write_bytes(b"image bytes")
+
     response = await call_upload_endpoint(async_client, logged_in_token, sample_image)
     assert response.status_code == 201
-    assert response.json()["file_url"] == "https://fakeurl.com"
+    file_url = response.json()["file_url"]
+    assert file_url.endswith("/myfile.png")
+    assert memory_storage.get(file_url) == b"image bytes"
 
 
 @pytest.mark.anyio
@@ -74,3 +85,315 @@ async def test_temp_file_removed_after_upload(
 
     created_file = named_temp_file_spy.spy_return
     assert not os.path.exists(created_file.name)  # deleted after use
+
+
+@pytest.mark.anyio
+async def test_upload_stream(
+    async_client: AsyncClient, memory_storage: MemoryStorageBackend, mocker
+):
+    upload_bytes = mocker.spy(memory_storage, "upload_bytes")
+
+    response = await async_client.post(
+        "/upload/stream",
+        params={"file_name": "myfile.png"},
+        content=b"image bytes",
+        headers={"Content-Type": "image/png"},
+    )
+
+    assert response.status_code == 201
+    assert memory_storage.get(response.json()["file_url"]) == b"image bytes"
+    upload_bytes.assert_called_once_with(b"image bytes", "myfile.png", "image/png")
+
+
+@pytest.mark.anyio
+async def test_upload_stream_error(
+    async_client: AsyncClient, memory_storage: MemoryStorageBackend, mocker
+):
+    mocker.patch.object(
+        memory_storage, "upload_bytes", side_effect=OSError("storage down")
+    )
+
+    response = await async_client.post(
+        "/upload/stream", params={"file_name": "myfile.png"}, content=b"image bytes"
+    )
+
+    assert response.status_code == 500
+
+
+# ---------------resumable uploads--------------
+@pytest.fixture()
+def large_file_spies(mocker, memory_storage: MemoryStorageBackend):
+    mocker.patch("social_media_api.routers.upload.MIN_PART_SIZE", 4)
+    return {
+        name: mocker.spy(memory_storage, name)
+        for name in ("upload_part", "finish_large_file", "cancel_large_file")
+    }
+
+
+async def start_upload(async_client: AsyncClient, token: str) -> str:
+    response = await async_client.post(
+        "/uploads",
+        json={"file_name": "video.mp4", "content_type": "video/mp4"},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == 201
+    return response.json()["upload_id"]
+
+
+async def put_part(
+    async_client: AsyncClient, token: str, upload_id: str, number: int, data: bytes
+):
+    return await async_client.put(
+        f"/uploads/{upload_id}/parts/{number}",
+        content=data,
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+
+@pytest.mark.anyio
+async def test_resumable_upload(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    memory_storage: MemoryStorageBackend,
+    large_file_spies,
+    mocker,
+):
+    upload_id = await start_upload(async_client, logged_in_token)
+    headers = {"Authorization": f"Bearer {logged_in_token}"}
+
+    # out of order, as parallel clients would send them
+    await put_part(async_client, logged_in_token, upload_id, 2, b"efgh")
+    await put_part(async_client, logged_in_token, upload_id, 3, b"ij")
+
+    status = (await async_client.get(f"/uploads/{upload_id}", headers=headers)).json()
+    assert [part["part_number"] for part in status["parts"]] == [2, 3]
+
+    response = await async_client.post(
+        f"/uploads/{upload_id}/complete", headers=headers
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Missing parts: [1]"
+
+    await put_part(async_client, logged_in_token, upload_id, 1, b"abcd")
+    response = await async_client.post(
+        f"/uploads/{upload_id}/complete", headers=headers
+    )
+
+    assert response.status_code == 200
+    assert memory_storage.get(response.json()["file_url"]) == b"abcdefghij"
+    large_file_spies["finish_large_file"].assert_called_once_with(
+        mocker.ANY,
+        [hashlib.sha1(data).hexdigest() for data in (b"abcd", b"efgh", b"ij")],
+    )
+    status = (await async_client.get(f"/uploads/{upload_id}", headers=headers)).json()
+    assert status["status"] == "complete"
+
+
+@pytest.mark.anyio
+async def test_upload_part_checksum_mismatch(
+    async_client: AsyncClient, logged_in_token: str, large_file_spies
+):
+    upload_id = await start_upload(async_client, logged_in_token)
+
+    response = await async_client.put(
+        f"/uploads/{upload_id}/parts/1",
+        content=b"abcd",
+        headers={
+            "Authorization": f"Bearer {logged_in_token}",
+            "X-Content-SHA1": hashlib.sha1(b"abce").hexdigest(),
+        },
+    )
+
+    assert response.status_code == 400
+    large_file_spies["upload_part"].assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_upload_part_retry_is_not_sent_again(
+    async_client: AsyncClient, logged_in_token: str, large_file_spies
+):
+    upload_id = await start_upload(async_client, logged_in_token)
+
+    for _ in range(2):
+        response = await put_part(async_client, logged_in_token, upload_id, 1, b"ab")
+        assert response.status_code == 200
+
+    large_file_spies["upload_part"].assert_called_once()
+
+
+@pytest.mark.anyio
+async def test_complete_rejects_small_parts(
+    async_client: AsyncClient, logged_in_token: str, large_file_spies
+):
+    upload_id = await start_upload(async_client, logged_in_token)
+    await put_part(async_client, logged_in_token, upload_id, 1, b"ab")
+    await put_part(async_client, logged_in_token, upload_id, 2, b"cd")
+
+    response = await async_client.post(
+        f"/uploads/{upload_id}/complete",
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 400
+    large_file_spies["finish_large_file"].assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_complete_rejects_single_part(
+    async_client: AsyncClient, logged_in_token: str, large_file_spies
+):
+    upload_id = await start_upload(async_client, logged_in_token)
+    await put_part(async_client, logged_in_token, upload_id, 1, b"abcd")
+
+    response = await async_client.post(
+        f"/uploads/{upload_id}/complete",
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 400
+    assert "at least 2 parts" in response.json()["detail"]
+    large_file_spies["finish_large_file"].assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_abort_upload(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    memory_storage: MemoryStorageBackend,
+    large_file_spies,
+):
+    upload_id = await start_upload(async_client, logged_in_token)
+    await put_part(async_client, logged_in_token, upload_id, 1, b"abcd")
+
+    response = await async_client.delete(
+        f"/uploads/{upload_id}", headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == 204
+    large_file_spies["cancel_large_file"].assert_called_once()
+    assert memory_storage.large_files == {}
+    response = await put_part(async_client, logged_in_token, upload_id, 2, b"efgh")
+    assert response.status_code == 409
+
+
+@pytest.mark.anyio
+async def test_abandoned_upload_expires(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    memory_storage: MemoryStorageBackend,
+    large_file_spies,
+):
+    headers = {"Authorization": f"Bearer {logged_in_token}"}
+    upload_id = await start_upload(async_client, logged_in_token)
+    await put_part(async_client, logged_in_token, upload_id, 1, b"abcd")
+    status = (await async_client.get(f"/uploads/{upload_id}", headers=headers)).json()
+
+    # still active
+    assert await expire_upload_sessions(database, now=status["expires_at"] - 1) == 0
+
+    # abandoned after one more part
+    response = await put_part(async_client, logged_in_token, upload_id, 2, b"efgh")
+    assert response.status_code == 200
+    assert await expire_upload_sessions(database, now=time.time() + 10**9) == 1
+
+    large_file_spies["cancel_large_file"].assert_called_once()
+    assert memory_storage.large_files == {}
+    status = (await async_client.get(f"/uploads/{upload_id}", headers=headers)).json()
+    assert (status["status"], status["parts"]) == ("expired", [])
+
+
+@pytest.mark.anyio
+async def test_expired_upload_is_refused(
+    async_client: AsyncClient, logged_in_token: str, large_file_spies, mocker
+):
+    upload_id = await start_upload(async_client, logged_in_token)
+    mocker.patch(
+        "social_media_api.routers.upload.time.time", return_value=time.time() + 10**9
+    )
+
+    response = await put_part(async_client, logged_in_token, upload_id, 1, b"abcd")
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Upload is expired"
+
+
+@pytest.mark.anyio
+async def test_upload_belongs_to_its_user(
+    async_client: AsyncClient, logged_in_token: str, large_file_spies
+):
+    upload_id = await start_upload(async_client, logged_in_token)
+    await async_client.post(
+        "/register", json={"email": "other@example.net", "password": "1234"}
+    )
+    await database.execute(
+        user_table.update()
+        .where(user_table.c.email == "other@example.net")
+        .values(confirmed=True)
+    )
+    token = (
+        await async_client.post(
+            "/token", json={"email": "other@example.net", "password": "1234"}
+        )
+    ).json()["access_token"]
+
+    response = await put_part(async_client, token, upload_id, 1, b"abcd")
+
+    assert response.status_code == 404
+
+
+# ---------------deduplication--------------
+@pytest.mark.anyio
+async def test_upload_duplicate_reuses_file(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    sample_image: pathlib.Path,
+    upload_file_spy,
+):
+    sample_image.write_bytes(b"the same meme")
+    metrics.reset()
+
+    urls = set()
+    for _ in range(2):
+        response = await call_upload_endpoint(
+            async_client, logged_in_token, sample_image
+        )
+        urls.add(response.json()["file_url"])
+
+    assert len(urls) == 1
+    upload_file_spy.assert_called_once()
+    assert metrics.snapshot()["uploads.bytes_saved"] == len(b"the same meme")
+
+
+@pytest.mark.anyio
+async def test_upload_stream_duplicate_reuses_file(
+    async_client: AsyncClient, memory_storage: MemoryStorageBackend, mocker
+):
+    upload_bytes = mocker.spy(memory_storage, "upload_bytes")
+
+    urls = set()
+    for _ in range(2):
+        response = await async_client.post(
+            "/upload/stream", params={"file_name": "meme.png"}, content=b"meme"
+        )
+        urls.add(response.json()["file_url"])
+
+    assert len(urls) == 1
+    upload_bytes.assert_called_once()
+
+
+@pytest.mark.anyio
+async def test_upload_stream_known_digest_skips_body(async_client: AsyncClient, mocker):
+    await record_uploaded_file(
+        hashlib.sha256(b"meme").hexdigest(), "https://fakeurl.com/meme", 4
+    )
+    stream = mocker.patch("social_media_api.routers.upload.stream_upload")
+
+    response = await async_client.post(
+        "/upload/stream",
+        params={"file_name": "meme.png"},
+        headers={"X-Content-SHA256": hashlib.sha256(b"meme").hexdigest()},
+    )
+
+    assert response.status_code == 201
+    assert response.json()["file_url"] == "https://fakeurl.com/meme"
+    stream.assert_not_called()
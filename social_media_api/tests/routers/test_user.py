@@ -47,6 +47,17 @@ async def test_confirm_user(async_client: AsyncClient, mocker):
     assert "User Confirmed" in response.json()["detail"]
 
 
+@pytest.mark.anyio
+async def test_confirm_user_invalidates_cached_user(async_client: AsyncClient, mocker):
+    spy = mocker.spy(BackgroundTasks, "add_task")
+    invalidate = mocker.patch("social_media_api.routers.user.invalidate_cached_user")
+    await register_user(async_client, "test@example.net", "1234")
+    confirmation_url = str(spy.call_args[1]["confirmation_url"])
+    await async_client.get(confirmation_url)
+
+    invalidate.assert_called_once_with("test@example.net")
+
+
 # user doesn't ahve valid token
 @pytest.mark.anyio
 async def test_confirm_user_invalid_token(async_client: AsyncClient):
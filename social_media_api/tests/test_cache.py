@@ -0,0 +1,54 @@
+import pytest
+
+from social_media_api import metrics
+from social_media_api.cache import Cache, CacheBackend, TTLCache
+
+
+@pytest.mark.anyio
+async def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+@pytest.mark.anyio
+async def test_ttl_cache_expires_entries(mocker):
+    monotonic = mocker.patch("social_media_api.cache.time.monotonic", return_value=0)
+    cache = TTLCache(max_size=10, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=120)
+
+    monotonic.return_value = 61
+
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert len(cache) == 1
+
+
+@pytest.mark.anyio
+async def test_cache_counts_hits_and_misses():
+    metrics.reset()
+    cache = Cache("test", ttl=60, max_size=10)
+
+    await cache.get("a")
+    await cache.set("a", {"id": 1})
+    assert await cache.get("a") == {"id": 1}
+
+    assert metrics.snapshot()["cache.test.hits"] == 1
+    assert metrics.snapshot()["cache.test.misses"] == 1
+
+
+@pytest.mark.anyio
+async def test_cache_backend_must_implement_every_method():
+    class Incomplete(CacheBackend):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,111 @@
+import pytest
+
+from social_media_api import circuit_breaker as circuit_breaker_module
+from social_media_api.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+
+
+@pytest.fixture()
+def now(mocker) -> list:
+    now = [0.0]
+    mocker.patch.object(circuit_breaker_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture()
+def breaker(now: list) -> CircuitBreaker:
+    return CircuitBreaker(
+        "test", failure_threshold=2, reset_timeout=10, failure_exceptions=(OSError,)
+    )
+
+
+async def ok():
+    return "ok"
+
+
+async def down():
+    raise OSError("down")
+
+
+@pytest.mark.anyio
+async def test_opens_after_consecutive_failures(breaker: CircuitBreaker):
+    for _ in range(2):
+        with pytest.raises(OSError):
+            await breaker.call(down)
+
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(ok)
+
+
+@pytest.mark.anyio
+async def test_success_resets_failure_count(breaker: CircuitBreaker):
+    with pytest.raises(OSError):
+        await breaker.call(down)
+    assert await breaker.call(ok) == "ok"
+    with pytest.raises(OSError):
+        await breaker.call(down)
+
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.anyio
+async def test_other_errors_dont_count(breaker: CircuitBreaker):
+    async def bug():
+        raise ValueError()
+
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            await breaker.call(bug)
+
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.anyio
+async def test_half_open_probe_closes_circuit(breaker: CircuitBreaker, now: list):
+    for _ in range(2):
+        with pytest.raises(OSError):
+            await breaker.call(down)
+    now[0] = 10
+
+    assert breaker.state == HALF_OPEN
+    assert await breaker.call(ok) == "ok"
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.anyio
+async def test_failed_probe_reopens_circuit(breaker: CircuitBreaker, now: list):
+    for _ in range(2):
+        with pytest.raises(OSError):
+            await breaker.call(down)
+    now[0] = 10
+
+    with pytest.raises(OSError):
+        await breaker.call(down)
+
+    assert breaker.state == OPEN
+    now[0] = 15
+    with pytest.raises(CircuitOpenError):
+        await breaker.call(ok)
+
+
+@pytest.mark.anyio
+async def test_half_open_lets_one_probe_through(breaker: CircuitBreaker, now: list):
+    for _ in range(2):
+        with pytest.raises(OSError):
+            await breaker.call(down)
+    now[0] = 10
+
+    async def probe():
+        # a second call while the probe is running is rejected
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(ok)
+        return "probed"
+
+    assert await breaker.call(probe) == "probed"
+    assert breaker.state == CLOSED
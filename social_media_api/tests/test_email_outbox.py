@@ -0,0 +1,267 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from social_media_api import metrics, tasks
+from social_media_api import rate_limit as rate_limit_module
+from social_media_api.email_outbox import (
+    EmailOutbox,
+    EmailTemplate,
+    Message,
+    send_mailgun_batch,
+    split_batches,
+)
+from social_media_api.rate_limit import TokenBucket
+
+TEMPLATE = EmailTemplate("welcome", "Welcome", "Hi %recipient.email%, %recipient.url%")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float) -> None:
+        self.now += delay
+
+
+@pytest.fixture()
+def clock(mocker) -> FakeClock:
+    clock = FakeClock()
+    mocker.patch.object(rate_limit_module.time, "monotonic", clock.monotonic)
+    mocker.patch.object(rate_limit_module.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture()
+def sent() -> list:
+    return []
+
+
+@pytest.fixture()
+def outbox(sent: list, clock: FakeClock) -> EmailOutbox:
+    async def send_batch(template, messages):
+        sent.append((template.name, [message.to for message in messages]))
+
+    return EmailOutbox(
+        send_batch,
+        flush_interval=60,
+        batch_size=3,
+        bucket=TokenBucket(rate=1, capacity=10),
+    )
+
+
+@pytest.mark.anyio
+async def test_render_fills_recipient_variables():
+    assert TEMPLATE.render({"email": "a@x", "url": "/u"}) == "Hi a@x, /u"
+
+
+@pytest.mark.anyio
+async def test_split_batches_sends_a_recipient_once_per_batch():
+    messages = [Message(TEMPLATE, to, {}) for to in ("a@x", "b@x", "a@x", "c@x")]
+    batches = split_batches(messages, size=2)
+    assert [[m.to for m in batch] for batch in batches] == [
+        ["a@x", "b@x"],
+        ["a@x", "c@x"],
+    ]
+
+
+@pytest.mark.anyio
+async def test_token_bucket_waits_for_refill(clock: FakeClock):
+    bucket = TokenBucket(rate=2, capacity=4)
+
+    assert await bucket.acquire(4) == 0
+    assert await bucket.acquire(3) == pytest.approx(1.5)
+    with pytest.raises(ValueError):
+        await bucket.acquire(5)
+
+
+@pytest.mark.anyio
+async def test_flush_batches_by_template(outbox: EmailOutbox, sent: list):
+    other = EmailTemplate("other", "Other", "Hi")
+    for to in ("a@x", "b@x", "c@x", "d@x"):
+        outbox.add(TEMPLATE, to, {"url": "/u"})
+    outbox.add(other, "a@x", {})
+
+    assert await outbox.flush() == 5
+    assert sent == [
+        ("welcome", ["a@x", "b@x", "c@x"]),
+        ("welcome", ["d@x"]),
+        ("other", ["a@x"]),
+    ]
+
+
+@pytest.mark.anyio
+async def test_add_coalesces_duplicates(outbox: EmailOutbox, sent: list):
+    metrics.reset()
+    outbox.add(TEMPLATE, "a@x", {"url": "/old"})
+    outbox.add(TEMPLATE, "a@x", {"url": "/new"})
+    outbox.add(TEMPLATE, "a@x", {"url": "/post/2"}, key="2")
+
+    assert await outbox.flush() == 2
+    assert metrics.snapshot()["email.coalesced"] == 1
+    # same recipient twice, so two batches
+    assert sent == [("welcome", ["a@x"]), ("welcome", ["a@x"])]
+
+
+@pytest.mark.anyio
+async def test_flush_is_rate_limited(outbox: EmailOutbox, clock: FakeClock):
+    for i in range(13):
+        outbox.add(TEMPLATE, f"{i}@x", {"url": "/u"})
+
+    await outbox.flush()
+
+    # 10 go out in the first burst, 3 more need 3 seconds of refill
+    assert clock.now == pytest.approx(3)
+
+
+@pytest.mark.anyio
+async def test_failed_flush_keeps_messages(outbox: EmailOutbox, sent: list):
+    async def failing(template, messages):
+        raise httpx.ConnectError("down")
+
+    outbox.add(TEMPLATE, "a@x", {"url": "/u"})
+    send_batch, outbox.send_batch = outbox.send_batch, failing
+
+    assert await outbox.flush() == 0
+
+    outbox.send_batch = send_batch
+    assert await outbox.flush() == 1
+    assert sent == [("welcome", ["a@x"])]
+
+
+def mailgun_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "//")
+    response = httpx.Response(status, request=request)
+    return httpx.HTTPStatusError("mailgun", request=request, response=response)
+
+
+@pytest.mark.anyio
+async def test_rejected_batch_drops_only_bad_addresses(outbox: EmailOutbox, sent: list):
+    async def send_batch(template, messages):
+        if any(message.to == "bad" for message in messages):
+            raise mailgun_error(400)
+        sent.append((template.name, [message.to for message in messages]))
+
+    outbox.send_batch = send_batch
+    for to in ("a@x", "bad", "c@x"):
+        outbox.add(TEMPLATE, to, {"url": "/u"})
+
+    assert await outbox.flush() == 2
+    assert sent == [("welcome", ["a@x"]), ("welcome", ["c@x"])]
+    # not retried
+    assert await outbox.flush() == 0
+
+
+@pytest.mark.anyio
+async def test_failed_batch_does_not_hold_back_others(outbox: EmailOutbox, sent: list):
+    other = EmailTemplate("other", "Other", "Hi")
+
+    async def send_batch(template, messages):
+        if template.name == "welcome":
+            raise mailgun_error(503)
+        sent.append((template.name, [message.to for message in messages]))
+
+    outbox.send_batch = send_batch
+    outbox.add(TEMPLATE, "a@x", {"url": "/u"})
+    outbox.add(other, "b@x", {})
+
+    assert await outbox.flush() == 1
+    assert sent == [("other", ["b@x"])]
+
+
+@pytest.mark.anyio
+async def test_retries_are_capped(outbox: EmailOutbox):
+    async def failing(template, messages):
+        raise httpx.ConnectError("down")
+
+    metrics.reset()
+    outbox.send_batch = failing
+    outbox.max_attempts = 2
+    outbox.add(TEMPLATE, "a@x", {"url": "/u"})
+
+    await outbox.flush()
+    await outbox.flush()
+
+    assert outbox._pending == {}
+    assert metrics.snapshot()["email.dropped"] == 1
+
+
+@pytest.mark.anyio
+async def test_background_flush_survives_errors():
+    sent = []
+
+    async def broken_once(template, messages):
+        if not sent:
+            sent.append(None)
+            raise KeyError("url")
+        sent.append([message.to for message in messages])
+
+    outbox = EmailOutbox(broken_once, 0.01, 3, TokenBucket(rate=100, capacity=10))
+    await outbox.start()
+    try:
+        outbox.add(TEMPLATE, "a@x", {"url": "/u"})
+        await asyncio.sleep(0.05)
+        outbox.add(TEMPLATE, "b@x", {"url": "/u"})
+        await asyncio.sleep(0.05)
+    finally:
+        await outbox.stop()
+
+    assert ["b@x"] in sent
+
+
+@pytest.mark.anyio
+async def test_send_mailgun_batch_sends_recipient_variables(mocker):
+    client = mocker.Mock()
+    client.post = mocker.AsyncMock(
+        return_value=httpx.Response(200, request=httpx.Request("POST", "//"))
+    )
+    mocker.patch("social_media_api.email_outbox.get_client", return_value=client)
+    outbox = EmailOutbox(send_mailgun_batch, 60, 10, TokenBucket(rate=10, capacity=10))
+    outbox.add(TEMPLATE, "a@x", {"url": "/a"})
+    outbox.add(TEMPLATE, "b@x", {"url": "/b"})
+
+    await outbox.flush()
+
+    data = client.post.call_args.kwargs["data"]
+    assert data["to"] == ["a@x", "b@x"]
+    assert data["text"] == TEMPLATE.body
+    assert json.loads(data["recipient-variables"]) == {
+        "a@x": {"email": "a@x", "url": "/a"},
+        "b@x": {"email": "b@x", "url": "/b"},
+    }
+
+
+@pytest.mark.anyio
+async def test_registration_email_goes_through_outbox(mocker, mock_httpx_client):
+    mocker.patch.object(tasks.settings, "email_outbox_enabled", True)
+    add = mocker.patch.object(tasks.email_outbox, "add")
+
+    await tasks.send_user_registration_email("a@x", "http://confirm")
+
+    add.assert_called_once_with(
+        tasks.REGISTRATION_EMAIL,
+        "a@x",
+        {"confirmation_url": "http://confirm"},
+        key=None,
+    )
+    mock_httpx_client.post.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_job_email_skips_outbox(mocker, mock_httpx_client):
+    mocker.patch.object(tasks.settings, "email_outbox_enabled", True)
+    add = mocker.patch.object(tasks.email_outbox, "add")
+
+    token = tasks.current_job.set({"attempts": 1, "max_attempts": 3})
+    try:
+        await tasks.send_user_registration_email("a@x", "http://confirm")
+    finally:
+        tasks.current_job.reset(token)
+
+    add.assert_not_called()
+    mock_httpx_client.post.assert_called_once()
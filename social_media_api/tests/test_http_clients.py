@@ -0,0 +1,65 @@
+import httpx
+import pytest
+
+from social_media_api import http_clients, metrics
+
+
+@pytest.fixture(autouse=True)
+async def clean_clients():
+    yield
+    await http_clients.close_clients()
+    metrics.reset()
+
+
+@pytest.mark.anyio
+async def test_get_client_is_shared():
+    client = http_clients.get_client("mailgun")
+
+    assert http_clients.get_client("mailgun") is client
+    assert http_clients.get_client("deepai") is not client
+
+    await http_clients.close_clients()
+    assert client.is_closed
+    assert http_clients.get_client("mailgun") is not client
+
+
+@pytest.mark.anyio
+async def test_client_counts_requests_and_traces():
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.extensions.get("trace"))
+        return httpx.Response(200)
+
+    client = http_clients.get_client("mailgun")
+    client._transport = httpx.MockTransport(handler)
+
+    await client.get("https://example.net/")
+    await client.get("https://example.net/")
+
+    assert metrics.snapshot()["http.mailgun.requests"] == 2
+    assert all(callable(trace) for trace in seen)
+
+
+@pytest.mark.anyio
+async def test_trace_counts_new_connections():
+    trace = http_clients.make_trace("mailgun")
+
+    await trace("connection.connect_tcp.complete", {})
+    await trace("connection.start_tls.complete", {})
+    await trace("http11.send_request_headers.started", {})
+
+    snapshot = metrics.snapshot()
+    assert snapshot["http.mailgun.connections_opened"] == 1
+    assert snapshot["http.mailgun.tls_handshakes"] == 1
+
+
+@pytest.mark.anyio
+async def test_http2_needs_h2(mocker):
+    mocker.patch.object(http_clients, "http2_available", return_value=False)
+    mocker.patch.object(http_clients.settings, "http_client_http2", True)
+
+    # falls back to HTTP/1.1 instead of failing on the missing package
+    client = http_clients.create_client("deepai")
+    assert isinstance(client, httpx.AsyncClient)
+    await client.aclose()
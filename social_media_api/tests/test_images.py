@@ -0,0 +1,110 @@
+import io
+import json
+
+import pytest
+from databases import Database
+from httpx import AsyncClient
+from PIL import Image
+
+from social_media_api import images
+from social_media_api.database import jobs_table, posts
+from social_media_api.images import (
+    generate_image_variants,
+    render_variants,
+    schedule_image_variants,
+)
+from social_media_api.storage import MemoryStorageBackend
+
+
+def make_image(mode: str = "RGB", size: tuple = (1200, 800), fmt: str = "PNG"):
+    out = io.BytesIO()
+    Image.new(mode, size).save(out, fmt)
+    return out.getvalue()
+
+
+@pytest.fixture()
+def image_processor():
+    yield images.image_processor
+    images.image_processor.shutdown()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "P", "L"])
+async def test_render_variants(mode: str):
+    variants = render_variants(make_image(mode), thumbnail_size=300, quality=80)
+
+    with Image.open(io.BytesIO(variants["thumbnail"])) as thumbnail:
+        assert thumbnail.format == "WEBP"
+        assert thumbnail.size == (300, 200)
+    with Image.open(io.BytesIO(variants["webp"])) as webp:
+        assert webp.format == "WEBP"
+        assert webp.size == (1200, 800)
+
+
+@pytest.mark.anyio
+async def test_generate_image_variants(
+    created_post: dict,
+    db: Database,
+    memory_storage: MemoryStorageBackend,
+    image_processor,
+    mocker,
+):
+    original = make_image()
+    mocker.patch("social_media_api.images.download_image", return_value=original)
+    await db.execute(
+        posts.update()
+        .where(posts.c.id == created_post["id"])
+        .values(image_url="https://example.net/cat.png")
+    )
+
+    await generate_image_variants(created_post["id"], "https://example.net/cat.png")
+
+    post = await db.fetch_one(posts.select().where(posts.c.id == created_post["id"]))
+    assert post.thumbnail_url.endswith(f"/posts/{created_post['id']}/thumbnail.webp")
+    assert post.webp_url.endswith(f"/posts/{created_post['id']}/webp.webp")
+    for url in (post.thumbnail_url, post.webp_url):
+        assert len(memory_storage.get(url)) < len(original)
+
+
+@pytest.mark.anyio
+async def test_post_exposes_variant_urls(
+    async_client: AsyncClient, created_post: dict, db: Database
+):
+    await db.execute(
+        posts.update()
+        .where(posts.c.id == created_post["id"])
+        .values(
+            image_url="https://b2/cat.png",
+            thumbnail_url="https://b2/thumbnail.webp",
+            webp_url="https://b2/webp.webp",
+        )
+    )
+
+    [post] = (await async_client.get("/post")).json()
+
+    assert post["thumbnail_url"] == "https://b2/thumbnail.webp"
+    assert post["webp_url"] == "https://b2/webp.webp"
+
+
+@pytest.mark.anyio
+async def test_schedule_image_variants_disabled(mocker):
+    generate = mocker.patch("social_media_api.images.generate_image_variants")
+
+    await schedule_image_variants(1, "https://example.net/cat.png")
+
+    generate.assert_not_called()
+
+
+@pytest.mark.anyio
+async def test_schedule_image_variants_enqueues_job(mocker, db: Database):
+    mocker.patch.object(images.settings, "image_variants_enabled", True)
+    mocker.patch.object(images.settings, "job_queue_enabled", True)
+
+    await schedule_image_variants(1, "https://example.net/cat.png")
+
+    [job] = await db.fetch_all(jobs_table.select())
+    assert job["name"] == "generate_image_variants"
+    assert json.loads(job["payload"]) == {
+        "post_id": 1,
+        "image_url": "https://example.net/cat.png",
+    }
@@ -0,0 +1,169 @@
+import asyncio
+import json
+
+import pytest
+from databases import Database
+from httpx import AsyncClient
+
+from social_media_api import jobs
+from social_media_api.database import jobs_table, posts
+from social_media_api.worker import JobWorker
+
+calls = []
+
+
+@jobs.job(max_attempts=2)
+async def flaky_job(fail: bool = False):
+    calls.append(fail)
+    if fail:
+        raise RuntimeError("boom")
+
+
+@jobs.job(concurrency=1)
+async def slow_job():
+    await asyncio.sleep(0.01)
+
+
+@pytest.fixture()
+def queue_enabled(mocker):
+    mocker.patch.object(jobs.settings, "job_queue_enabled", True)
+    calls.clear()
+
+
+@pytest.fixture()
+def worker(db: Database) -> JobWorker:
+    return JobWorker(db, concurrency=4, poll_interval=0.01, visibility_timeout=5)
+
+
+async def run_all(worker: JobWorker) -> None:
+    await asyncio.gather(*await worker.run_once())
+
+
+async def get_jobs(db: Database) -> list:
+    return await db.fetch_all(jobs_table.select().order_by(jobs_table.c.id))
+
+
+@pytest.mark.anyio
+async def test_create_post_enqueues_image_generation(
+    async_client: AsyncClient,
+    logged_in_token: str,
+    queue_enabled,
+    worker: JobWorker,
+    db: Database,
+    mocker,
+):
+    generate = mocker.patch(
+        "social_media_api.tasks._generate_cute_creature_api",
+        return_value={"output_url": "http://example.net/image.jpg"},
+    )
+    response = await async_client.post(
+        "/post?prompt=A cat",
+        json={"body": "Test Post"},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 201
+    generate.assert_not_called()
+    [job] = await get_jobs(db)
+    assert job["name"] == "generate_and_add_to_post"
+    assert json.loads(job["payload"])["prompt"] == "A cat"
+
+    await run_all(worker)
+
+    generate.assert_called_once_with("A cat")
+    assert await get_jobs(db) == []
+    post = await db.fetch_one(posts.select())
+    assert post["image_url"] == "http://example.net/image.jpg"
+
+
+@pytest.mark.anyio
+async def test_register_enqueues_email(
+    async_client: AsyncClient,
+    queue_enabled,
+    worker: JobWorker,
+    db: Database,
+    mock_httpx_client,
+):
+    await async_client.post(
+        "/register", json={"email": "test@example.net", "password": "1234"}
+    )
+    [job] = await get_jobs(db)
+    assert "/confirm/" in json.loads(job["payload"])["confirmation_url"]
+    mock_httpx_client.post.assert_not_called()
+
+    await run_all(worker)
+
+    mock_httpx_client.post.assert_called_once()
+
+
+@pytest.mark.anyio
+async def test_failed_job_retries_with_backoff(
+    queue_enabled, worker: JobWorker, db: Database, mocker
+):
+    now = mocker.patch("social_media_api.jobs.time.time", return_value=1000.0)
+    await jobs.enqueue(db, flaky_job, fail=True)
+
+    await run_all(worker)
+    [job] = await get_jobs(db)
+    assert (job["status"], job["attempts"]) == ("queued", 1)
+    assert job["run_at"] == 1000 + jobs.settings.job_retry_backoff_seconds
+    assert "boom" in job["last_error"]
+
+    # not due yet
+    assert await worker.run_once() == []
+
+    now.return_value = job["run_at"]
+    await run_all(worker)
+    [job] = await get_jobs(db)
+    assert (job["status"], job["attempts"]) == ("failed", 2)
+    assert calls == [True, True]
+
+
+@pytest.mark.anyio
+async def test_expired_lease_is_reclaimed(queue_enabled, db: Database, mocker):
+    now = mocker.patch("social_media_api.jobs.time.time", return_value=1000.0)
+    await jobs.enqueue(db, flaky_job)
+
+    first = await jobs.claim(db, lease=30)
+    assert await jobs.claim(db, lease=30) is None
+
+    now.return_value = 1031.0
+    second = await jobs.claim(db, lease=30)
+    assert second["attempts"] == 2
+
+    # the first worker lost the job, finishing it late changes nothing
+    await jobs.complete(db, first)
+    assert len(await get_jobs(db)) == 1
+    await jobs.complete(db, second)
+    assert await get_jobs(db) == []
+
+
+@pytest.mark.anyio
+async def test_expired_lease_on_last_attempt_fails(queue_enabled, db: Database, mocker):
+    # flaky_job has 2 attempts, and its worker dies on both
+    now = mocker.patch("social_media_api.jobs.time.time", return_value=1000.0)
+    await jobs.enqueue(db, flaky_job)
+    await jobs.claim(db, lease=30)
+    now.return_value = 1031.0
+    await jobs.claim(db, lease=30)
+
+    now.return_value = 1062.0
+    assert await jobs.claim(db, lease=30) is None
+    [job] = await get_jobs(db)
+    assert (job["status"], job["attempts"]) == ("failed", 2)
+    assert job["locked_until"] is None
+
+
+@pytest.mark.anyio
+async def test_job_concurrency_limit(queue_enabled, worker: JobWorker, db: Database):
+    await jobs.enqueue(db, slow_job)
+    await jobs.enqueue(db, slow_job)
+    await jobs.enqueue(db, flaky_job)
+
+    started = await worker.run_once()
+
+    # one slow_job at a time, the other kind isn't held up
+    assert len(started) == 2
+    await asyncio.gather(*started)
+    assert len(await get_jobs(db)) == 1
+    await run_all(worker)
+    assert await get_jobs(db) == []
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+from databases import Database
+from httpx import AsyncClient
+
+from social_media_api import like_buffer as like_buffer_module
+from social_media_api.database import likes_table, posts
+from social_media_api.like_buffer import LikeBuffer
+
+
+@pytest.fixture()
+def like_buffer(db: Database) -> LikeBuffer:
+    return LikeBuffer(db, flush_interval=60, max_size=100)
+
+
+async def get_like_count(db: Database, post_id: int) -> int:
+    query = posts.select().where(posts.c.id == post_id)
+    return (await db.fetch_one(query)).like_count
+
+
+@pytest.mark.anyio
+async def test_flush_writes_buffered_likes(
+    like_buffer: LikeBuffer, created_post: dict, db: Database
+):
+    for user_id in (1, 2, 2, 3):
+        like_buffer.add(created_post["id"], user_id)
+
+    assert await like_buffer.flush() == 3
+    assert await get_like_count(db, created_post["id"]) == 3
+    assert len(await db.fetch_all(likes_table.select())) == 3
+
+
+@pytest.mark.anyio
+async def test_discard_cancels_buffered_like(
+    like_buffer: LikeBuffer, created_post: dict, db: Database
+):
+    like_buffer.add(created_post["id"], 1)
+    like_buffer.discard(created_post["id"], 1)
+
+    assert await like_buffer.flush() == 0
+    assert await get_like_count(db, created_post["id"]) == 0
+
+
+@pytest.mark.anyio
+async def test_unlike_during_flush_wins(
+    like_buffer: LikeBuffer, created_post: dict, db: Database, mocker
+):
+    insert_likes = like_buffer_module.insert_likes
+    inserting = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_insert_likes(*args):
+        inserting.set()
+        await release.wait()
+        return await insert_likes(*args)
+
+    mocker.patch.object(like_buffer_module, "insert_likes", slow_insert_likes)
+    like_buffer.add(created_post["id"], 1)
+    flush = asyncio.create_task(like_buffer.flush())
+    await inserting.wait()
+
+    unlike = asyncio.create_task(like_buffer.unlike(created_post["id"], 1))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(flush, unlike)
+
+    assert await get_like_count(db, created_post["id"]) == 0
+    assert await db.fetch_all(likes_table.select()) == []
+
+
+@pytest.mark.anyio
+async def test_failed_flush_keeps_likes(
+    like_buffer: LikeBuffer, created_post: dict, db: Database, mocker
+):
+    like_buffer.add(created_post["id"], 1)
+    mocker.patch(
+        "social_media_api.like_buffer.insert_likes", side_effect=RuntimeError("down")
+    )
+
+    assert await like_buffer.flush() == 0
+
+    mocker.stopall()
+    assert await like_buffer.flush() == 1
+
+
+@pytest.mark.anyio
+async def test_full_buffer_flushes_early(created_post: dict, db: Database):
+    like_buffer = LikeBuffer(db, flush_interval=60, max_size=2)
+    await like_buffer.start()
+    like_buffer.add(created_post["id"], 1)
+    like_buffer.add(created_post["id"], 2)
+    # well before the 60s interval
+    for _ in range(50):
+        if await get_like_count(db, created_post["id"]) == 2:
+            break
+        await asyncio.sleep(0.01)
+    else:
+        pytest.fail("full buffer was not flushed")
+    await like_buffer.stop()
+
+
+@pytest.mark.anyio
+async def test_like_post_buffered(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str, db, mocker
+):
+    mocker.patch.object(like_buffer_module.settings, "like_buffer_enabled", True)
+    response = await async_client.post(
+        "/like",
+        json={"post_id": created_post["id"]},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    assert response.status_code == 202
+    assert await get_like_count(db, created_post["id"]) == 0
+
+    await like_buffer_module.like_buffer.flush()
+
+    assert await get_like_count(db, created_post["id"]) == 1
@@ -0,0 +1,101 @@
+from unittest.mock import Mock
+
+import pytest
+import sqlalchemy as sa
+
+from social_media_api.migrations import MIGRATIONS, create_index, run_migrations
+
+
+@pytest.fixture()
+def engine(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    yield engine
+    engine.dispose()
+
+
+@pytest.mark.anyio
+async def test_run_migrations_fresh_database(engine):
+    assert run_migrations(engine) == [m.version for m in MIGRATIONS]
+
+    inspector = sa.inspect(engine)
+    assert {"users", "posts", "comments", "likes"} <= set(inspector.get_table_names())
+    assert "ix_comments_post_id_id" in {
+        i["name"] for i in inspector.get_indexes("comments")
+    }
+
+
+@pytest.mark.anyio
+async def test_run_migrations_is_idempotent(engine):
+    run_migrations(engine)
+    assert run_migrations(engine) == []
+
+
+@pytest.mark.anyio
+async def test_run_migrations_upgrades_existing_database(engine):
+    # schema as created by the old import-time metadata.create_all
+    with engine.begin() as conn:
+        for create in (
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR UNIQUE, "
+            "password VARCHAR, confirmed BOOLEAN)",
+            "CREATE TABLE posts (id INTEGER PRIMARY KEY, body VARCHAR, "
+            "user_id INTEGER NOT NULL, image_url VARCHAR)",
+            "CREATE TABLE comments (id INTEGER PRIMARY KEY, body VARCHAR, "
+            "post_id INTEGER NOT NULL, user_id INTEGER NOT NULL)",
+            "CREATE TABLE likes (id INTEGER PRIMARY KEY, post_id INTEGER NOT NULL, "
+            "user_id INTEGER NOT NULL)",
+        ):
+            conn.execute(sa.text(create))
+        conn.execute(
+            sa.text("INSERT INTO posts (id, body, user_id) VALUES (1, 'a', 1)")
+        )
+        conn.execute(
+            sa.text(
+                "INSERT INTO likes (post_id, user_id) VALUES (1, 1), (1, 2), (1, 2)"
+            )
+        )
+
+    run_migrations(engine)
+
+    with engine.connect() as conn:
+        like_count = conn.execute(sa.text("SELECT like_count FROM posts")).scalar()
+    assert like_count == 2
+    assert "ix_posts_like_count_id" in {
+        i["name"] for i in sa.inspect(engine).get_indexes("posts")
+    }
+    # the duplicate like is gone and can't come back
+    assert {"ux_likes_post_id_user_id"} == {
+        i["name"] for i in sa.inspect(engine).get_indexes("likes")
+    }
+
+
+def postgres_connection(index_valid) -> Mock:
+    conn = Mock()
+    conn.dialect.name = "postgresql"
+    conn.execute.return_value.scalar.return_value = index_valid
+    return conn
+
+
+def executed(conn: Mock) -> list[str]:
+    return [str(call.args[0]) for call in conn.execute.call_args_list]
+
+
+@pytest.mark.anyio
+async def test_create_index_rebuilds_invalid_index():
+    # left behind by a failed CREATE INDEX CONCURRENTLY
+    conn = postgres_connection(index_valid=False)
+
+    create_index(conn, "ux_likes", "likes", "post_id", unique=True)
+
+    statements = executed(conn)
+    assert statements[1] == "DROP INDEX CONCURRENTLY IF EXISTS ux_likes"
+    assert statements[2].startswith("CREATE UNIQUE INDEX CONCURRENTLY")
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("index_valid", [True, None])
+async def test_create_index_keeps_valid_index(index_valid):
+    conn = postgres_connection(index_valid)
+
+    create_index(conn, "ux_likes", "likes", "post_id", unique=True)
+
+    assert not any(s.startswith("DROP") for s in executed(conn))
@@ -0,0 +1,126 @@
+import math
+
+import pytest
+from databases import Database
+
+from social_media_api.database import post_scores, posts
+from social_media_api.ranking import (
+    add_likes,
+    like_weight,
+    mark_scores_stale,
+    refresh_post_scores,
+)
+from social_media_api.tests.helpers import like_post
+
+HOUR = 60 * 60
+
+
+async def get_scores(db: Database) -> dict[int, float]:
+    rows = await db.fetch_all(post_scores.select())
+    return {row["post_id"]: row["score"] for row in rows}
+
+
+async def set_like_count(db: Database, post_id: int, like_count: int) -> None:
+    await db.execute(
+        posts.update().where(posts.c.id == post_id).values(like_count=like_count)
+    )
+    await mark_scores_stale(db, [post_id])
+
+
+async def insert_post(db: Database, body: str) -> None:
+    post_id = await db.execute(posts.insert().values(body=body, user_id=1))
+    await mark_scores_stale(db, [post_id])
+
+
+@pytest.mark.anyio
+async def test_add_likes_decays_with_age():
+    now = like_weight(1_750_000_000)
+    day_old = like_weight(1_750_000_000 - 24 * HOUR)
+
+    # with the default 24h half life a like from yesterday is worth half
+    assert add_likes(day_old, 1, now, 0) == pytest.approx(now + math.log(1.5))
+    assert add_likes(now, 0, now, 0) == now
+
+
+@pytest.mark.anyio
+async def test_add_likes_unlike_never_drops_to_zero():
+    score = add_likes(0.0, -5, 0.0, 2)
+    assert math.isfinite(score)
+    assert score < 0
+
+
+@pytest.mark.anyio
+async def test_add_likes_unlike_of_old_post_removes_one_like():
+    week_ago = like_weight(1_750_000_000 - 7 * 24 * HOUR)
+    now = like_weight(1_750_000_000)
+    # scored a week ago with 9 likes, plus its starting weight
+    score = week_ago + math.log(10)
+
+    assert add_likes(score, -1, now, 9) == pytest.approx(score + math.log(0.9))
+
+
+@pytest.mark.anyio
+async def test_refresh_post_scores(created_post: dict, db: Database):
+    assert await refresh_post_scores(db, now=1_750_000_000) == 1
+    [score] = (await get_scores(db)).values()
+    assert score == pytest.approx(like_weight(1_750_000_000))
+
+    # nothing changed, nothing to write
+    assert await refresh_post_scores(db, now=1_750_000_000) == 0
+
+    await set_like_count(db, created_post["id"], 2)
+    assert await refresh_post_scores(db, now=1_750_000_000 + HOUR) == 1
+    [new_score] = (await get_scores(db)).values()
+    assert new_score > score
+
+
+@pytest.mark.anyio
+async def test_refresh_post_scores_prefers_recent_likes(
+    created_post: dict, db: Database
+):
+    await insert_post(db, "Second")
+    await refresh_post_scores(db, now=1_750_000_000)
+
+    # same number of likes, but post 2 got them two days later
+    await set_like_count(db, 1, 3)
+    await refresh_post_scores(db, now=1_750_000_000)
+    await set_like_count(db, 2, 3)
+    await refresh_post_scores(db, now=1_750_000_000 + 48 * HOUR)
+
+    scores = await get_scores(db)
+    assert scores[2] > scores[1]
+
+
+@pytest.mark.anyio
+async def test_refresh_post_scores_in_batches(created_post: dict, db: Database):
+    for i in range(4):
+        await insert_post(db, f"Post {i}")
+
+    assert await refresh_post_scores(db, batch_size=2) == 5
+    assert len(await get_scores(db)) == 5
+
+
+@pytest.mark.anyio
+async def test_refresh_post_scores_reads_only_queued_posts(
+    created_post: dict, db: Database
+):
+    await refresh_post_scores(db, now=1_750_000_000)
+
+    # not queued, so not seen
+    await db.execute(posts.update().values(like_count=5))
+    assert await refresh_post_scores(db, now=1_750_000_000) == 0
+
+    await mark_scores_stale(db, [created_post["id"]])
+    assert await refresh_post_scores(db, now=1_750_000_000) == 1
+    assert await refresh_post_scores(db, now=1_750_000_000) == 0
+
+
+@pytest.mark.anyio
+async def test_liking_queues_the_post(
+    async_client, created_post: dict, logged_in_token: str, db: Database
+):
+    await refresh_post_scores(db, now=1_750_000_000)
+
+    await like_post(created_post["id"], async_client, logged_in_token)
+
+    assert await refresh_post_scores(db, now=1_750_000_000) == 1
@@ -0,0 +1,98 @@
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+from httpx import AsyncClient
+
+from social_media_api import replicas
+from social_media_api.database import database
+from social_media_api.security import get_user
+from social_media_api.tests.helpers import create_post
+
+
+def make_replica(rows=None, row=None) -> Mock:
+    return Mock(
+        fetch_all=AsyncMock(return_value=rows or []),
+        fetch_one=AsyncMock(return_value=row),
+    )
+
+
+@pytest.mark.anyio
+async def test_read_database_round_robin(mocker):
+    first, second = make_replica(), make_replica()
+    mocker.patch.object(replicas, "replicas", [first, second])
+
+    chosen = {id(replicas.read_database()) for _ in range(4)}
+
+    assert chosen == {id(first), id(second)}
+    assert replicas.read_database(use_primary=True) is database
+
+
+@pytest.mark.anyio
+async def test_read_database_without_replicas():
+    assert replicas.read_database() is database
+
+
+@pytest.mark.anyio
+async def test_feed_reads_from_replica(
+    async_client: AsyncClient, created_post: dict, mocker
+):
+    replica = make_replica()
+    mocker.patch.object(replicas, "replicas", [replica])
+
+    response = await async_client.get("/post")
+
+    # the replica hasn't seen the post yet
+    assert response.json() == []
+    replica.fetch_all.assert_awaited_once()
+
+
+@pytest.mark.anyio
+async def test_read_your_writes(
+    async_client: AsyncClient, logged_in_token: str, mocker
+):
+    replica = make_replica()
+    mocker.patch.object(replicas, "replicas", [replica])
+
+    post = await create_post("Test Post", async_client, logged_in_token)
+    assert replicas.READ_PRIMARY_COOKIE in async_client.cookies
+
+    response = await async_client.get(f"/post/{post['id']}")
+    assert response.status_code == 200
+    replica.fetch_all.assert_not_awaited()
+
+
+@pytest.mark.anyio
+async def test_read_your_writes_skips_replica_pages_in_feed_cache(
+    async_client: AsyncClient, logged_in_token: str, mocker
+):
+    replica = make_replica()
+    mocker.patch.object(replicas, "replicas", [replica])
+    await create_post("Test Post", async_client, logged_in_token)
+    cookie = async_client.cookies[replicas.READ_PRIMARY_COOKIE]
+
+    # another client, still reading from the lagging replica
+    async_client.cookies.delete(replicas.READ_PRIMARY_COOKIE)
+    assert (await async_client.get("/post")).json() == []
+
+    async_client.cookies.set(replicas.READ_PRIMARY_COOKIE, cookie)
+    response = await async_client.get("/post")
+    assert [post["body"] for post in response.json()] == ["Test Post"]
+
+
+@pytest.mark.anyio
+async def test_no_cookie_without_replicas(
+    async_client: AsyncClient, logged_in_token: str
+):
+    await create_post("Test Post", async_client, logged_in_token)
+    assert replicas.READ_PRIMARY_COOKIE not in async_client.cookies
+
+
+@pytest.mark.anyio
+async def test_get_user_falls_back_to_primary(registered_user: dict, mocker):
+    replica = make_replica(row=None)
+    mocker.patch.object(replicas, "replicas", [replica])
+
+    user = await get_user(registered_user["email"])
+
+    assert user.id == registered_user["id"]
+    replica.fetch_one.assert_awaited_once()
@@ -31,6 +31,34 @@ async def test_get_user_not_found():
     assert user is None
 
 
+@pytest.mark.anyio
+async def test_get_cached_user(registered_user: dict, mocker):
+    spy = mocker.spy(security, "get_user")
+
+    first = await security.get_cached_user(registered_user["email"])
+    second = await security.get_cached_user(registered_user["email"])
+
+    assert first == second
+    assert second.id == registered_user["id"]
+    spy.assert_called_once()
+
+
+@pytest.mark.anyio
+async def test_get_cached_user_not_found():
+    assert await security.get_cached_user("doesnotexist@example.com") is None
+
+
+@pytest.mark.anyio
+async def test_invalidate_cached_user(registered_user: dict, mocker):
+    await security.get_cached_user(registered_user["email"])
+    spy = mocker.spy(security, "get_user")
+
+    await security.invalidate_cached_user(registered_user["email"])
+    await security.get_cached_user(registered_user["email"])
+
+    spy.assert_called_once()
+
+
 @pytest.mark.anyio
 async def test_password_hashes():
     password = "password123"
@@ -39,6 +67,24 @@ async def test_password_hashes():
     assert security.verify_password(password, hashed)
 
 
+@pytest.mark.anyio
+async def test_password_hashes_off_event_loop():
+    password = "password123"
+    hashed = await security.hash_password(password)
+
+    assert await security.check_password(password, hashed)
+    assert not await security.check_password("wrongpassword", hashed)
+
+
+@pytest.mark.anyio
+async def test_password_hasher_rejects_when_overloaded(mocker):
+    mocker.patch.object(security.password_hasher, "max_pending", 0)
+
+    with pytest.raises(security.HTTPException) as exc_info:
+        await security.hash_password("password123")
+    assert exc_info.value.status_code == 503
+
+
 @pytest.mark.anyio
 async def test_authenticate_user(confirmed_user: dict):
     user = await security.authenticate_user(
@@ -120,6 +166,38 @@ async def test_get_subject_for_token_type_Invalid_token():
     assert "Invalid Token" == exc_info.value.detail
 
 
+@pytest.mark.anyio
+async def test_get_subject_for_token_type_cached(mocker):
+    token = security.create_access_token("test@example.com")
+    spy = mocker.spy(security.jwt, "decode")
+
+    for _ in range(3):
+        assert "test@example.com" == security.get_subject_for_token_type(
+            token, "access"
+        )
+    spy.assert_called_once()
+
+
+@pytest.mark.anyio
+async def test_get_subject_for_token_type_cache_keeps_type_check():
+    token = security.create_confirmation_token("test@example.com")
+    security.get_subject_for_token_type(token, "confirmation")
+
+    with pytest.raises(security.HTTPException) as exc_info:
+        security.get_subject_for_token_type(token, "access")
+    assert "Token has incorrect type" <= exc_info.value.detail
+
+
+@pytest.mark.anyio
+async def test_get_subject_for_token_type_tampered_cached_token():
+    token = security.create_access_token("test@example.com")
+    security.get_subject_for_token_type(token, "access")
+
+    with pytest.raises(security.HTTPException) as exc_info:
+        security.get_subject_for_token_type(token[:-2] + "xx", "access")
+    assert "Invalid Token" == exc_info.value.detail
+
+
 # sub field missing
 @pytest.mark.anyio
 async def test_get_subject_for_token_type_missing_sub():
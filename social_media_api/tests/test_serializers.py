@@ -0,0 +1,41 @@
+import pytest
+from httpx import AsyncClient
+
+from social_media_api.config import settings
+from social_media_api.database import database, posts
+from social_media_api.models.post import UserPostWithLikes
+from social_media_api.routers.post import select_post_and_likes
+from social_media_api.serializers import dumps, serialize_post
+from social_media_api.tests.helpers import create_comment, like_post
+
+
+@pytest.mark.anyio
+async def test_serialize_post_matches_model(created_post: dict):
+    await database.execute(
+        posts.update().values(image_url="http://example.net/image.jpg")
+    )
+    row = await database.fetch_one(select_post_and_likes)
+
+    expected = UserPostWithLikes.model_validate(row).model_dump_json()
+    assert dumps(serialize_post(row)) == expected.encode()
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    "url", ["/post", "/post/1", "/post/1/comment?limit=1", "/post?limit=1"]
+)
+async def test_fast_serialization_same_response(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str, mocker, url
+):
+    for body in ("First", "Second"):
+        await create_comment(body, created_post["id"], async_client, logged_in_token)
+    await like_post(created_post["id"], async_client, logged_in_token)
+
+    fast = await async_client.get(url)
+    mocker.patch.object(settings, "fast_serialization", False)
+    mocker.patch("social_media_api.routers.post.get_feed_version", return_value="v2")
+    validated = await async_client.get(url)
+
+    assert fast.status_code == validated.status_code == 200
+    assert fast.json() == validated.json()
+    assert fast.headers.get("X-Next-Cursor") == validated.headers.get("X-Next-Cursor")
@@ -0,0 +1,152 @@
+import errno
+import hashlib
+import os
+
+import pytest
+
+from social_media_api import storage as storage_module
+from social_media_api.storage import (
+    LocalStorageBackend,
+    MemoryStorageBackend,
+    StorageBackend,
+    copy_fd,
+    storage_key,
+)
+
+
+@pytest.fixture()
+def local(tmp_path) -> LocalStorageBackend:
+    return LocalStorageBackend(str(tmp_path / "media"), "/media/")
+
+
+def local_path(local: LocalStorageBackend, url: str):
+    return local.root / url.removeprefix("/media/")
+
+
+@pytest.mark.anyio
+async def test_storage_key_stays_inside_root():
+    prefix, *rest = storage_key("../../etc/passwd").split("/")
+    assert len(prefix) == 32
+    assert rest == ["etc", "passwd"]
+
+
+@pytest.mark.anyio
+async def test_local_upload_file(local: LocalStorageBackend, tmp_path):
+    source = tmp_path / "source.png"
+    source.write_bytes(b"x" * 100_000)
+
+    url = local.upload_file(str(source), "cat.png")
+
+    assert url.startswith("/media/") and url.endswith("/cat.png")
+    assert local_path(local, url).read_bytes() == b"x" * 100_000
+
+
+@pytest.mark.anyio
+async def test_local_same_name_gets_own_url(local: LocalStorageBackend):
+    first = local.upload_bytes(b"one", "cat.png")
+    second = local.upload_bytes(b"two", "cat.png")
+
+    assert first != second
+    assert local_path(local, first).read_bytes() == b"one"
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("backend", ["local", "memory"])
+async def test_large_file(backend: str, local: LocalStorageBackend):
+    store = local if backend == "local" else MemoryStorageBackend()
+    file_id = store.start_large_file("video.mp4")
+    sha1s = [
+        store.upload_part(file_id, number, data)
+        for number, data in ((2, b"efgh"), (1, b"abcd"))
+    ][::-1]
+
+    url = store.finish_large_file(file_id, sha1s)
+
+    content = (
+        local_path(local, url).read_bytes() if backend == "local" else store.get(url)
+    )
+    assert content == b"abcdefgh"
+    assert sha1s == [
+        hashlib.sha1(b"abcd").hexdigest(),
+        hashlib.sha1(b"efgh").hexdigest(),
+    ]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("backend", ["local", "memory"])
+async def test_large_file_needs_two_parts(backend: str, local: LocalStorageBackend):
+    # as B2 does
+    store = local if backend == "local" else MemoryStorageBackend()
+    file_id = store.start_large_file("video.mp4")
+    sha1 = store.upload_part(file_id, 1, b"abcd")
+
+    with pytest.raises(ValueError):
+        store.finish_large_file(file_id, [sha1])
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("backend", ["local", "memory"])
+async def test_delete_file(backend: str, local: LocalStorageBackend):
+    store = local if backend == "local" else MemoryStorageBackend()
+    url = store.upload_bytes(b"one", "cat.png")
+
+    store.delete_file(url, "cat.png")
+
+    if backend == "local":
+        assert not local_path(local, url).exists()
+    else:
+        assert store.files == {}
+
+
+@pytest.mark.anyio
+async def test_local_cancel_large_file(local: LocalStorageBackend):
+    file_id = local.start_large_file("video.mp4")
+    local.upload_part(file_id, 1, b"abcd")
+
+    local.cancel_large_file(file_id)
+
+    assert not (local.work_root / "parts" / file_id).exists()
+
+
+@pytest.mark.anyio
+async def test_local_parts_are_not_served(local: LocalStorageBackend):
+    file_id = local.start_large_file("video.mp4")
+    local.upload_part(file_id, 1, b"abcd")
+
+    assert not local.root.exists() or not any(local.root.rglob("*"))
+
+
+@pytest.mark.anyio
+async def test_backend_must_implement_every_method():
+    class Incomplete(StorageBackend):
+        def upload_bytes(self, data, file_name, content_type=None):
+            return "url"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+@pytest.mark.anyio
+async def test_upload_part_checks_sha1():
+    store = MemoryStorageBackend()
+    file_id = store.start_large_file("video.mp4")
+
+    with pytest.raises(ValueError):
+        store.upload_part(file_id, 1, b"abcd", sha1=hashlib.sha1(b"abce").hexdigest())
+
+
+@pytest.mark.anyio
+async def test_copy_fd_falls_back_without_kernel_copy(tmp_path, mocker):
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, "cross-device")
+
+    mocker.patch.object(storage_module.os, "copy_file_range", unsupported)
+    mocker.patch.object(storage_module.os, "sendfile", unsupported)
+    source, target = tmp_path / "source", tmp_path / "target"
+    source.write_bytes(b"y" * 50_000)
+
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        assert copy_fd(src.fileno(), dst.fileno()) == 50_000
+
+    assert target.read_bytes() == b"y" * 50_000
+    assert os.path.getsize(target) == 50_000
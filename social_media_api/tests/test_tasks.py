@@ -1,12 +1,17 @@
+import asyncio
+
 import httpx
 import pytest
 from databases import Database
 
+from social_media_api import jobs, metrics, tasks
+from social_media_api.circuit_breaker import CircuitOpenError
 from social_media_api.database import database, posts
 from social_media_api.tasks import (
     APIResponseError,
     _generate_cute_creature_api,
     generate_and_add_to_post,
+    generate_image,
     send_simple_email,
 )
 
@@ -47,8 +52,19 @@ async def test_generate_cute_creature_api_server_error(mock_httpx_client):
         status_code=500, content="", request=httpx.Request("POST", "//")
     )
 
+    # worth retrying, so not an APIResponseError
+    with pytest.raises(httpx.HTTPStatusError):
+        await _generate_cute_creature_api("A cat")
+
+
+@pytest.mark.anyio
+async def test_generate_cute_creature_api_rejected(mock_httpx_client):
+    mock_httpx_client.post.return_value = httpx.Response(
+        status_code=400, content="", request=httpx.Request("POST", "//")
+    )
+
     with pytest.raises(
-        APIResponseError, match="API request failed with status code 500"
+        APIResponseError, match="API request failed with status code 400"
     ):
         await _generate_cute_creature_api("A cat")
 
@@ -85,4 +101,79 @@ async def test_generate_and_add_to_post_success(
     assert updated_post.image_url == json_data["output_url"]
 
 
+@pytest.mark.anyio
+async def test_generate_and_add_to_post_retries_while_circuit_open(
+    created_post: dict, confirmed_user: dict, db: Database, mocker
+):
+    mocker.patch.object(tasks, "generate_image", side_effect=CircuitOpenError())
+    send_email = mocker.patch.object(tasks, "send_email")
+    args = (confirmed_user["email"], created_post["id"], "/post/1", db)
+
+    token = jobs.current_job.set({"attempts": 1, "max_attempts": 3})
+    try:
+        with pytest.raises(CircuitOpenError):
+            await generate_and_add_to_post(*args)
+        send_email.assert_not_called()
+
+        # last attempt
+        jobs.current_job.set({"attempts": 3, "max_attempts": 3})
+        await generate_and_add_to_post(*args)
+    finally:
+        jobs.current_job.reset(token)
+    send_email.assert_called_once()
+    assert send_email.call_args.args[0] is tasks.IMAGE_FAILED_EMAIL
+
+
+@pytest.mark.anyio
+async def test_generate_image_reuses_result_for_same_prompt(mocker):
+    generate = mocker.patch(
+        "social_media_api.tasks._generate_cute_creature_api",
+        return_value={"output_url": "https://example.com/image.jpg"},
+    )
+
+    first, second = await asyncio.gather(
+        generate_image("A cat"), generate_image("A cat")
+    )
+    cached = await generate_image("A cat")
+
+    assert first == second == cached == {"output_url": "https://example.com/image.jpg"}
+    generate.assert_called_once_with("A cat")
+
+
+@pytest.mark.anyio
+async def test_generate_image_bounds_concurrency(mocker):
+    mocker.patch.object(tasks, "_image_slots", asyncio.Semaphore(2))
+    most = 0
+
+    async def generate(prompt):
+        nonlocal most
+        most = max(most, tasks._images_in_flight)
+        await asyncio.sleep(0.01)
+        return {"output_url": prompt}
+
+    mocker.patch("social_media_api.tasks._generate_cute_creature_api", generate)
+
+    await asyncio.gather(*(generate_image(f"cat {i}") for i in range(5)))
+
+    assert most == 2
+
+
+@pytest.mark.anyio
+async def test_generate_image_fails_fast_when_circuit_open(mocker):
+    metrics.reset()
+    generate = mocker.patch(
+        "social_media_api.tasks._generate_cute_creature_api",
+        side_effect=APIResponseError("down"),
+    )
+    for i in range(tasks.image_breaker.failure_threshold):
+        with pytest.raises(APIResponseError, match="down"):
+            await generate_image(f"cat {i}")
+
+    with pytest.raises(CircuitOpenError):
+        await generate_image("another cat")
+
+    assert generate.call_count == tasks.image_breaker.failure_threshold
+    assert metrics.snapshot()["circuit.deepai.state"] == 2
+
+
 # pytest social_media_api/tests/test_tasks.py
@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import threading
+
+import pytest
+
+from social_media_api import metrics
+from social_media_api.storage import StorageBackend
+from social_media_api.uploads import record_uploaded_file, stream_upload
+
+
+class FakeStorage(StorageBackend):
+    def __init__(self, fail_part: int = 0):
+        self.fail_part = fail_part
+        self.small = []
+        self.parts = {}
+        self.finished = None
+        self.cancelled = []
+        self.deleted = []
+        self.in_flight_at_cancel = None
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self._lock = threading.Lock()
+
+    def upload_file(self, local_file, file_name):
+        raise AssertionError("streamed uploads never stage a file")
+
+    def upload_bytes(self, data, file_name, content_type=None):
+        self.small.append(data)
+        return f"https://b2/{file_name}"
+
+    def start_large_file(self, file_name, content_type=None):
+        return "file-1"
+
+    def upload_part(self, file_id, number, data, sha1=None):
+        with self._lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            if number == self.fail_part:
+                raise OSError("part failed")
+            threading.Event().wait(0.01)
+            self.parts[number] = data
+            return f"sha1-{number}"
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def finish_large_file(self, file_id, sha1s):
+        self.finished = sha1s
+        return "https://b2/large"
+
+    def cancel_large_file(self, file_id):
+        self.in_flight_at_cancel = self.in_flight
+        self.cancelled.append(file_id)
+
+    def delete_file(self, file_url, file_name):
+        self.deleted.append(file_url)
+
+
+@pytest.fixture()
+def b2(mocker) -> FakeStorage:
+    return mocker.patch("social_media_api.uploads.storage", FakeStorage())
+
+
+async def body(*chunks: bytes):
+    for chunk in chunks:
+        await asyncio.sleep(0)
+        yield chunk
+
+
+@pytest.mark.anyio
+async def test_small_body_is_a_single_upload(b2: FakeStorage):
+    url = await stream_upload(body(b"ab", b"cd"), "f.txt", part_size=4)
+
+    assert url == "https://b2/f.txt"
+    assert b2.small == [b"abcd"]
+    assert b2.parts == {}
+
+
+@pytest.mark.anyio
+async def test_large_body_is_sent_in_parts(b2: FakeStorage):
+    url = await stream_upload(
+        body(b"abc", b"defgh", b"ij"), "f.txt", part_size=4, concurrency=2
+    )
+
+    assert url == "https://b2/large"
+    assert b2.parts == {1: b"abcd", 2: b"efgh", 3: b"ij"}
+    assert b2.finished == ["sha1-1", "sha1-2", "sha1-3"]
+    assert b2.most_in_flight <= 2
+
+
+@pytest.mark.anyio
+async def test_failed_part_cancels_large_file(b2: FakeStorage):
+    b2.fail_part = 2
+
+    with pytest.raises(OSError, match="part failed"):
+        await stream_upload(body(b"x" * 20), "f.txt", part_size=4, concurrency=2)
+
+    assert b2.cancelled == ["file-1"]
+    assert b2.finished is None
+
+
+@pytest.mark.anyio
+async def test_failed_part_waits_for_parts_in_flight(b2: FakeStorage):
+    b2.fail_part = 1
+
+    with pytest.raises(OSError, match="part failed"):
+        await stream_upload(body(b"x" * 20), "f.txt", part_size=4, concurrency=2)
+
+    # part 2 was still uploading when part 1 failed
+    assert b2.in_flight_at_cancel == 0
+    assert 2 in b2.parts
+
+
+@pytest.mark.anyio
+async def test_duplicate_large_body_is_deleted(b2: FakeStorage):
+    await record_uploaded_file(
+        hashlib.sha256(b"abcdefghij").hexdigest(), "https://b2/first", 10
+    )
+    metrics.reset()
+
+    url = await stream_upload(body(b"abcdefghij"), "f.txt", part_size=4)
+
+    assert url == "https://b2/first"
+    assert b2.deleted == ["https://b2/large"]
+    assert metrics.snapshot()["uploads.bytes_saved"] == 10
@@ -0,0 +1,186 @@
+# Streams an upload to storage as it arrives, without staging it on disk.
+#
+# The body is cut into parts of upload_part_size_bytes. Once there is more than
+# one part's worth, a large file is started and every full part is sent
+# while the rest is still being received, up to upload_part_concurrency parts
+# at once. When that many are in flight reading stops, so a slow store applies
+# backpressure to the client instead of piling parts up in memory. A body that
+# fits in one part is sent with a single upload instead. Storage backends are
+# synchronous, every call runs in a thread.
+#
+# Uploads are content addressed: the sha256 of every uploaded file is kept in
+# uploaded_files, and a file that was uploaded before isn't stored again,
+# the caller gets the existing url. A streamed body is hashed as it arrives; one
+# that fits in a single part is looked up before it's sent. A larger one is
+# already on its way by the time its digest is known, so a duplicate is stored
+# and deleted again right after, only its storage is saved (clients that send
+# X-Content-SHA256 up front skip the transfer too, see routers/upload).
+import asyncio
+import hashlib
+import logging
+import time
+from typing import AsyncIterator, Optional
+
+from databases import Database
+from sqlalchemy.dialects import postgresql, sqlite
+
+from social_media_api import metrics
+from social_media_api.config import settings
+from social_media_api.database import (
+    database,
+    upload_parts,
+    upload_sessions,
+    uploaded_files,
+)
+from social_media_api.storage import storage
+
+logger = logging.getLogger(__name__)
+
+# resumable upload sessions, see routers/upload
+UPLOAD_OPEN = "open"
+UPLOAD_COMPLETE = "complete"
+UPLOAD_ABORTED = "aborted"
+UPLOAD_EXPIRED = "expired"
+
+
+async def find_uploaded_file(digest: str) -> Optional[str]:
+    query = uploaded_files.select().where(uploaded_files.c.digest == digest)
+    uploaded = await database.fetch_one(query)
+    if uploaded is None:
+        return None
+    metrics.increment("uploads.deduplicated")
+    metrics.increment("uploads.bytes_saved", uploaded.size)
+    return uploaded.file_url
+
+
+async def record_uploaded_file(digest: str, file_url: str, size: int) -> None:
+    # two uploads of the same new file may race, the first one wins
+    dialect = postgresql if database.url.dialect == "postgresql" else sqlite
+    query = (
+        dialect.insert(uploaded_files)
+        .values(digest=digest, file_url=file_url, size=size, created_at=time.time())
+        .on_conflict_do_nothing(index_elements=["digest"])
+    )
+    await database.execute(query)
+
+
+async def discard_duplicate(file_url: str, file_name: str) -> None:
+    try:
+        await asyncio.to_thread(storage.delete_file, file_url, file_name)
+    except Exception as e:
+        # only costs storage, the caller gets the existing file either way
+        logger.error(f"Deleting duplicate upload {file_url} failed: {e}")
+
+
+async def stream_upload(
+    chunks: AsyncIterator[bytes],
+    file_name: str,
+    content_type: Optional[str] = None,
+    part_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+) -> str:
+    part_size = part_size or settings.upload_part_size_bytes
+    slots = asyncio.Semaphore(concurrency or settings.upload_part_concurrency)
+    buffer = bytearray()
+    digest = hashlib.sha256()
+    size = 0
+    file_id: Optional[str] = None
+    parts: list[asyncio.Task] = []
+
+    async def send_part(number: int, data: bytes) -> str:
+        try:
+            sha1 = await asyncio.to_thread(storage.upload_part, file_id, number, data)
+        finally:
+            slots.release()
+        metrics.increment("uploads.parts")
+        metrics.increment("uploads.bytes", len(data))
+        return sha1
+
+    async def queue_part(data: bytes) -> None:
+        await slots.acquire()
+        # stop reading as soon as a part failed, the upload is lost anyway
+        for part in parts:
+            if part.done() and part.exception() is not None:
+                slots.release()
+                raise part.exception()
+        parts.append(asyncio.create_task(send_part(len(parts) + 1, data)))
+
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            digest.update(chunk)
+            size += len(chunk)
+            # strictly more than a part: a large file needs at least two parts
+            while len(buffer) > part_size:
+                if file_id is None:
+                    file_id = await asyncio.to_thread(
+                        storage.start_large_file, file_name, content_type
+                    )
+                await queue_part(bytes(buffer[:part_size]))
+                del buffer[:part_size]
+
+        if file_id is None:
+            if file_url := await find_uploaded_file(digest.hexdigest()):
+                return file_url
+            metrics.increment("uploads.bytes", len(buffer))
+            file_url = await asyncio.to_thread(
+                storage.upload_bytes, bytes(buffer), file_name, content_type
+            )
+        else:
+            await queue_part(bytes(buffer))
+            sha1s = await asyncio.gather(*parts)
+            logger.debug(f"Uploaded {file_name} in {len(sha1s)} parts")
+            file_url = await asyncio.to_thread(
+                storage.finish_large_file, file_id, sha1s
+            )
+    except BaseException:
+        # cancelling a part wouldn't stop its thread, which would go on sending
+        # to the cancelled large file; let the ones in flight finish first
+        await asyncio.gather(*parts, return_exceptions=True)
+        if file_id is not None:
+            logger.warning(f"Upload of {file_name} failed, cancelling large file")
+            try:
+                await asyncio.to_thread(storage.cancel_large_file, file_id)
+            except Exception as e:
+                logger.error(f"Cancelling large file {file_id} failed: {e}")
+        raise
+
+    if file_id is not None:
+        if existing_url := await find_uploaded_file(digest.hexdigest()):
+            await discard_duplicate(file_url, file_name)
+            return existing_url
+    await record_uploaded_file(digest.hexdigest(), file_url, size)
+    return file_url
+
+
+async def expire_upload_sessions(
+    database: Database, now: Optional[float] = None
+) -> int:
+    # resumable uploads that were left open: without this their parts stay in
+    # storage (and on the B2 bill) forever
+    now = time.time() if now is None else now
+    query = upload_sessions.select().where(
+        upload_sessions.c.status == UPLOAD_OPEN, upload_sessions.c.expires_at < now
+    )
+    expired = 0
+    for upload in await database.fetch_all(query):
+        try:
+            await asyncio.to_thread(storage.cancel_large_file, upload.b2_file_id)
+        except Exception as e:
+            # stays open, the next run tries again
+            logger.error(f"Cancelling expired upload {upload.id} failed: {e}")
+            continue
+        async with database.transaction():
+            await database.execute(
+                upload_parts.delete().where(upload_parts.c.upload_id == upload.id)
+            )
+            await database.execute(
+                upload_sessions.update()
+                .where(upload_sessions.c.id == upload.id)
+                .values(status=UPLOAD_EXPIRED)
+            )
+        expired += 1
+    if expired:
+        logger.info(f"Expired {expired} upload sessions")
+        metrics.increment("uploads.sessions_expired", expired)
+    return expired
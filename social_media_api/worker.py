@@ -0,0 +1,157 @@
+# Runs the durable background jobs from social_media_api.jobs.
+#
+#   python -m social_media_api.worker [--concurrency 8]
+#
+# Each worker runs up to job_worker_concurrency jobs at a time (and at most
+# JobSpec.concurrency of one kind), polling the jobs table when idle. SIGTERM
+# / SIGINT stop claiming new jobs and wait for the running ones to finish, so a
+# deploy doesn't cut image generations short; anything that doesn't finish is
+# picked up again once its lease runs out.
+import asyncio
+import json
+import logging
+import signal
+from collections import Counter
+from typing import Optional
+
+from databases import Database
+
+# tasks registers the job handlers
+from social_media_api import jobs, metrics, tasks  # noqa: F401
+from social_media_api.config import settings
+from social_media_api.database import database
+from social_media_api.email_outbox import email_outbox
+from social_media_api.http_clients import close_clients
+from social_media_api.images import image_processor
+from social_media_api.logging_conf import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorker:
+    def __init__(
+        self,
+        database: Database,
+        concurrency: int,
+        poll_interval: float,
+        visibility_timeout: float,
+    ):
+        self.database = database
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.running: Counter[str] = Counter()
+        self._tasks: set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+        self._slot_freed = asyncio.Event()
+
+        metrics.register_gauge("jobs.running", lambda: sum(self.running.values()))
+
+    def saturated_jobs(self) -> set[str]:
+        return {
+            name
+            for name, spec in jobs.JOBS.items()
+            if spec.concurrency is not None and self.running[name] >= spec.concurrency
+        }
+
+    async def run_job(self, job) -> None:
+        name = job["name"]
+        # run_job is its own task, so this is only seen by this job
+        jobs.current_job.set(job)
+        try:
+            spec = jobs.JOBS[name]
+            # never outlive the lease, past it another worker may run the job
+            await asyncio.wait_for(
+                spec.func(**json.loads(job["payload"])),
+                timeout=self.visibility_timeout,
+            )
+        except Exception as e:
+            logger.warning(f"Job {name} {job['id']} attempt {job['attempts']}: {e!r}")
+            await jobs.fail(self.database, job, repr(e))
+        else:
+            await jobs.complete(self.database, job)
+        finally:
+            self.running[name] -= 1
+            self._slot_freed.set()
+
+    async def claim_next(self) -> Optional[asyncio.Task]:
+        job = await jobs.claim(
+            self.database, self.visibility_timeout, self.saturated_jobs()
+        )
+        if job is None:
+            return None
+        # counted right away, so the next claim already sees the slot taken
+        self.running[job["name"]] += 1
+        task = asyncio.create_task(self.run_job(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def run_once(self) -> list[asyncio.Task]:
+        # claim as many jobs as there are free slots
+        started = []
+        while len(self._tasks) < self.concurrency:
+            task = await self.claim_next()
+            if task is None:
+                break
+            started.append(task)
+        return started
+
+    async def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Claiming jobs failed: {e}")
+            # sleep until a slot frees up, the poll interval passes or we stop
+            self._slot_freed.clear()
+            waiters = [
+                asyncio.create_task(self._slot_freed.wait()),
+                asyncio.create_task(self._stopping.wait()),
+            ]
+            await asyncio.wait(
+                waiters, timeout=self.poll_interval, return_when="FIRST_COMPLETED"
+            )
+            for waiter in waiters:
+                waiter.cancel()
+        if self._tasks:
+            logger.info(f"Waiting for {len(self._tasks)} running jobs")
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+
+async def main(concurrency: int) -> None:
+    configure_logging()
+    worker = JobWorker(
+        database,
+        concurrency=concurrency,
+        poll_interval=settings.job_poll_interval_seconds,
+        visibility_timeout=settings.job_visibility_timeout_seconds,
+    )
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+
+    await database.connect()
+    if settings.email_outbox_enabled:
+        await email_outbox.start()
+    try:
+        logger.info(f"Job worker started, concurrency {concurrency}")
+        await worker.run()
+    finally:
+        await database.disconnect()
+        await email_outbox.stop()
+        await close_clients()
+        image_processor.shutdown()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Background job worker")
+    parser.add_argument(
+        "--concurrency", type=int, default=settings.job_worker_concurrency
+    )
+    asyncio.run(main(parser.parse_args().concurrency))